@@ -0,0 +1,106 @@
+import os
+import time
+import pygame
+
+# Shared, process-wide image cache for the game assets.
+# Every file in the assets dir is decoded exactly once and packed into one or
+# more atlas pages. Sprites only keep subsurfaces (references) into the pages,
+# so creating a Monster or a Fireball doesn't touch the disk anymore.
+
+page_size = 512 # Width and max height of one atlas page in pixels.
+padding = 1 # Empty pixels between images to avoid bleeding when scaled.
+
+class Atlas(object):
+
+    def __init__(self, directory, page_size=page_size):
+        self.directory = directory
+        self.page_size = page_size
+        self.pages = []
+        self.images = {} # File name without extension -> subsurface.
+        self.sequences = {} # Cached frame lists, shared by all sprites.
+        self.files_loaded = 0
+
+        start = time.perf_counter()
+        self.load()
+        self.load_time = time.perf_counter() - start
+
+    def load(self):
+        has_display = pygame.display.get_surface() is not None
+        decoded = []
+        for name in sorted(os.listdir(self.directory)):
+            base, extension = os.path.splitext(name)
+            if extension.lower() != '.png':
+                continue
+            image = pygame.image.load(os.path.join(self.directory, name))
+            # Turn colorkeys and palettes into per pixel alpha.
+            if has_display:
+                image = image.convert_alpha()
+            else:
+                surface = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+                surface.fill((0, 0, 0, 0))
+                surface.blit(image, (0, 0))
+                image = surface
+            decoded.append((base, image))
+        self.files_loaded = len(decoded)
+
+        # Shelf packing, tallest images first so shelves stay tight.
+        decoded.sort(key=lambda item: (-item[1].get_height(), item[0]))
+        placements = []
+        page = 0
+        x = y = shelf_height = 0
+        for base, image in decoded:
+            w, h = image.get_size()
+            if x + w > self.page_size:
+                x = 0
+                y += shelf_height + padding
+                shelf_height = 0
+            if y + h > self.page_size:
+                page += 1
+                x = y = shelf_height = 0
+            placements.append((base, image, page, x, y))
+            x += w + padding
+            shelf_height = max(shelf_height, h)
+
+        # Blit images to pages. BLEND_RGBA_MAX onto a fully transparent page
+        # copies the pixels exactly, alpha included.
+        heights = [0] * (page + 1) if placements else []
+        for base, image, index, x, y in placements:
+            heights[index] = max(heights[index], y + image.get_height())
+        self.pages = [pygame.Surface((self.page_size, h), pygame.SRCALPHA)
+                      for h in heights]
+        for page_surface in self.pages:
+            page_surface.fill((0, 0, 0, 0))
+        for base, image, index, x, y in placements:
+            self.pages[index].blit(image, (x, y),
+                                   special_flags=pygame.BLEND_RGBA_MAX)
+
+        # Convert to display format when there is a display to convert to.
+        if has_display:
+            self.pages = [page_surface.convert_alpha()
+                          for page_surface in self.pages]
+
+        for base, image, index, x, y in placements:
+            self.images[base] = self.pages[index].subsurface(
+                pygame.Rect((x, y), image.get_size()))
+
+    # Single image by file name without extension, e.g. 'tile'.
+    def get(self, name):
+        return self.images[name]
+
+    # Numbered frame sequence, e.g. frames('robo', 0, 21) = robo0 ... robo20.
+    # The same list is returned for every call, sprites must not modify it.
+    def frames(self, prefix, first, last):
+        key = (prefix, first, last)
+        if key not in self.sequences:
+            self.sequences[key] = [self.images[prefix + str(i)]
+                                   for i in range(first, last)]
+        return self.sequences[key]
+
+    # Bytes of pixel data held by the atlas pages.
+    def memory_footprint(self):
+        return sum(page.get_pitch() * page.get_height() for page in self.pages)
+
+    def report(self):
+        return ("Assets: %d files in %d atlas page(s), %.1f KiB, loaded in %.1f ms"
+                % (self.files_loaded, len(self.pages),
+                   self.memory_footprint() / 1024, self.load_time * 1000))
@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import random
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Batch simulation runner for level balancing and regression testing.
+# Runs independent headless episodes on a process pool and streams results
+# back as soon as each episode finishes.
+# Run: python batch.py world1 --episodes 32 --steps 3600
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import roborun
+from atlas import Atlas
+
+game_dir = os.path.dirname(os.path.abspath(__file__))
+assets = os.path.join(game_dir, 'assets')
+
+# One episode to simulate. world is a template name (e.g. 'world1') or a
+# path to a world file, which is loaded compiled. Either inputs (a list of
+# roborun.Inputs, one per step) or policy is given. policy is called as
+# policy(world, rng) every step and returns Inputs; it must be a module level
+# function so it can be sent to the worker processes. Episode ends when
+# player wins or loses, or after max_steps.
+Episode = namedtuple('Episode', ['world', 'seed', 'inputs', 'policy',
+                                 'max_steps'],
+                     defaults=(0, None, None, 60 * 60))
+
+# Atlas is loaded once per worker process.
+worker_atlas = None
+
+def init_worker():
+    global worker_atlas
+    worker_atlas = Atlas(assets)
+
+def load_template(world):
+    template = getattr(roborun, world, None)
+    if isinstance(template, list):
+        return template
+    return roborun.levels.load_level(world)
+
+def run_episode(episode):
+    atlas = worker_atlas if worker_atlas is not None else Atlas(assets)
+    template = load_template(episode.world)
+    rng = random.Random(episode.seed)
+    world = roborun.World(template, atlas)
+    start = time.perf_counter()
+    steps = episode.max_steps
+    if episode.inputs is not None:
+        steps = min(steps, len(episode.inputs))
+    for i in range(steps):
+        if episode.inputs is not None:
+            inputs = episode.inputs[i]
+        else:
+            inputs = episode.policy(world, rng)
+        world.tick(inputs)
+        if world.won or world.lost:
+            break
+    elapsed = time.perf_counter() - start
+    return {
+        'world': episode.world,
+        'seed': episode.seed,
+        'steps': world.ticks,
+        'coins': world.coins_collected,
+        'coins_total': world.coins_total,
+        'deaths': roborun.lives - world.lives,
+        'lost': world.lost,
+        'won': world.won,
+        # Simulated seconds until door was reached, None if it wasn't.
+        'completion_time': world.ticks * roborun.fixed_dt if world.won else None,
+        'steps_per_sec': world.ticks / elapsed if elapsed > 0 else 0.0,
+    }
+
+# Run episodes on a pool of workers processes (default: one per CPU core).
+# Yields result dicts in the order the episodes finish.
+def run_batch(episodes, workers=None):
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker) as pool:
+        futures = [pool.submit(run_episode, episode) for episode in episodes]
+        for future in as_completed(futures):
+            yield future.result()
+
+# Aggregate statistics over result dicts.
+def summarize(results):
+    results = list(results)
+    completed = [r['completion_time'] for r in results if r['won']]
+    steps = sum(r['steps'] for r in results)
+    return {
+        'episodes': len(results),
+        'won': len(completed),
+        'lost': sum(1 for r in results if r['lost']),
+        'mean_coins': sum(r['coins'] for r in results) / max(1, len(results)),
+        'deaths': sum(r['deaths'] for r in results),
+        'mean_completion_time':
+            sum(completed) / len(completed) if completed else None,
+        'steps': steps,
+        # Steps per second of one worker, mean over episodes.
+        'mean_steps_per_sec':
+            sum(r['steps_per_sec'] for r in results) / max(1, len(results)),
+    }
+
+# Throughput of episodes run with 1 to max_workers workers. Yields
+# (workers, steps, seconds) for each.
+def scaling(episodes, max_workers):
+    for workers in range(1, max_workers + 1):
+        start = time.perf_counter()
+        steps = sum(result['steps'] for result in run_batch(episodes, workers))
+        yield workers, steps, time.perf_counter() - start
+
+# Example policy: run right, turn back now and then, jump and shoot at random.
+def random_policy(world, rng):
+    direction = rng.random()
+    return roborun.Inputs(direction < 0.2, direction >= 0.35,
+                          int(rng.random() < 0.05), int(rng.random() < 0.03))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=
+        "Run headless Roborun episodes in parallel with a random policy.")
+    parser.add_argument('world', help="world template name or world file")
+    parser.add_argument('--episodes', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=60 * 60,
+                        help="max steps per episode")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--scaling', action='store_true',
+                        help="report throughput with 1 to --workers workers "
+                             "(default: one per CPU core)")
+    args = parser.parse_args(argv)
+
+    episodes = [Episode(args.world, seed, policy=random_policy,
+                        max_steps=args.steps)
+                for seed in range(args.episodes)]
+    if args.scaling:
+        base = None
+        for workers, steps, elapsed in scaling(
+                episodes, args.workers or os.cpu_count() or 1):
+            rate = steps / elapsed
+            if base is None:
+                base = rate
+            print("%3d workers: %d steps in %.2f s = %.0f steps/s, %.2fx of "
+                  "1 worker, %.0f%% efficiency"
+                  % (workers, steps, elapsed, rate, rate / base,
+                     100 * rate / base / workers))
+        return
+    start = time.perf_counter()
+    results = []
+    for result in run_batch(episodes, args.workers):
+        results.append(result)
+        print("seed %4d: %5d steps, coins %d/%d, deaths %d, %s"
+              % (result['seed'], result['steps'], result['coins'],
+                 result['coins_total'], result['deaths'],
+                 'won' if result['won'] else
+                 'lost' if result['lost'] else 'timeout'))
+    elapsed = time.perf_counter() - start
+    summary = summarize(results)
+    print("%d episodes, %d won, %d lost, mean coins %.1f, "
+          "total %d steps in %.2f s = %.0f steps/s"
+          % (summary['episodes'], summary['won'], summary['lost'],
+             summary['mean_coins'], summary['steps'], elapsed,
+             summary['steps'] / elapsed))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
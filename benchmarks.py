@@ -0,0 +1,967 @@
+import gc
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import tracemalloc
+import argparse
+import platform
+
+# Performance benchmarks for Roborun.
+# Run: python benchmarks.py [name ...]   (no names = run all)
+# Regression suite: python benchmarks.py --record baseline.json
+#                   python benchmarks.py --compare baseline.json
+# Runs headless with the SDL dummy video driver unless one is already set.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+import roborun
+from atlas import Atlas
+from tilemap import TileChunks
+from collision import TileGrid, SpatialHash
+import levels
+import levelgen
+import reachability
+from preload import Preloader
+from snapshot import Snapshotter, SnapshotRing
+from replay import world_checksum
+from capture import FrameCapture, make_writer
+from hotreload import LevelWatcher
+from profiler import FrameProfiler
+
+game_dir = os.path.dirname(os.path.abspath(__file__))
+assets = os.path.join(game_dir, 'assets')
+
+def setup():
+    pygame.init()
+    window = pygame.display.set_mode(roborun.window_size)
+    return window, Atlas(assets)
+
+# World template of given size filled with random platforms, monsters and
+# coins. Only meant as a workload, not as a playable level.
+def synthetic_world(width, height, seed=0, platforms=0.2, monsters=0.02,
+                    coins=0.03):
+    rng = random.Random(seed)
+    rows = []
+    for y in range(height):
+        row = []
+        for x in range(width):
+            r = rng.random()
+            if y == height - 1 or r < platforms:
+                row.append('P')
+            elif r < platforms + monsters:
+                row.append('M')
+            elif r < platforms + monsters + coins:
+                row.append('C')
+            else:
+                row.append(' ')
+        rows.append(''.join(row))
+    rows[height - 2] = 'S' + rows[height - 2][1:]
+    return rows
+
+# Camera offsets panning once through the world, like Camera.state.topleft.
+def camera_path(world, frames):
+    world_width = len(world[0]) * roborun.tile_x
+    world_height = len(world) * roborun.tile_y
+    span_x = max(0, world_width - roborun.WIDTH)
+    span_y = max(0, world_height - roborun.HEIGHT)
+    for i in range(frames):
+        t = i / max(1, frames - 1)
+        yield pygame.Rect(-int(span_x * t), -int(span_y * t),
+                          world_width, world_height)
+
+def time_frames(function, frames):
+    start = time.perf_counter()
+    for i in range(frames):
+        function(i)
+    return (time.perf_counter() - start) / frames
+
+# Per tile blitting loop of update_window versus baked tile chunks.
+def bench_tiles(frames=300):
+    window, atlas = setup()
+    tile = atlas.get('tile')
+    worlds = [('world3', roborun.world3),
+              ('synthetic 300x100', synthetic_world(300, 100)),
+              ('synthetic 1000x200', synthetic_world(1000, 200))]
+    for name, world in worlds:
+        rects = []
+        chunks = TileChunks(tile, roborun.tile_x, roborun.tile_y)
+        for y, row in enumerate(world):
+            for x, element in enumerate(row):
+                if element == 'P':
+                    rects.append(pygame.Rect(x * roborun.tile_x,
+                                             y * roborun.tile_y,
+                                             roborun.tile_x, roborun.tile_y))
+                    chunks.add(x, y)
+        path = list(camera_path(world, frames))
+        blits = [0, 0]
+
+        def per_tile(i):
+            offset = path[i].topleft
+            for rect in rects:
+                window.blit(tile, rect.move(offset))
+            blits[0] += len(rects)
+
+        def chunked(i):
+            blits[1] += chunks.draw(window, path[i])
+
+        old = time_frames(per_tile, frames)
+        new = time_frames(chunked, frames)
+        print("tiles %-20s per tile: %7.3f ms %6d blits | chunks: %7.3f ms "
+              "%3d blits, %d bakes"
+              % (name, old * 1000, blits[0] // frames, new * 1000,
+                 blits[1] // frames, chunks.bakes))
+
+# Linear spritecollideany scan versus TileGrid queries on growing worlds.
+# Both must find the very same tile for every query.
+def bench_collision(queries=2000):
+    window, atlas = setup()
+    tile_image = atlas.get('tile')
+    rng = random.Random(1)
+    for width, height in [(60, 34), (200, 100), (500, 200), (1000, 400)]:
+        world = synthetic_world(width, height)
+        tiles = pygame.sprite.Group()
+        grid = TileGrid(roborun.tile_x, roborun.tile_y)
+        for y, row in enumerate(world):
+            for x, element in enumerate(row):
+                if element == 'P':
+                    tile = pygame.sprite.Sprite()
+                    tile.image = tile_image
+                    tile.rect = pygame.Rect(x * roborun.tile_x,
+                                            y * roborun.tile_y,
+                                            roborun.tile_x, roborun.tile_y)
+                    tiles.add(tile)
+                    grid.add(tile, x, y)
+        probes = []
+        for i in range(queries):
+            probe = pygame.sprite.Sprite()
+            probe.rect = pygame.Rect(
+                rng.randrange(-32, width * roborun.tile_x),
+                rng.randrange(-32, height * roborun.tile_y),
+                roborun.tile_x, roborun.tile_y)
+            probes.append(probe)
+        # Linear scans get slow, so time only a sample of them.
+        sample = probes[:max(20, queries * 200 // len(tiles))]
+        start = time.perf_counter()
+        expected = [pygame.sprite.spritecollideany(p, tiles) for p in sample]
+        linear = (time.perf_counter() - start) / len(sample)
+        start = time.perf_counter()
+        found = [grid.collide_any(p.rect) for p in probes]
+        indexed = (time.perf_counter() - start) / len(probes)
+        assert found[:len(sample)] == expected, "Grid query results differ."
+        print("collision %5d tiles   linear: %8.2f us/query | grid: %5.2f us/query"
+              % (len(tiles), linear * 1e6, indexed * 1e6))
+
+# Interaction checks of player and 10 fireballs against thousands of
+# moving monsters and coins: linear group scans versus the spatial hash.
+def bench_broadphase(frames=120):
+    rng = random.Random(2)
+    for count in [1000, 5000, 20000]:
+        world_width = 32 * count // 4
+        monsters = pygame.sprite.Group()
+        coins = pygame.sprite.Group()
+        entities = SpatialHash()
+        for i in range(count):
+            sprite = pygame.sprite.Sprite()
+            sprite.rect = pygame.Rect(rng.randrange(world_width),
+                                      rng.randrange(32 * 40), 32, 32)
+            if i % 2:
+                monsters.add(sprite)
+                entities.insert(sprite, 'monster')
+            else:
+                coins.add(sprite)
+                entities.insert(sprite, 'coin')
+        actors = []
+        for i in range(11):
+            actor = pygame.sprite.Sprite()
+            actor.rect = pygame.Rect(rng.randrange(world_width),
+                                     rng.randrange(32 * 40), 32, 32)
+            actors.append(actor)
+
+        def move(i):
+            step = 1 if (i // 60) % 2 else -1
+            for monster in monsters:
+                monster.rect.x += step
+                entities.move(monster)
+
+        def linear(i):
+            for actor in actors:
+                pygame.sprite.spritecollideany(actor, monsters)
+                pygame.sprite.spritecollideany(actor, coins)
+
+        def hashed(i):
+            for actor, contacts in entities.pairs(actors):
+                pass
+
+        update = time_frames(move, frames)
+        old = time_frames(linear, frames)
+        new = time_frames(hashed, frames)
+        print("broadphase %5d entities   linear queries: %7.3f ms/frame | "
+              "hash queries: %6.3f ms/frame, incremental updates: %6.3f ms/frame"
+              % (count, old * 1000, new * 1000, update * 1000))
+
+# Scripted input for headless runs: run right, sometimes left, jump and
+# shoot at random. Same seed gives the same inputs.
+def scripted_inputs(frames, seed=0):
+    rng = random.Random(seed)
+    inputs = []
+    for i in range(frames):
+        direction = [1, 1, 1, 0, 2, 1, 1, 0][(i // 45) % 8]
+        inputs.append(roborun.Inputs(direction == 0, direction == 1,
+                                     int(rng.random() < 0.05),
+                                     int(rng.random() < 0.04)))
+    return inputs
+
+# Simulation steps per second without any display.
+def bench_headless(frames=3000):
+    atlas = Atlas(assets)
+    inputs = scripted_inputs(frames)
+    worlds = [('world0', roborun.world0), ('world1', roborun.world1),
+              ('world3', roborun.world3),
+              ('synthetic 300x100', synthetic_world(300, 100))]
+    for name, template in worlds:
+        world = roborun.World(template, atlas)
+        start = time.perf_counter()
+        for frame_inputs in inputs:
+            world.step(roborun.fixed_dt, frame_inputs)
+        elapsed = time.perf_counter() - start
+        print("headless %-20s %8.0f steps/s (%d steps)"
+              % (name, world.ticks / elapsed, world.ticks))
+
+# World with count monsters patrolling in corridors between random walls.
+def monster_world(count, width=200, seed=0):
+    rng = random.Random(seed)
+    per_row = width // 4
+    rows = []
+    for corridor in range((count + per_row - 1) // per_row):
+        row = [' '] * width
+        row[0] = row[-1] = 'P'
+        for x in rng.sample(range(2, width - 2), width // 20):
+            row[x] = 'P'
+        free = [x for x in range(1, width - 1) if row[x] == ' ']
+        for x in rng.sample(free, min(per_row, count - corridor * per_row)):
+            row[x] = 'M'
+        rows.append(''.join(row))
+        rows.append('P' * width)
+    rows.append('S'.ljust(width))
+    rows.append('P' * width)
+    return rows
+
+# Monster updates with Monster sprites versus the NumPy MonsterArray.
+# Both must end up with monsters in the same places.
+def bench_monsters(steps=300):
+    atlas = Atlas(assets)
+    for count in [100, 1000, 10000]:
+        template = monster_world(count)
+        timings = []
+        positions = []
+        for vectorized in (False, True):
+            # Vectorized monsters don't sleep, so neither do these.
+            roborun.lod = False
+            try:
+                world = roborun.World(template, atlas, vectorized)
+            finally:
+                roborun.lod = True
+            idle = roborun.Inputs()
+            start = time.perf_counter()
+            for i in range(steps):
+                world.tick(idle)
+            timings.append((time.perf_counter() - start) / steps)
+            positions.append(sorted(tuple(monster.rect)
+                                    for monster in world.all_monsters))
+        assert positions[0] == positions[1], "Monster positions differ."
+        print("monsters %5d   sprites: %8.3f ms/step | numpy: %7.3f ms/step"
+              % (count, timings[0] * 1000, timings[1] * 1000))
+
+# Load time and peak memory of eager World versus StreamingWorld on level
+# files of growing width, plus streaming cost while running through them.
+def bench_streaming(steps=600):
+    atlas = Atlas(assets)
+    directory = tempfile.mkdtemp()
+    try:
+        for width in [300, 3000, 30000]:
+            template = synthetic_world(width, 34, platforms=0.05,
+                                       monsters=0.01, coins=0.02)
+            path = os.path.join(directory, 'level%d.level' % width)
+            levels.save_level(template, path)
+            results = []
+            for name in ('eager', 'streaming'):
+                tracemalloc.start()
+                start = time.perf_counter()
+                level_file = None
+                if name == 'eager':
+                    world = roborun.World(levels.read_template(path), atlas)
+                else:
+                    level_file = levels.LevelFile(path)
+                    world = roborun.StreamingWorld(level_file, atlas)
+                load = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                try:
+                    start = time.perf_counter()
+                    for i in range(steps):
+                        world.tick(roborun.Inputs(right=True))
+                    run = (time.perf_counter() - start) / steps
+                finally:
+                    if level_file is not None:
+                        level_file.close()
+                results.append((name, load, peak, run))
+            print("streaming %6d columns  " % width + " | ".join(
+                "%s: load %7.1f ms, peak %8.0f KiB, %.3f ms/step"
+                % (name, load * 1000, peak / 1024, run * 1000)
+                for name, load, peak, run in results))
+    finally:
+        shutil.rmtree(directory)
+
+# What generate_world gets out of an ASCII template, without the sprites.
+def parse_template(rows):
+    tiles = []
+    entities = []
+    for y, row in enumerate(rows):
+        for x, element in enumerate(row):
+            if element == 'P':
+                tiles.append((x, y))
+            elif element in 'MCD':
+                entities.append((element, x, y))
+    return tiles, entities
+
+# Time and peak memory of function(), measured in separate runs so that
+# tracemalloc doesn't slow down the timed run.
+def measure(function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+# ASCII world file parsing versus compiled levels, compiled on cache miss
+# and read from the cache on hit.
+def bench_levels():
+    directory = tempfile.mkdtemp()
+    for width, height in [(300, 34), (1000, 100), (10000, 1000)]:
+        path = os.path.join(directory, 'world%dx%d.txt' % (width, height))
+        with open(path, 'w') as f:
+            f.write('\n'.join(synthetic_world(width, height)))
+        cache = os.path.join(directory, 'cache%dx%d' % (width, height))
+        def ascii_parse():
+            parse_template(levels.read_template(path))
+        def compile_level():
+            shutil.rmtree(cache, ignore_errors=True)
+            levels.load_level(path, cache)
+        def cached_load():
+            levels.load_level(path, cache)
+        def cached_cells():
+            level = levels.load_level(path, cache)
+            list(level.tiles()), list(level.entity_list())
+        results = [(name, measure(function)) for name, function in
+                   [('ascii parse', ascii_parse), ('compile', compile_level),
+                    ('cached load', cached_load),
+                    ('cached + cells', cached_cells)]]
+        print("levels %5dx%-4d  " % (width, height) + " | ".join(
+            "%s: %8.1f ms, peak %8.0f KiB" % (name, elapsed * 1000, peak / 1024)
+            for name, (elapsed, peak) in results))
+        compiled = os.path.getsize(os.path.join(cache, os.listdir(cache)[0]))
+        print("    source %d KiB, compiled %d KiB"
+              % (os.path.getsize(path) // 1024, compiled // 1024))
+    shutil.rmtree(directory)
+
+# Game loop as in roborun.main, without profiler and with one, to see the
+# profiler overhead and where frame time goes.
+def bench_profile(frames=600):
+    window, atlas = setup()
+    inputs = scripted_inputs(frames)
+    for template_name in ('world1', 'world3'):
+        results = []
+        for name in ('off', 'on', 'on + overlay'):
+            world = roborun.World(getattr(roborun, template_name), atlas)
+            renderer = roborun.Renderer(window, world)
+            profiler = None
+            if name != 'off':
+                profiler = FrameProfiler(overlay=name == 'on + overlay')
+            world.profiler = renderer.profiler = profiler
+            start = time.perf_counter()
+            for frame_inputs in inputs:
+                if profiler is not None:
+                    profiler.begin_frame()
+                    profiler.mark('input')
+                renderer.camera.update(world.player)
+                world.step(roborun.fixed_dt, frame_inputs)
+                renderer.draw()
+                if profiler is not None:
+                    profiler.end_frame(roborun.fixed_dt, world, renderer)
+            results.append((name, (time.perf_counter() - start) / frames))
+        print("profile %-8s " % template_name + " | ".join(
+            "profiler %s: %.3f ms/frame" % (name, elapsed * 1000)
+            for name, elapsed in results))
+        print(profiler.report())
+        directory = tempfile.mkdtemp()
+        for extension in ('json', 'csv'):
+            path = os.path.join(directory, 'profile.' + extension)
+            profiler.export(path)
+            print("    %s export %d KiB" % (extension,
+                                            os.path.getsize(path) // 1024))
+        shutil.rmtree(directory)
+
+# HUD drawing: loading images and font every frame like the first version
+# of the game, blitting from the atlas every frame, and the cached HUD.
+def bench_hud(frames=600):
+    window, atlas = setup()
+    world = roborun.World(roborun.world1, atlas)
+    hud = roborun.HUD(world)
+    hud.add_widget((120, 44), lambda: world.ticks // 30, "FPS %d")
+    def draw_loaded(i):
+        for j in range(world.lives):
+            window.blit(pygame.image.load(os.path.join(
+                assets, 'heart.png')).convert_alpha(), (j * 20 + 4, 4))
+        window.blit(pygame.image.load(os.path.join(
+            assets, 'coin6.png')).convert_alpha(), (0, 16))
+        font = pygame.font.Font('freesansbold.ttf', 16)
+        text = font.render(str(world.coins_collected) + "/" +
+                           str(world.coins_total), True, roborun.WHITE)
+        window.blit(text, (32, 26))
+    font = roborun.get_font(16)
+    def draw_direct(i):
+        for j in range(world.lives):
+            window.blit(atlas.get('heart'), (j * 20 + 4, 4))
+        window.blit(atlas.get('coin6'), (0, 16))
+        text = font.render(str(world.coins_collected) + "/" +
+                           str(world.coins_total), True, roborun.WHITE)
+        window.blit(text, (32, 26))
+    def draw_cached(i):
+        # Lives or coins change every 100 frames, the widget every 30.
+        world.ticks = i
+        if i % 100 == 99:
+            world.coins_collected += 1
+        hud.draw(window)
+    for name, function in [('load per frame', draw_loaded),
+                           ('atlas per frame', draw_direct),
+                           ('cached', draw_cached)]:
+        print("hud %-16s %.4f ms/frame"
+              % (name, time_frames(function, frames) * 1000))
+    print("hud cached: %d renders in %d frames" % (hud.renders, frames))
+
+# Frame times while shooting, fireballs made on every shot versus taken
+# from the pool. Normal mode shoots now and then with the shoot_count cap of
+# the game, stress mode shoots bursts of 50 fireballs with a cap of 2000.
+def bench_fireballs(frames=1200):
+    atlas = Atlas(assets)
+    class Unpooled(roborun.Fireball):
+        kill = pygame.sprite.Sprite.kill
+    def shoot_new(world, player):
+        if world.shoot_count > 0:
+            world.shoot_count -= 1
+            fireball = Unpooled(world, roborun.fireball_speed,
+                                player.rect.x, player.rect.y - 1)
+            world.all_sprites.add(fireball)
+            world.all_fireballs.add(fireball)
+            if world.lod is not None:
+                world.lod.fireball_shot(fireball)
+    def shoot_pooled(world, player):
+        player.shoot_fireball()
+    for mode, cap, burst, every in [('normal', roborun.shoot_count, 1, 20),
+                                    ('stress', 2000, 50, 5)]:
+        results = []
+        for name, shoot in [('new', shoot_new), ('pooled', shoot_pooled)]:
+            world = roborun.World(synthetic_world(300, 40, platforms=0.01,
+                                                  monsters=0, coins=0), atlas)
+            world.shoot_count = cap
+            if name == 'pooled':
+                world.fireball_pool.reserve(cap)
+            player = world.player
+            # Time of shooting the burst and of the whole frame.
+            shots = []
+            times = []
+            gc.collect()
+            for i in range(frames):
+                start = time.perf_counter()
+                if i % every == 0:
+                    for j in range(burst):
+                        shoot(world, player)
+                    shots.append(time.perf_counter() - start)
+                world.tick(roborun.Inputs())
+                times.append(time.perf_counter() - start)
+            shots.sort()
+            times.sort()
+            results.append((name, shots[len(shots) // 2], shots[-1],
+                            times[int(frames * 0.99)], times[-1]))
+        print("fireballs %-6s " % mode + " | ".join(
+            "%s: burst p50 %.3f max %.3f ms, frame p99 %.3f max %.3f ms"
+            % (name, shot * 1000, shot_max * 1000, p99 * 1000, worst * 1000)
+            for name, shot, shot_max, p99, worst in results))
+        print("    pool made %d fireballs in total" % world.fireball_pool.created)
+
+# Memory per entity and step time on worlds full of coins.
+def bench_entities(steps=300):
+    atlas = Atlas(assets)
+    inputs = scripted_inputs(steps)
+    for coins in [1000, 10000, 50000]:
+        width = coins // 20
+        template = synthetic_world(width, 40, platforms=0.02, monsters=0.005,
+                                   coins=0.5)
+        sprites = sum(row.count('C') + row.count('M') + row.count('P')
+                      for row in template) + 1
+        gc.collect()
+        tracemalloc.start()
+        world = roborun.World(template, atlas)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for frame_inputs in inputs:
+            world.tick(frame_inputs)
+        elapsed = (time.perf_counter() - start) / steps
+        print("entities %6d coins (%6d sprites): %6.0f bytes/sprite, "
+              "%.3f ms/step" % (len(world.all_coins), sprites,
+                                memory / sprites, elapsed * 1000))
+
+# Generated levels of growing size: generating them, writing them to level
+# files, and World and StreamingWorld on them.
+def bench_levelgen(steps=300, height=100):
+    atlas = Atlas(assets)
+    inputs = scripted_inputs(steps)
+    directory = tempfile.mkdtemp()
+    for width in [1000, 10000, 100000]:
+        start = time.perf_counter()
+        template = levelgen.generate_level(width, height, seed=width)
+        generate = time.perf_counter() - start
+        path = os.path.join(directory, 'generated%d.level' % width)
+        start = time.perf_counter()
+        levelgen.write_generated(path, width, height, seed=width)
+        write = time.perf_counter() - start
+        results = ["generate %7.1f ms, write %7.1f ms"
+                   % (generate * 1000, write * 1000)]
+        for name in ('eager', 'streaming'):
+            if name == 'eager' and width * height > 1000000:
+                continue
+            start = time.perf_counter()
+            if name == 'eager':
+                world = roborun.World(template, atlas)
+            else:
+                world = roborun.StreamingWorld(levels.LevelFile(path), atlas)
+            load = time.perf_counter() - start
+            start = time.perf_counter()
+            for frame_inputs in inputs:
+                world.tick(frame_inputs)
+            run = (time.perf_counter() - start) / steps
+            results.append("%s: load %7.1f ms, %.3f ms/step"
+                           % (name, load * 1000, run * 1000))
+        del template
+        print("levelgen %6dx%d  " % (width, height) + " | ".join(results))
+    shutil.rmtree(directory)
+
+# Reachability analysis of generated levels of growing size, up to a million
+# cells. The arc trees are made once, before timing.
+def bench_reachability(height=100, seeds=200):
+    reachability.jump_arcs(reachability.game_physics())
+    for width in [100, 1000, 10000]:
+        template = levelgen.generate_level(width, height, seed=width)
+        start = time.perf_counter()
+        report = reachability.analyze(template)
+        elapsed = time.perf_counter() - start
+        print("reachability %6dx%d: %8.1f ms, %6d positions, %s"
+              % (width, height, elapsed * 1000, report.positions,
+                 'solvable' if report.solvable else 'NOT solvable'))
+    # Every generated level must be solvable, dense ones too: platforms 1.0
+    # fills all cells the generator doesn't keep clear for the path.
+    for density in [0.1, 0.5, 1.0]:
+        unsolvable = [seed for seed in range(seeds) if not reachability.analyze(
+            levelgen.generate_level(60, 14, seed, platforms=density)).solvable]
+        print("reachability platforms %.1f: %d of %d seeds unsolvable"
+              % (density, len(unsolvable), seeds))
+        assert not unsolvable, "Unsolvable seeds: %s" % unsolvable
+
+# Change of level: building the next level when the door is reached versus
+# preparing it on a worker thread while the current level keeps running.
+# Stall is the time the game loop can't draw frames at the swap, slowest
+# frame is the worst frame drawn while the worker was busy.
+def bench_transition(height=100):
+    window, atlas = setup()
+    inputs = roborun.Inputs(right=True)
+    for width in [100, 1000, 3000]:
+        template = levelgen.generate_level(width, height, seed=width)
+        start = time.perf_counter()
+        roborun.prepare_level(template, window, atlas)
+        built = time.perf_counter() - start
+        game, renderer = roborun.prepare_level(roborun.world0, window, atlas)
+        preloader = Preloader(
+            lambda: roborun.prepare_level(template, window, atlas))
+        frames = []
+        while not preloader.ready():
+            start = time.perf_counter()
+            renderer.camera.update(game.player, roborun.fixed_dt)
+            game.step(roborun.fixed_dt, inputs)
+            renderer.draw()
+            frames.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        preloader.get()
+        swap = time.perf_counter() - start
+        print("transition %5dx%d  built: stall %7.1f ms | preloaded in "
+              "%7.1f ms: stall %.3f ms, %3d frames meanwhile, slowest "
+              "%5.1f ms" % (width, height, built * 1000,
+                            preloader.build_time * 1000, swap * 1000,
+                            len(frames), max(frames, default=0) * 1000))
+
+# Batched environments with random actions, in env-steps per second, and
+# the time of resetting a world.
+def bench_env(steps=200):
+    # Imported here, env needs NumPy which the other benchmarks don't.
+    import env
+    atlas = Atlas(assets)
+    for vectorized in (False, True):
+        for num_envs in [1, 16, 64]:
+            environment = env.VectorEnv(roborun.world1, num_envs,
+                                        vectorized=vectorized, atlas=atlas)
+            rate = env.measure(environment, steps)
+            start = time.perf_counter()
+            environment.reset()
+            reset = (time.perf_counter() - start) / num_envs
+            print("env %2d x world1%s: %7.0f env-steps/s, reset %.3f ms/world"
+                  % (num_envs, ' vectorized' if vectorized else '', rate,
+                     reset * 1000))
+
+# Snapshot, restore and a rewind ring of 5 seconds at 60 FPS for growing
+# amounts of monsters, as many coins besides. Restoring puts back killed
+# monsters and coins too.
+def bench_snapshot(steps=300):
+    atlas = Atlas(assets)
+    for count in [100, 1000, 10000]:
+        template = monster_world(count)
+        rows = list(template)
+        rows[-2] = rows[-2][:1] + 'C' * min(count, len(rows[-2]) - 1)
+        world = roborun.World(rows, atlas)
+        snapshotter = Snapshotter(world)
+        first = snapshotter.capture()
+        ring = SnapshotRing(5 * roborun.FPS)
+        idle = roborun.Inputs()
+        capture = push = 0.0
+        for i in range(steps):
+            world.tick(idle)
+            start = time.perf_counter()
+            state = snapshotter.capture()
+            capture += time.perf_counter() - start
+            start = time.perf_counter()
+            ring.push(state)
+            push += time.perf_counter() - start
+        frames = len(ring)
+        nbytes = ring.nbytes
+        for sprite in world.all_monsters.sprites()[::2]:
+            sprite.kill()
+        for sprite in world.all_coins.sprites()[::2]:
+            sprite.kill()
+        start = time.perf_counter()
+        snapshotter.restore(first)
+        restart = time.perf_counter() - start
+        pop = 0.0
+        while len(ring):
+            start = time.perf_counter()
+            snapshotter.restore(ring.pop())
+            pop += time.perf_counter() - start
+        print("snapshot %5d monsters + %5d coins  capture %7.3f ms, push "
+              "%6.3f ms, rewind %7.3f ms/frame, restart %7.3f ms | %d frames "
+              "in %7.1f KiB (full %7.1f KiB)"
+              % (count, len(snapshotter.coins), capture / steps * 1000,
+                 push / steps * 1000, pop / frames * 1000, restart * 1000,
+                 frames, nbytes / 1024, frames * len(first) * 8 / 1024))
+
+# Holding the rewind key the way the game does: play with the player running
+# right through a row of coins and a snapshot pushed every step, then one
+# restore per frame back through the ring of rewind_seconds. The ring is
+# filled twice over first, so it doesn't reach back to the start of the
+# level where no monster sleeps yet. Rewinding must keep up with the frame
+# rate, 1 / FPS per frame on average.
+def bench_rewind():
+    atlas = Atlas(assets)
+    budget = roborun.fixed_dt
+    for count in [1000, 10000]:
+        rows = list(monster_world(count))
+        rows[-2] = rows[-2][:1] + 'C' * (len(rows[-2]) - 1)
+        world = roborun.World(rows, atlas)
+        snapshotter = Snapshotter(world)
+        ring = SnapshotRing(round(roborun.rewind_seconds * roborun.FPS))
+        inputs = roborun.Inputs(right=True)
+        for i in range(2 * ring.capacity):
+            world.tick(inputs)
+            ring.push(snapshotter.capture())
+        frames = []
+        # Garbage collection runs at random points, keep it out like the
+        # regression suite does.
+        gc.collect()
+        gc.disable()
+        try:
+            while len(ring):
+                start = time.perf_counter()
+                snapshotter.restore(ring.pop())
+                frames.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        snapshotter.close()
+        mean = sum(frames) / len(frames)
+        print("rewind %5d monsters: %6.3f ms/frame, slowest %6.3f ms, %d of "
+              "%d frames over the %.1f ms budget"
+              % (count, mean * 1000, max(frames) * 1000,
+                 sum(1 for frame in frames if frame > budget), len(frames),
+                 budget * 1000))
+        assert mean <= budget, "Rewinding is slower than the frame rate."
+
+# Monster level of detail on versus off in levels of growing width with the
+# same density of monsters, the player running right, and on with a
+# snapshot for rewinding taken every step like the game does. All must end
+# up in the same state.
+def bench_lod(steps=300):
+    atlas = Atlas(assets)
+    run = roborun.Inputs(right=True)
+    for width in [500, 2000, 8000]:
+        template = synthetic_world(width, 40, platforms=0.08, monsters=0.03)
+        timings = []
+        checksums = []
+        for use_lod, rewind in [(False, False), (True, False), (True, True)]:
+            roborun.lod = use_lod
+            try:
+                world = roborun.World(template, atlas)
+            finally:
+                roborun.lod = True
+            if rewind:
+                snapshotter = Snapshotter(world)
+                ring = SnapshotRing(round(roborun.rewind_seconds * roborun.FPS))
+            start = time.perf_counter()
+            for i in range(steps):
+                world.tick(run)
+                if rewind:
+                    ring.push(snapshotter.capture())
+            timings.append((time.perf_counter() - start) / steps)
+            if world.lod is not None and not rewind:
+                asleep = len(world.lod.sleeping)
+                checks = world.lod.checks / steps
+            checksums.append(world_checksum(world))
+        assert checksums[0] == checksums[1] == checksums[2], (
+            "Level of detail changed the game.")
+        print("lod %5d columns, %5d monsters   off: %7.3f ms/step | on: "
+              "%6.3f ms/step, %5d asleep, %5.1f checks/step | on, rewind: "
+              "%6.3f ms/step"
+              % (width, len(world.all_monsters), timings[0] * 1000,
+                 timings[1] * 1000, asleep, checks, timings[2] * 1000))
+
+# Frame capture while rendering world1 as fast as possible: game loop time
+# per frame without capture, with raw video and with PNG images, frames
+# dropped and the writer's throughput.
+def bench_capture(frames=300):
+    window, atlas = setup()
+    inputs = scripted_inputs(frames)
+    directory = tempfile.mkdtemp()
+    try:
+        for name, path in [('off', None),
+                           ('raw', os.path.join(directory, 'frames.raw')),
+                           ('png', os.path.join(directory, '%05d.png'))]:
+            world = roborun.World(roborun.world1, atlas)
+            renderer = roborun.Renderer(window, world)
+            capture = None
+            if path is not None:
+                capture = FrameCapture(make_writer(path), window.get_size())
+            start = time.perf_counter()
+            for frame_inputs in inputs:
+                renderer.camera.update(world.player, roborun.fixed_dt)
+                world.step(roborun.fixed_dt, frame_inputs)
+                renderer.draw()
+                if capture is not None:
+                    capture.frame(window)
+            elapsed = time.perf_counter() - start
+            line = "capture %-3s  %6.3f ms/frame" % (name,
+                                                     elapsed / frames * 1000)
+            if capture is not None:
+                capture.close()
+                line += "  %3d/%d dropped, writer %4.0f frames/s" % (
+                    capture.dropped, capture.frames,
+                    capture.written / capture.write_time)
+            print(line)
+    finally:
+        shutil.rmtree(directory)
+
+# Hot reload of one changed cell in world files of growing width, applying
+# the change only versus reading the file too, against building the world
+# again.
+def bench_reload(changes=50):
+    atlas = Atlas(assets)
+    directory = tempfile.mkdtemp()
+    try:
+        for width in [100, 1000, 10000]:
+            template = synthetic_world(width, 40)
+            path = os.path.join(directory, 'world%d.txt' % width)
+            with open(path, 'w') as f:
+                f.write('\n'.join(template))
+            world = roborun.World(template, atlas)
+            watcher = LevelWatcher(path, world)
+            rng = random.Random(0)
+            apply = read = 0.0
+            for i in range(changes):
+                rows = list(watcher.template)
+                x = rng.randrange(width)
+                y = rng.randrange(len(rows) - 2)
+                rows[y] = rows[y][:x] + rng.choice('PMC ') + rows[y][x + 1:]
+                with open(path, 'w') as f:
+                    f.write('\n'.join(rows))
+                start = time.perf_counter()
+                changed = levels.read_template(path)
+                read += time.perf_counter() - start
+                watcher.reload(changed)
+                apply += watcher.reload_time
+            start = time.perf_counter()
+            roborun.World(watcher.template, atlas)
+            rebuild = time.perf_counter() - start
+            print("reload %5d columns  apply %6.3f ms, with reading the file "
+                  "%7.3f ms | rebuild %8.2f ms"
+                  % (width, apply / changes * 1000,
+                     (apply + read) / changes * 1000, rebuild * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+# Regression suite. Every metric is a time in seconds (lower is better):
+# each function returns (seconds, units done) and is called until it has
+# been timed for at least minimum seconds, giving seconds per unit. The best
+# of repeat such runs is kept. Results can be recorded to a JSON file and
+# later runs compared against it.
+def run_suite(repeat=3, frames=300, minimum=0.2):
+    window, atlas = setup()
+    metrics = {}
+    def best(name, function):
+        times = []
+        for i in range(repeat):
+            # Garbage collection runs at random points, keep it out like
+            # timeit does.
+            gc.collect()
+            gc.disable()
+            try:
+                elapsed = units = 0
+                while elapsed < minimum:
+                    seconds, done = function()
+                    elapsed += seconds
+                    units += done
+            finally:
+                gc.enable()
+            times.append(elapsed / units)
+        metrics[name] = min(times)
+        print("%-32s %10.3f ms" % (name, metrics[name] * 1000))
+
+    best('atlas/load', lambda: (Atlas(assets).load_time, 1))
+
+    inputs = scripted_inputs(frames)
+    worlds = [('world0', roborun.world0), ('world1', roborun.world1),
+              ('world2', roborun.world2), ('world3', roborun.world3),
+              ('synthetic 300x100', synthetic_world(300, 100)),
+              ('synthetic 1000x200', synthetic_world(1000, 200))]
+    for name, template in worlds:
+        def generate():
+            start = time.perf_counter()
+            roborun.World(template, atlas)
+            return time.perf_counter() - start, 1
+        # Fixed steps with scripted input.
+        def step():
+            world = roborun.World(template, atlas)
+            start = time.perf_counter()
+            for frame_inputs in inputs:
+                world.tick(frame_inputs)
+            return time.perf_counter() - start, frames
+        # Renderer.draw calls while the world runs.
+        def render():
+            world = roborun.World(template, atlas)
+            renderer = roborun.Renderer(window, world)
+            elapsed = 0.0
+            for frame_inputs in inputs:
+                renderer.camera.update(world.player)
+                world.tick(frame_inputs)
+                start = time.perf_counter()
+                renderer.draw()
+                elapsed += time.perf_counter() - start
+            return elapsed, frames
+        best('generate/' + name, generate)
+        best('step/' + name, step)
+        best('render/' + name, render)
+    return metrics
+
+def record(metrics, path):
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(),
+                   'pygame': pygame.version.ver,
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'metrics': metrics}, f, indent=1, sort_keys=True)
+
+# Compare metrics against a recorded baseline file. Metrics slower than the
+# baseline by more than threshold (0.1 = 10 %) are regressions, their names
+# are returned.
+def compare(metrics, path, threshold=0.1):
+    with open(path) as f:
+        baseline = json.load(f)['metrics']
+    regressions = []
+    for name in sorted(set(metrics) | set(baseline)):
+        if name not in metrics or name not in baseline:
+            print("%-32s only in %s" % (
+                name, 'baseline' if name in baseline else 'this run'))
+            continue
+        ratio = metrics[name] / baseline[name] if baseline[name] else 1.0
+        status = ''
+        if ratio > 1 + threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            status = 'faster'
+        print("%-32s %10.3f ms -> %10.3f ms %+7.1f %%  %s"
+              % (name, baseline[name] * 1000, metrics[name] * 1000,
+                 (ratio - 1) * 100, status))
+    print("%d regressions beyond %.0f %%" % (len(regressions), threshold * 100))
+    return regressions
+
+benchmarks = {
+    'tiles': bench_tiles,
+    'collision': bench_collision,
+    'broadphase': bench_broadphase,
+    'headless': bench_headless,
+    'monsters': bench_monsters,
+    'streaming': bench_streaming,
+    'levels': bench_levels,
+    'profile': bench_profile,
+    'hud': bench_hud,
+    'fireballs': bench_fireballs,
+    'entities': bench_entities,
+    'levelgen': bench_levelgen,
+    'reachability': bench_reachability,
+    'transition': bench_transition,
+    'env': bench_env,
+    'snapshot': bench_snapshot,
+    'rewind': bench_rewind,
+    'lod': bench_lod,
+    'capture': bench_capture,
+    'reload': bench_reload,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+        "Roborun benchmarks. Without options runs the named benchmarks "
+        "(default: all). --record and --compare run the regression suite.")
+    parser.add_argument('names', nargs='*', help="benchmarks to run: "
+                        + ", ".join(benchmarks))
+    parser.add_argument('--record', metavar='FILE',
+                        help="run suite and write results to FILE")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="run suite and compare against results in FILE")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="slowdown counted as regression (default 0.1)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="suite runs per metric, best is kept")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in benchmarks:
+            parser.error("unknown benchmark: " + name)
+    if args.record or args.compare:
+        metrics = run_suite(args.repeat)
+        if args.record:
+            record(metrics, args.record)
+        if args.compare and compare(metrics, args.compare, args.threshold):
+            sys.exit(1)
+    else:
+        for name in args.names or list(benchmarks):
+            benchmarks[name]()
@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import zlib
+import queue
+import struct
+import threading
+
+import pygame
+
+# Frame capture, for bug reports and level previews.
+# FrameCapture copies every finished frame into a surface from a small pool
+# and hands that to a writer thread through a bounded queue. The writer
+# writes the pixels straight from the surface's buffer, so frames are not
+# converted or copied again on the way. If the writer falls behind and no
+# surface is free the frame is dropped (and counted) instead of stalling
+# the game loop, unless wait is set, as for replays.
+# Works without a display too: capture the surface a Renderer draws on, see
+# replay.py --capture.
+#
+# Outputs:
+#   RawWriter: raw video, the pixels of every frame one after another with
+#       no header, to a file or to a pipe ('-' is stdout). The pixel format
+#       name for ffmpeg is in pixel_format, e.g.
+#       python replay.py rec.rrr --capture - | ffmpeg -f rawvideo
+#           -pix_fmt bgr0 -s 960x544 -r 60 -i - preview.mp4
+#   ImageWriter: numbered image files, path has a %d for the frame number,
+#       e.g. frames/%05d.png, image format by extension (see
+#       pygame.image.save). PNG files are compressed with zlib here, which
+#       unlike pygame.image.save lets the game loop run meanwhile.
+
+pool_size = 4 # Surfaces a frame can wait in for the writer.
+
+# ffmpeg name of the pixel format of a 32 bit surface's bytes, e.g. bgr0.
+def pixel_format(surface):
+    letters = ['0'] * 4
+    for letter, mask, shift in zip('rgba', surface.get_masks(),
+                                   surface.get_shifts()):
+        if mask:
+            letters[shift // 8] = letter
+    if sys.byteorder == 'big':
+        letters.reverse()
+    return ''.join(letters)
+
+class RawWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        if path == '-':
+            self.file = sys.stdout.buffer
+        else:
+            self.file = open(path, 'wb')
+
+    def write(self, number, surface):
+        view = surface.get_view('0')
+        self.file.write(view)
+        # Unlocks the surface.
+        view = None
+
+    def close(self):
+        if self.file is sys.stdout.buffer:
+            self.file.flush()
+        else:
+            self.file.close()
+
+class ImageWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, number, surface):
+        path = self.path % number
+        if path.lower().endswith('.png'):
+            with open(path, 'wb') as f:
+                f.write(encode_png(surface))
+        else:
+            pygame.image.save(surface, path)
+
+    def close(self):
+        pass
+
+def png_chunk(kind, data):
+    return (struct.pack('>I', len(data)) + kind + data +
+            struct.pack('>I', zlib.crc32(kind + data)))
+
+# PNG file of surface, RGB without filtering.
+def encode_png(surface, level=6):
+    width, height = surface.get_size()
+    pixels = pygame.image.tobytes(surface, 'RGB')
+    stride = 3 * width
+    # Every row starts with its filter type, 0 for none.
+    rows = b''.join(b'\0' + pixels[i:i + stride]
+                    for i in range(0, len(pixels), stride))
+    return (b'\x89PNG\r\n\x1a\n' +
+            png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                           0, 0, 0)) +
+            png_chunk(b'IDAT', zlib.compress(rows, level)) +
+            png_chunk(b'IEND', b''))
+
+# Writer for path: images if it has a %d in it, otherwise raw video.
+def make_writer(path):
+    if '%' in path:
+        return ImageWriter(path)
+    return RawWriter(path)
+
+class FrameCapture(object):
+
+    # Captures frames of size (width, height) to writer (see make_writer).
+    def __init__(self, writer, size, pool_size=pool_size, wait=False):
+        self.writer = writer
+        self.size = size
+        self.wait = wait
+        surfaces = [pygame.Surface(size, 0, 32) for i in range(pool_size)]
+        self.pixel_format = pixel_format(surfaces[0])
+        self.free = queue.Queue()
+        for surface in surfaces:
+            self.free.put(surface)
+        self.queue = queue.Queue(pool_size) # (frame number, surface).
+        self.frames = 0 # Frames offered, dropped ones included.
+        self.dropped = 0
+        self.written = 0
+        self.nbytes = 0 # Pixel bytes written.
+        self.copy_time = 0.0 # Game thread, copying frames to the pool.
+        self.wait_time = 0.0 # Game thread, waiting for a free surface.
+        self.write_time = 0.0 # Writer thread, writing frames.
+        self.error = None
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread = threading.Thread(target=self.run, name='capture',
+                                       daemon=True)
+        self.thread.start()
+
+    # Capture window (any surface of size) as the next frame. Returns False
+    # if the frame was dropped.
+    def frame(self, window):
+        number = self.frames
+        self.frames += 1
+        start = time.perf_counter()
+        try:
+            surface = self.free.get(self.wait)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        copied = time.perf_counter()
+        self.wait_time += copied - start
+        surface.blit(window, (0, 0))
+        self.copy_time += time.perf_counter() - copied
+        self.queue.put((number, surface))
+        return True
+
+    def run(self):
+        writer = self.writer
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            number, surface = item
+            # After an error, which close() raises, frames are not written.
+            if self.error is None:
+                start = time.perf_counter()
+                try:
+                    writer.write(number, surface)
+                except Exception as error:
+                    self.error = error
+                else:
+                    self.write_time += time.perf_counter() - start
+                    self.written += 1
+                    self.nbytes += surface.get_height() * surface.get_pitch()
+            self.free.put(surface)
+
+    # Write frames still in the queue and finish. Errors of the writer are
+    # raised here, on the calling thread.
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.end = time.perf_counter()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        elapsed = (self.end or time.perf_counter()) - self.start
+        frames = max(1, self.frames)
+        return ("Captured %d of %d frames (%d dropped) to %s: %.1f MB of pixels, "
+                "%.0f frames/s written, %.2f ms/frame copying, %.2f ms/frame "
+                "waiting, writer busy %.0f%%"
+                % (self.written, self.frames, self.dropped, self.writer.path,
+                   self.nbytes / 1e6,
+                   self.written / self.write_time if self.write_time else 0.0,
+                   self.copy_time / frames * 1000,
+                   self.wait_time / frames * 1000,
+                   100 * self.write_time / elapsed if elapsed > 0 else 0.0))
@@ -0,0 +1,186 @@
+# Spatial index for the static platform tiles.
+# The world is a uniform grid of tile_x * tile_y cells, so the tiles a rect
+# overlaps are found by looking up only the cells the rect covers instead of
+# scanning every tile like pygame.sprite.spritecollideany does.
+
+class TileGrid(object):
+
+    def __init__(self, tile_x, tile_y):
+        self.tile_x = tile_x
+        self.tile_y = tile_y
+        self.cells = {} # Grid cell (x, y) -> Tile sprite.
+        self.queries = 0 # Total amount of queries, for measuring.
+
+    def __len__(self):
+        return len(self.cells)
+
+    # Index tile at grid cell (x, y), coordinates in tiles.
+    def add(self, tile, x, y):
+        self.cells[(x, y)] = tile
+
+    def remove(self, x, y):
+        return self.cells.pop((x, y), None)
+
+    def get(self, x, y):
+        return self.cells.get((x, y))
+
+    def clear(self):
+        self.cells.clear()
+
+    # Range of cells covered by rect.
+    def span(self, rect):
+        return (rect.left // self.tile_x, (rect.right - 1) // self.tile_x,
+                rect.top // self.tile_y, (rect.bottom - 1) // self.tile_y)
+
+    # First tile colliding with rect or None. Cells are scanned row by row,
+    # left to right, which is the order generate_world adds tiles to
+    # all_tiles, so the result is the same tile spritecollideany would give.
+    def collide_any(self, rect):
+        self.queries += 1
+        left, right, top, bottom = self.span(rect)
+        cells = self.cells
+        for y in range(top, bottom + 1):
+            for x in range(left, right + 1):
+                tile = cells.get((x, y))
+                if tile is not None and rect.colliderect(tile.rect):
+                    return tile
+        return None
+
+    # All tiles colliding with rect, in the same order as collide_any.
+    def collide_all(self, rect):
+        self.queries += 1
+        left, right, top, bottom = self.span(rect)
+        cells = self.cells
+        tiles = []
+        for y in range(top, bottom + 1):
+            for x in range(left, right + 1):
+                tile = cells.get((x, y))
+                if tile is not None and rect.colliderect(tile.rect):
+                    tiles.append(tile)
+        return tiles
+
+# Broad-phase for the moving and collectable entities (monsters, coins,
+# doors). Entities are hashed to square cells of cell_size pixels and
+# re-hashed only when they move to other cells. Actors (player, fireballs)
+# are matched against entities of the cells they cover.
+
+cell_size = 64 # Pixels per spatial hash cell side.
+
+class SpatialHash(object):
+
+    def __init__(self, cell_size=cell_size):
+        self.cell_size = cell_size
+        self.buckets = {} # Cell (x, y) -> set of sprites.
+        self.spans = {} # Sprite -> covered cell span.
+        self.kinds = {} # Sprite -> kind, e.g. 'monster'.
+        self.order = {} # Sprite -> insertion number.
+        self.counter = 0
+        self.checks = 0 # Narrow phase rect checks, for measuring.
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __contains__(self, sprite):
+        return sprite in self.spans
+
+    def span(self, rect):
+        size = self.cell_size
+        return (rect.left // size, (rect.right - 1) // size,
+                rect.top // size, (rect.bottom - 1) // size)
+
+    def cells(self, span):
+        left, right, top, bottom = span
+        for y in range(top, bottom + 1):
+            for x in range(left, right + 1):
+                yield (x, y)
+
+    def insert(self, sprite, kind):
+        span = self.span(sprite.rect)
+        self.spans[sprite] = span
+        self.kinds[sprite] = kind
+        self.order[sprite] = self.counter
+        self.counter += 1
+        for cell in self.cells(span):
+            self.buckets.setdefault(cell, set()).add(sprite)
+
+    # Update sprite's cells after it moved. Costs only a span comparison
+    # when the sprite stays inside the same cells.
+    def move(self, sprite):
+        old = self.spans.get(sprite)
+        if old is None:
+            return
+        new = self.span(sprite.rect)
+        if new == old:
+            return
+        for cell in self.cells(old):
+            self.buckets[cell].discard(sprite)
+            if not self.buckets[cell]:
+                del self.buckets[cell]
+        for cell in self.cells(new):
+            self.buckets.setdefault(cell, set()).add(sprite)
+        self.spans[sprite] = new
+
+    def remove(self, sprite):
+        span = self.spans.pop(sprite, None)
+        if span is None:
+            return
+        for cell in self.cells(span):
+            self.buckets[cell].discard(sprite)
+            if not self.buckets[cell]:
+                del self.buckets[cell]
+        del self.kinds[sprite]
+        del self.order[sprite]
+
+    def clear(self):
+        self.buckets.clear()
+        self.spans.clear()
+        self.kinds.clear()
+        self.order.clear()
+
+    # First colliding entity of each kind for rect, as a dict kind -> sprite.
+    # "First" means earliest inserted, which matches the result of
+    # spritecollideany on a group the entities were added to in that order.
+    def contacts(self, rect):
+        found = {}
+        seen = set()
+        order = self.order
+        kinds = self.kinds
+        buckets = self.buckets
+        for cell in self.cells(self.span(rect)):
+            bucket = buckets.get(cell)
+            if bucket is None:
+                continue
+            for sprite in bucket:
+                if sprite in seen:
+                    continue
+                seen.add(sprite)
+                self.checks += 1
+                if not rect.colliderect(sprite.rect):
+                    continue
+                kind = kinds[sprite]
+                current = found.get(kind)
+                if current is None or order[sprite] < order[current]:
+                    found[kind] = sprite
+        return found
+
+    # Entities of given kinds colliding with rect, in insertion order.
+    def query(self, rect, kinds=None):
+        found = set()
+        buckets = self.buckets
+        for cell in self.cells(self.span(rect)):
+            bucket = buckets.get(cell)
+            if bucket is not None:
+                found.update(bucket)
+        kind_of = self.kinds
+        hits = [sprite for sprite in found
+                if (kinds is None or kind_of[sprite] in kinds)
+                and rect.colliderect(sprite.rect)]
+        hits.sort(key=self.order.__getitem__)
+        return hits
+
+    # One pass over actors, yielding (actor, contacts) pairs. Contacts are
+    # computed when the pair is requested, so removals done while handling
+    # earlier pairs are already visible to later actors.
+    def pairs(self, actors):
+        for actor in actors:
+            yield actor, self.contacts(actor.rect)
@@ -0,0 +1,248 @@
+import os
+import time
+
+import numpy as np
+
+# Batched environment for training and evaluating bots, needs NumPy.
+# Runs num_envs headless Worlds of the same level in one process. Each step
+# takes one action per world and returns observations, rewards and done
+# flags as NumPy arrays, which are allocated once and filled in place on
+# every step (the returned arrays are overwritten by the next step, copy
+# them to keep them).
+# Observations are a window of view_height x view_width cells around the
+# robot with one channel per kind of thing: tiles, monsters, coins and
+# doors (1 closed, 2 open). Tiles are copied from a padded bitmap of the
+# level, one read-only bitmap for all worlds; a world whose tiles change
+# (see World.tile_listeners) gets its own copy. The rest come from the
+# spatial hash cells covering the window.
+# Finished worlds (won, lost or out of steps) are reset right away by
+# restoring a snapshot of them at the start (see snapshot.py) instead of
+# making them again; what happened in them is in finished after the step.
+# Run: python env.py [world1 | world file] [--envs K] [--steps N]
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import roborun
+from atlas import Atlas
+from snapshot import Snapshotter
+
+game_dir = os.path.dirname(os.path.abspath(__file__))
+assets = os.path.join(game_dir, 'assets')
+
+view_width = 21 # Cells in an observation, robot in the middle.
+view_height = 15
+channels = {'tile': 0, 'monster': 1, 'coin': 2, 'door': 3}
+
+# Rewards.
+coin_reward = 1.0 # Coin collected.
+life_reward = -1.0 # Life lost, falling out of the world loses all of them.
+door_reward = 10.0 # Door reached.
+
+# Inputs of each action: 0 stand, 1 left, 2 right, plus 3 to jump and 6 to
+# shoot, e.g. 5 is jump to the right.
+actions = [roborun.Inputs(move == 1, move == 2, jump, shoot)
+           for shoot in (0, 1) for jump in (0, 1) for move in (0, 1, 2)]
+# Jumps and shots are key presses, they are only given on the first tick.
+held_actions = [roborun.Inputs(inputs.left, inputs.right)
+                for inputs in actions]
+
+class VectorEnv(object):
+
+    # template is a world template or a CompiledLevel. Each step runs
+    # repeat fixed ticks with the same action. Episodes end after max_steps
+    # steps at the latest.
+    def __init__(self, template, num_envs=8, repeat=1, max_steps=60 * 60,
+                 vectorized=False, atlas=None):
+        self.template = template
+        self.num_envs = num_envs
+        self.repeat = repeat
+        self.max_steps = max_steps
+        self.vectorized = vectorized
+        self.atlas = atlas if atlas is not None else Atlas(assets)
+        self.worlds = [None] * num_envs
+        self.snapshotters = [None] * num_envs
+        self.starts = [None] * num_envs # Snapshots of the worlds at the start.
+        self.steps = [0] * num_envs # Steps of the current episodes.
+        self.returns = [0.0] * num_envs # Rewards of the current episodes.
+        self.finished = [] # Results of episodes ended by the last step.
+        self.total_steps = 0
+
+        self.observations = np.zeros(
+            (num_envs, len(channels), view_height, view_width), dtype=np.uint8)
+        self.rewards = np.zeros(num_envs, dtype=np.float32)
+        self.dones = np.zeros(num_envs, dtype=bool)
+
+        # Tile bitmap of the level, padded so the window around the robot
+        # never goes outside of it. Made from the first world and shared by
+        # all of them, read-only. solid has the bitmap of each world, the
+        # shared one until the world's tiles change.
+        self.pad_x = view_width
+        self.pad_y = view_height
+        self.level_solid = None
+        self.solid = [None] * num_envs
+
+    # Start new episodes in all worlds. Returns the observations.
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_world(i)
+            self.observe(i)
+        self.finished = []
+        return self.observations
+
+    def reset_world(self, i):
+        if self.worlds[i] is not None and self.solid[i] is self.level_solid:
+            self.snapshotters[i].restore(self.starts[i])
+        else:
+            # First episode, or the world's tiles changed, which snapshots
+            # don't cover.
+            if self.snapshotters[i] is not None:
+                self.snapshotters[i].close()
+            world = roborun.World(self.template, self.atlas, self.vectorized)
+            if self.level_solid is None:
+                self.level_solid = self.make_solid(world)
+            self.solid[i] = self.level_solid
+            world.tile_listeners.append(
+                lambda x, y, added: self.tile_changed(i, x, y, added))
+            self.worlds[i] = world
+            self.snapshotters[i] = Snapshotter(world)
+            self.starts[i] = self.snapshotters[i].capture()
+        self.steps[i] = 0
+        self.returns[i] = 0.0
+
+    # Read-only padded tile bitmap of world.
+    def make_solid(self, world):
+        solid = np.zeros((world.height // roborun.tile_y + 2 * self.pad_y,
+                          world.width // roborun.tile_x + 2 * self.pad_x),
+                         dtype=np.uint8)
+        for x, y in world.tile_grid.cells:
+            solid[y + self.pad_y, x + self.pad_x] = 1
+        solid.setflags(write=False)
+        return solid
+
+    def tile_changed(self, i, x, y, added):
+        solid = self.solid[i]
+        if solid is self.level_solid:
+            solid = self.solid[i] = self.level_solid.copy()
+        row = y + self.pad_y
+        col = x + self.pad_x
+        if 0 <= row < solid.shape[0] and 0 <= col < solid.shape[1]:
+            solid[row, col] = added
+
+    # Fill observation of world i.
+    def observe(self, i):
+        world = self.worlds[i]
+        observation = self.observations[i]
+        solid = self.solid[i]
+        center_x, center_y = world.player.rect.center
+        # Top left cell of the window, kept inside the padded bitmap.
+        left = center_x // roborun.tile_x - view_width // 2
+        top = center_y // roborun.tile_y - view_height // 2
+        col = min(max(left + self.pad_x, 0), solid.shape[1] - view_width)
+        row = min(max(top + self.pad_y, 0), solid.shape[0] - view_height)
+        left = col - self.pad_x
+        top = row - self.pad_y
+        observation[0] = solid[row:row + view_height, col:col + view_width]
+        observation[1:] = 0
+
+        # Entities from the spatial hash cells covering the window.
+        entity_hash = world.entity_hash
+        buckets = entity_hash.buckets
+        kinds = entity_hash.kinds
+        size = entity_hash.cell_size
+        first_x = left * roborun.tile_x // size
+        last_x = ((left + view_width) * roborun.tile_x - 1) // size
+        first_y = top * roborun.tile_y // size
+        last_y = ((top + view_height) * roborun.tile_y - 1) // size
+        for cell_y in range(first_y, last_y + 1):
+            for cell_x in range(first_x, last_x + 1):
+                bucket = buckets.get((cell_x, cell_y))
+                if bucket is None:
+                    continue
+                for sprite in bucket:
+                    x, y = sprite.rect.center
+                    x = x // roborun.tile_x - left
+                    y = y // roborun.tile_y - top
+                    if 0 <= x < view_width and 0 <= y < view_height:
+                        kind = kinds[sprite]
+                        if kind == 'door':
+                            observation[3, y, x] = 1 + sprite.is_open
+                        else:
+                            observation[channels[kind], y, x] = 1
+
+    # Take one action per world, a sequence of num_envs action numbers (see
+    # actions). Returns observations, rewards and dones.
+    def step(self, action_numbers):
+        rewards = self.rewards
+        dones = self.dones
+        self.finished = []
+        for i in range(self.num_envs):
+            world = self.worlds[i]
+            action = int(action_numbers[i])
+            coins = world.coins_collected
+            lives = world.lives
+            world.tick(actions[action])
+            for tick in range(1, self.repeat):
+                if world.won or world.lost:
+                    break
+                world.tick(held_actions[action])
+            reward = (coin_reward * (world.coins_collected - coins) +
+                      life_reward * (lives - world.lives))
+            if world.won:
+                reward += door_reward
+            elif world.lost:
+                reward += life_reward * max(0, world.lives)
+            self.steps[i] += 1
+            self.returns[i] += reward
+            rewards[i] = reward
+            done = (world.won or world.lost or
+                    self.steps[i] >= self.max_steps)
+            dones[i] = done
+            if done:
+                self.finished.append({
+                    'env': i,
+                    'steps': self.steps[i],
+                    'return': self.returns[i],
+                    'coins': world.coins_collected,
+                    'coins_total': world.coins_total,
+                    'won': world.won,
+                    'lost': world.lost,
+                })
+                self.reset_world(i)
+            self.observe(i)
+        self.total_steps += self.num_envs
+        return self.observations, rewards, dones
+
+# Run env with random actions. Returns env-steps per second.
+def measure(env, steps, seed=0):
+    rng = np.random.default_rng(seed)
+    action_numbers = np.zeros(env.num_envs, dtype=np.int64)
+    env.reset()
+    start = time.perf_counter()
+    for i in range(steps):
+        action_numbers[...] = rng.integers(0, len(actions), env.num_envs)
+        env.step(action_numbers)
+    elapsed = time.perf_counter() - start
+    return env.num_envs * steps / elapsed
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Run batched Roborun environments with random actions and report "
+        "the throughput.")
+    parser.add_argument('world', nargs='?', default='world1',
+                        help="world template name or world file")
+    parser.add_argument('--envs', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="fixed ticks per step")
+    parser.add_argument('--vectorized', action='store_true',
+                        help="simulate monsters with NumPy arrays")
+    args = parser.parse_args()
+    template = getattr(roborun, args.world, None)
+    if not isinstance(template, list):
+        template = roborun.levels.load_level(args.world)
+    env = VectorEnv(template, args.envs, args.repeat,
+                    vectorized=args.vectorized)
+    rate = measure(env, args.steps)
+    print("%d envs x %d steps: %.0f env-steps/s (%.0f ticks/s)"
+          % (args.envs, args.steps, rate, rate * args.repeat))
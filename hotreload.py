@@ -0,0 +1,163 @@
+import os
+import time
+
+import levels
+
+# Hot reload of a world file while it's played.
+# LevelWatcher checks the modification time of a world file every interval
+# seconds. When the file has changed it is read again and compared with the
+# template the world was made from, and only the cells that changed are
+# applied to the running world: tiles are added or removed (tile listeners
+# keep the collision grid, tile chunks, monster store and level of detail up
+# to date) and monsters, coins and doors are spawned or despawned. The
+# player and everything else the edit didn't touch stay as they were.
+# Moving S only moves the spawn of the next new game.
+# Rows are compared as whole strings and the changed part of a changed row
+# is found by binary search on slices, so apart from reading the file a
+# reload costs about the same for a one cell change in any size of level.
+# Run: python roborun.py myworld.txt, with watch = True in roborun.py.
+
+class LevelWatcher(object):
+
+    # world must have been made from the file at path and not stepped yet:
+    # its monsters, coins and doors are matched with the cells of the file
+    # in the order they were added.
+    def __init__(self, path, world, interval=0.5):
+        self.path = path
+        self.world = world
+        self.interval = interval
+        self.template = levels.read_template(path)
+        self.mtime = os.stat(path).st_mtime_ns
+        self.next_check = time.perf_counter() + interval
+        # Cell (x, y) -> monster, coin or door spawned from it.
+        self.entities = {}
+        sprites = {'M': iter(world.all_monsters.sprites()),
+                   'C': iter(world.all_coins.sprites()),
+                   'D': iter(world.doors.sprites())}
+        for y, row in enumerate(self.template):
+            for x, element in enumerate(row):
+                if element in sprites:
+                    self.entities[(x, y)] = next(sprites[element])
+        self.reloads = 0
+        self.changed = 0 # Cells changed by the last reload.
+        self.reload_time = 0.0 # Seconds the last reload took to apply.
+
+    # Reload if the file has changed since last time. Returns True if the
+    # world was changed.
+    def poll(self):
+        now = time.perf_counter()
+        if now < self.next_check:
+            return False
+        self.next_check = now + self.interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError: # Being saved.
+            return False
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        try:
+            template = levels.read_template(self.path)
+        except (OSError, ValueError): # Being saved, or empty.
+            return False
+        return self.reload(template)
+
+    # Change the world from the current template to template. Returns True
+    # if any cells changed.
+    def reload(self, template):
+        start = time.perf_counter()
+        old = self.template
+        width = max(len(old[0]) if old else 0, len(template[0]))
+        changed = 0
+        for y in range(max(len(old), len(template))):
+            old_row = old[y].ljust(width) if y < len(old) else ' ' * width
+            row = template[y].ljust(width) if y < len(template) else ' ' * width
+            if old_row == row:
+                continue
+            first, last = changed_span(old_row, row)
+            for x in range(first, last):
+                if old_row[x] != row[x]:
+                    self.remove(x, y, old_row[x])
+                    self.add(x, y, row[x])
+                    changed += 1
+        self.template = template
+        world = self.world
+        tile_grid = world.tile_grid
+        if len(template) * tile_grid.tile_y != world.height or (
+            len(template[0]) * tile_grid.tile_x != world.width):
+            self.resize(len(template[0]), len(template))
+        doors_open = world.coins_collected >= world.coins_total
+        for door in world.doors:
+            door.is_open = doors_open
+        self.reloads += 1
+        self.changed = changed
+        self.reload_time = time.perf_counter() - start
+        return changed > 0
+
+    def remove(self, x, y, element):
+        world = self.world
+        if element == 'P':
+            world.remove_tile(x, y)
+            return
+        sprite = self.entities.pop((x, y), None)
+        if sprite is None:
+            return
+        if element == 'C':
+            world.coins_total -= 1
+            if sprite.alive():
+                sprite.kill()
+            else:
+                world.coins_collected -= 1
+        elif element == 'D':
+            world.entity_hash.remove(sprite)
+            sprite.kill()
+        elif sprite.alive():
+            sprite.kill()
+
+    def add(self, x, y, element):
+        world = self.world
+        if element == 'P':
+            world.add_tile(x, y)
+        elif element == 'M':
+            self.entities[(x, y)] = world.add_monster(x, y)
+        elif element == 'C':
+            self.entities[(x, y)] = world.add_coin(x, y)
+            world.coins_total += 1
+        elif element == 'D':
+            self.entities[(x, y)] = world.add_door(x, y)
+
+    # Level size changed, in tiles.
+    def resize(self, columns, rows):
+        world = self.world
+        tile_grid = world.tile_grid
+        old_ground = world.ground
+        # Ground stays as far below the bottom of the level.
+        world.ground += rows * tile_grid.tile_y - world.height
+        world.width = columns * tile_grid.tile_x
+        world.height = rows * tile_grid.tile_y
+        if world.player.ground == old_ground:
+            world.player.ground = world.ground
+
+    def report(self):
+        return ("Reloaded %s: %d cells changed in %.2f ms"
+                % (self.path, self.changed, self.reload_time * 1000))
+
+# Range first, last of the part of equal length strings a and b that
+# differs, found with O(log n) slice comparisons.
+def changed_span(a, b):
+    low, high = 0, len(a) # a[:low] == b[:low], a[:high] != b[:high].
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle
+    first = low
+    low, high = 0, len(a) - first # Same from the end.
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle
+    return first, len(a) - low
@@ -0,0 +1,168 @@
+import sys
+import math
+import array
+import random
+
+import levels
+
+# Seeded procedural level generator.
+# Makes worlds of any size in the usual template format (P, M, S, C, D,
+# space). A path of platform segments runs from the spawn S on the left to
+# the door D on the right. Segments are separated by gaps and steps the
+# player can always jump over with the default physics of roborun.py
+# (32 pixel tiles, player_jump_speed 500, g 1500, player_speed 200) without
+# the double jump: a single jump rises about 2.6 tiles and clears 3 tiles
+# of gap even while going up 2 tiles. Cells above the path, and over the
+# gaps between its segments, are kept free of other platforms so nothing
+# blocks the jumps. All coins are on the path, so the door can be opened.
+#
+# The path is planned column by column first, which needs memory only for
+# the width of the level. Rows are then made one at a time, so a level can
+# be streamed straight into a level file (see write_generated) without
+# ever keeping it all in memory. The same arguments always give the same
+# level.
+
+clearance = 4 # Free rows above path, more than one jump rises.
+max_rise = 2 # Tiles the path can go up from one segment to the next.
+max_drop = 4 # Tiles the path can go down from one segment to the next.
+max_gap = 3 # Widest gap between segments, in tiles.
+segment_length = (3, 12) # Shortest and longest path segment.
+safe_columns = 6 # No monsters or coins this close to the spawn.
+
+class LevelGenerator(object):
+
+    # Densities are probabilities: platforms for each cell off the path to
+    # have a platform tile, monsters and coins for each column of the path to
+    # have a monster or a coin on it.
+    def __init__(self, width, height, seed=0, platforms=0.05, monsters=0.05,
+                 coins=0.2):
+        if width < 2 * safe_columns or height < clearance + 3:
+            raise ValueError("Level must be at least %dx%d tiles."
+                             % (2 * safe_columns, clearance + 3))
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.platforms = platforms
+        self.monsters = monsters
+        self.coins = 0
+        # Row of path surface in each column, -1 for gaps.
+        self.surface = array.array('i', [-1]) * width
+        # Rows clear_top ... clear_bottom of each column get no extra tiles.
+        self.clear_top = array.array('i', [height]) * width
+        self.clear_bottom = array.array('i', [-1]) * width
+        # Path tiles, spawn, door, monsters and coins, by row: {y: [(x, element)]}.
+        self.elements = {}
+        self.plan(random.Random(seed), monsters, coins)
+
+    def place(self, x, y, element):
+        self.elements.setdefault(y, []).append((x, element))
+
+    def plan(self, rng, monsters, coins):
+        width = self.width
+        top = clearance + 1
+        bottom = self.height - 1
+        surface = self.surface
+        y = rng.randint(max(top, bottom - 4), bottom)
+        x = 0
+        last = y
+        gap = 0
+        while x < width:
+            length = rng.randint(*segment_length)
+            if x == 0:
+                length = max(length, safe_columns)
+            if width - (x + length) < segment_length[0] + max_gap:
+                # Too little room left for another segment, go to the end.
+                length = width - x
+            for column in range(x, x + length):
+                surface[column] = y
+            # Gap columns: no tiles between the rows of both sides. The path
+            # columns on either side of the gap are kept clear from the same
+            # top, so the player can drop or jump across without hitting a
+            # wall next to the lower side.
+            for column in range(x - gap, x):
+                self.clear_top[column] = min(last, y) - clearance
+                self.clear_bottom[column] = max(last, y)
+            if x > 0:
+                self.clear_top[x - gap - 1] = min(last, y) - clearance
+                self.clear_top[x] = min(last, y) - clearance
+            x += length
+            if x >= width:
+                break
+            last = y
+            y = rng.randint(max(top, y - max_rise), min(bottom, y + max_drop))
+            gap = rng.randint(0, max_gap)
+            if y <= last - 2:
+                # Without a gap the player could walk under a high step.
+                gap = max(gap, 1)
+            x += gap
+
+        spawn_y = surface[0] - 1
+        self.spawn = (1, spawn_y)
+        self.place(1, spawn_y, 'S')
+        door_x = width - 1
+        self.place(door_x, surface[door_x] - 1, 'D')
+        for x in range(width):
+            y = surface[x]
+            if y < 0:
+                continue
+            self.place(x, y, 'P')
+            self.clear_top[x] = min(self.clear_top[x], y - clearance)
+            self.clear_bottom[x] = y
+            if safe_columns <= x < door_x:
+                coin_y = y - 1
+                if rng.random() < monsters:
+                    self.place(x, y - 1, 'M')
+                    coin_y = y - 2
+                if rng.random() < coins:
+                    if rng.random() < 0.5:
+                        coin_y = y - 2
+                    self.place(x, coin_y, 'C')
+                    self.coins += 1
+
+    # Rows of the level as strings, made one at a time.
+    def rows(self):
+        width = self.width
+        rng = random.Random(self.seed ^ 0x5eed)
+        density = self.platforms
+        if 0 < density < 1:
+            log_miss = math.log(1 - density)
+        clear_top = self.clear_top
+        clear_bottom = self.clear_bottom
+        for y in range(self.height):
+            row = bytearray(b' ') * width
+            if density >= 1:
+                for x in range(width):
+                    if not clear_top[x] <= y <= clear_bottom[x]:
+                        row[x] = 80 # P
+            elif density > 0:
+                # Skip straight to the next tile, distance between tiles
+                # follows the geometric distribution.
+                x = int(math.log(1 - rng.random()) / log_miss)
+                while x < width:
+                    if not clear_top[x] <= y <= clear_bottom[x]:
+                        row[x] = 80 # P
+                    x += 1 + int(math.log(1 - rng.random()) / log_miss)
+            for x, element in self.elements.get(y, ()):
+                row[x] = ord(element)
+            yield row.decode('ascii')
+
+    def __iter__(self):
+        return self.rows()
+
+# Generated level as a list of rows, ready for World or generate_world.
+def generate_level(width, height, seed=0, **densities):
+    return list(LevelGenerator(width, height, seed, **densities))
+
+# Write generated level to a level file (see levels.py) row by row. Returns
+# the LevelGenerator.
+def write_generated(path, width, height, seed=0, **densities):
+    generator = LevelGenerator(width, height, seed, **densities)
+    levels.write_level(generator.rows(), path, width, height, generator.coins,
+                       generator.spawn)
+    return generator
+
+if __name__ == '__main__':
+    # python levelgen.py width height [seed] target.level
+    width, height = int(sys.argv[1]), int(sys.argv[2])
+    seed = int(sys.argv[3]) if len(sys.argv) > 4 else 0
+    write_generated(sys.argv[-1], width, height, seed)
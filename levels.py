@@ -0,0 +1,250 @@
+import os
+import sys
+import mmap
+import array
+import struct
+import hashlib
+import re
+
+# Level file format for big worlds.
+# First line is a header:
+#   ROBORUN <width> <height> <coins> <spawn x> <spawn y>
+# followed by height rows of exactly width characters, each ending in '\n'.
+# Elements are the same as in the world templates (P, M, S, C, D, space).
+# Since all rows have the same length, any part of the level can be read
+# without reading the rows before it.
+
+magic = b'ROBORUN'
+
+# Write world template to level file.
+def save_level(template, path):
+    width = max(len(row) for row in template)
+    coins = 0
+    spawn = (0, 0)
+    for y, row in enumerate(template):
+        coins += row.count('C')
+        if 'S' in row:
+            spawn = (row.index('S'), y)
+    write_level(template, path, width, len(template), coins, spawn)
+
+# Write level file row by row from an iterable of rows, without keeping the
+# whole template in memory. Shorter rows are padded with spaces.
+def write_level(rows, path, width, height, coins, spawn):
+    with open(path, 'w', newline='\n') as f:
+        f.write("%s %d %d %d %d %d\n" % (magic.decode(), width, height,
+                                         coins, spawn[0], spawn[1]))
+        for row in rows:
+            f.write(row.ljust(width) + '\n')
+
+# Memory mapped level file. Works like a read-only world template: len()
+# is the amount of rows and indexing returns a row string, but rows are
+# only read from the file when asked for.
+class LevelFile(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self.map.find(b'\n')
+        fields = self.map[:header_end].split()
+        if len(fields) != 6 or fields[0] != magic:
+            raise ValueError("Not a Roborun level file: " + path)
+        self.width, self.height, self.coins = (int(f) for f in fields[1:4])
+        self.spawn = (int(fields[4]), int(fields[5]))
+        self.offset = header_end + 1
+        self.stride = self.width + 1
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.height
+        if not 0 <= y < self.height:
+            raise IndexError(y)
+        return self.row(y, 0, self.width)
+
+    def __iter__(self):
+        for y in range(self.height):
+            yield self[y]
+
+    # Columns first_x ... last_x - 1 of row y.
+    def row(self, y, first_x, last_x):
+        start = self.offset + y * self.stride
+        return self.map[start + first_x:start + last_x].decode('ascii')
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+# Compiled binary levels.
+# Layout, all integers little endian:
+#   header: magic b'RRLEVEL1', width, height, spawn x, spawn y, coins,
+#           entity count (uint32 each)
+#   tile bitmap: height rows of (width + 7) // 8 bytes, one bit per cell,
+#                most significant bit first, 1 = platform tile
+#   entity table: entity count records of kind, x, y (uint32 each) in the
+#                 same row by row order as in the template
+# Compiled levels are cached next to the source in __levelcache__, keyed on
+# the hash of the source file, so a level is compiled only when it changes.
+
+compiled_magic = b'RRLEVEL1'
+header_format = struct.Struct('<8s6I')
+entity_kinds = {'M': 1, 'C': 2, 'D': 3} # Monster, coin, door.
+entity_pattern = re.compile(b'[MCDS]')
+cache_dir_name = '__levelcache__'
+
+# Tile bitmap row of a template row: P -> 1, anything else -> 0.
+tile_bits = bytes(ord('1') if value == ord('P') else ord('0')
+                  for value in range(256))
+
+class CompiledLevel(object):
+
+    def __init__(self, width, height, spawn, coins, bitmap, entities):
+        self.width = width
+        self.height = height
+        self.spawn = spawn
+        self.coins = coins
+        self.bitmap = bitmap # bytes, see layout above.
+        self.entities = entities # array('I') of kind, x, y triples.
+        self.row_bytes = (width + 7) // 8
+
+    # Grid cells (x, y) of all platform tiles.
+    def tiles(self):
+        row_bytes = self.row_bytes
+        bits = row_bytes * 8
+        for y in range(self.height):
+            row = self.bitmap[y * row_bytes:(y + 1) * row_bytes]
+            if not any(row):
+                continue
+            digits = bin(int.from_bytes(row, 'big'))[2:].zfill(bits)
+            x = digits.find('1')
+            while x != -1:
+                yield x, y
+                x = digits.find('1', x + 1)
+
+    # (kind, x, y) of all monsters, coins and doors, kind being M, C or D.
+    def entity_list(self):
+        names = dict((value, name) for name, value in entity_kinds.items())
+        entities = self.entities
+        for i in range(0, len(entities), 3):
+            yield names[entities[i]], entities[i + 1], entities[i + 2]
+
+    def to_bytes(self):
+        return b''.join((
+            header_format.pack(compiled_magic, self.width, self.height,
+                               self.spawn[0], self.spawn[1], self.coins,
+                               len(self.entities) // 3),
+            self.bitmap,
+            self.entities.tobytes()))
+
+    @classmethod
+    def from_bytes(cls, data):
+        (magic, width, height, spawn_x, spawn_y, coins,
+         count) = header_format.unpack_from(data)
+        if magic != compiled_magic:
+            raise ValueError("Not a compiled Roborun level.")
+        start = header_format.size
+        bitmap_size = height * ((width + 7) // 8)
+        bitmap = bytes(data[start:start + bitmap_size])
+        entities = array.array('I')
+        entities.frombytes(
+            data[start + bitmap_size:start + bitmap_size + count * 12])
+        if sys.byteorder != 'little':
+            entities.byteswap()
+        return cls(width, height, (spawn_x, spawn_y), coins, bitmap, entities)
+
+# Compile template rows (strings or bytes) into a CompiledLevel.
+def compile_level(rows):
+    rows = [row.encode('ascii') if isinstance(row, str) else row
+            for row in rows]
+    width = max(len(row) for row in rows)
+    row_bytes = (width + 7) // 8
+    bitmap = bytearray()
+    entities = array.array('I')
+    coins = 0
+    spawn = None
+    for y, row in enumerate(rows):
+        digits = row.ljust(row_bytes * 8).translate(tile_bits)
+        bitmap += int(digits, 2).to_bytes(row_bytes, 'big')
+        for match in entity_pattern.finditer(row):
+            element = match.group().decode('ascii')
+            if element == 'S':
+                spawn = (match.start(), y)
+            else:
+                entities.extend((entity_kinds[element], match.start(), y))
+                if element == 'C':
+                    coins += 1
+    if spawn is None:
+        raise ValueError("Level has no spawn position S.")
+    return CompiledLevel(width, len(rows), spawn, coins, bytes(bitmap),
+                         entities)
+
+def is_compiled(path):
+    with open(path, 'rb') as f:
+        return f.read(len(compiled_magic)) == compiled_magic
+
+# Template rows of a world file or level file (header is skipped).
+def read_rows(data):
+    rows = data.split(b'\n')
+    if rows and rows[0].startswith(magic):
+        rows = rows[1:]
+    rows = [row.rstrip(b'\r') for row in rows]
+    while rows and not rows[-1].strip():
+        rows.pop()
+    return rows
+
+# World file or level file as a template: list of row strings, short rows
+# padded with spaces so all rows have the same width.
+def read_template(path):
+    with open(path, 'rb') as f:
+        rows = [row.decode('utf-8') for row in read_rows(f.read())]
+    width = max(len(row) for row in rows)
+    return [row.ljust(width) for row in rows]
+
+# Load world or level file as CompiledLevel, compiling it only if there is
+# no compiled version of the same source in the cache.
+def load_level(path, cache_dir=None):
+    with open(path, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha1(source).hexdigest()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                 cache_dir_name)
+    cached = os.path.join(cache_dir, "%s-%s.rrl"
+                          % (os.path.basename(path), digest[:16]))
+    if os.path.exists(cached):
+        with open(cached, 'rb') as f:
+            return CompiledLevel.from_bytes(f.read())
+    level = compile_level(read_rows(source))
+    del source
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to temporary file first so a half written file is never used.
+    temporary = cached + '.tmp%d' % os.getpid()
+    with open(temporary, 'wb') as f:
+        f.write(level.to_bytes())
+    os.replace(temporary, cached)
+    remove_stale(cache_dir, os.path.basename(path), cached)
+    return level
+
+# Remove compiled versions of source name in cache_dir other than keep, they
+# are of earlier versions of the source.
+def remove_stale(cache_dir, name, keep):
+    pattern = re.compile(re.escape(name) + r'-[0-9a-f]{16}\.rrl$')
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if pattern.match(entry) and path != keep:
+            try:
+                os.remove(path)
+            except OSError: # Removed by another process meanwhile.
+                pass
+
+if __name__ == '__main__':
+    # Compile a world or level file: python levels.py source [target.rrl]
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else (
+        os.path.splitext(source)[0] + '.rrl')
+    with open(source, 'rb') as f:
+        level = compile_level(read_rows(f.read()))
+    with open(target, 'wb') as f:
+        f.write(level.to_bytes())
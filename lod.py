@@ -0,0 +1,381 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+
+import pygame
+
+# Level of detail for monsters: monsters far from the player sleep.
+# A sleeping monster is left out of World.all_sprites, so it costs nothing
+# per step. Monsters only patrol from wall to wall (see Monster), and the
+# position of one that doesn't hit a wall is computed directly from the
+# step count. So where a sleeping monster is at any later step can be
+# computed without stepping: the legs it walks are found from the walls
+# left and right of it, and after its first turn it goes back and forth
+# with a fixed period. A monster woken up is where it would be if it had
+# been updated all along, to the bit.
+#
+# Monsters wake up before they can get into the active area, a rect around
+# the player big enough for the camera view and the reach of fireballs. The
+# camera view is in it too once a Renderer has shown it. A sleeping monster
+# gets checked at half the time it would need at least to get into the
+# area, with the player and the monster moving towards each other as fast
+# as they can (the player falling faster all the time, or jumping), so
+# checks are few and only for monsters close to the area.
+# Monsters that fireballs in the air could get to stay awake too.
+# Per step the cost depends on the amount of monsters near the player, not
+# on the size of the level.
+
+# How a monster moves while it sleeps between walls left and right (x of
+# the wall side facing the monster, None if there is no wall): from step
+# since on it walks its leg until it turns at step turn (None if it never
+# does), then walks a leg from first_x for first_steps steps (None if it
+# never turns again) and a leg back from back_x, over and over with the
+# period of the two.
+class Sleep(object):
+
+    __slots__ = ('since', 'left', 'right', 'turn', 'first_x', 'first_steps',
+                 'back_x', 'period')
+
+    def __init__(self, since, left, right, turn=None, first_x=None,
+                 first_steps=None, back_x=None, period=None):
+        self.since = since
+        self.left = left
+        self.right = right
+        self.turn = turn
+        self.first_x = first_x
+        self.first_steps = first_steps
+        self.back_x = back_x
+        self.period = period
+
+class Dormancy(object):
+
+    # The active area reaches area_x and area_y pixels from the player's
+    # center. The area's edges can move towards a monster at most closing_x
+    # pixels per step horizontally. Vertically the player's speed in pixels
+    # per step can go up by at most jump_y at once, jumping, and gravity_y
+    # every step. Monsters move monster_speed pixels per step. margin is how
+    # much further than the active area a monster must be to go to sleep.
+    # dt is the time step monsters and the player are updated with.
+    def __init__(self, world, area_x, area_y, closing_x, jump_y, gravity_y,
+                 monster_speed, dt, margin=64):
+        self.world = world
+        self.area_x = area_x
+        self.area_y = area_y
+        self.closing_x = closing_x
+        self.jump_y = jump_y
+        self.gravity_y = gravity_y
+        self.monster_speed = monster_speed
+        self.dt = dt
+        self.margin = margin
+        self.view = None # Camera view in world pixels, set by Renderer.
+        self.awake = set()
+        self.sleeping = set()
+        self.row_sleeping = {} # Tile row -> sleeping monsters in it.
+        self.queue = [] # (clock, counter, monster, Sleep) checks to do.
+        # Steps updated and jumped (see jumped), checks are scheduled by it.
+        self.clock = 0
+        self.shots = [] # Rects of fireballs shot since the last update.
+        self.counter = 0
+        self.rows = None # Row -> sorted columns with tiles.
+        self.checks = 0 # Sleeping monsters checked, for measuring.
+        world.tile_listeners.append(self.tile_changed)
+
+    def add(self, monster):
+        self.awake.add(monster)
+
+    def discard(self, monster):
+        self.awake.discard(monster)
+        if monster.asleep is not None:
+            self.sleeping.discard(monster)
+            self.forget_rows(monster)
+            monster.asleep = None
+
+    # Wake the monsters sleeping in row y that the tile at x is between the
+    # walls of, or is a wall of.
+    def tile_changed(self, x, y, added):
+        if self.rows is not None:
+            columns = self.rows.setdefault(y, [])
+            if added:
+                insort(columns, x)
+            else:
+                del columns[bisect_left(columns, x)]
+        tile_x = self.world.tile_grid.tile_x
+        left = x * tile_x
+        right = left + tile_x
+        for monster in list(self.row_sleeping.get(y, ())):
+            sleep = monster.asleep
+            if ((sleep.left is None or right >= sleep.left) and
+                (sleep.right is None or left <= sleep.right)):
+                self.wake(monster)
+
+    # Tile rows sleeping monster is in.
+    def monster_rows(self, monster):
+        tile_y = self.world.tile_grid.tile_y
+        return range(monster.rect.top // tile_y,
+                     (monster.rect.bottom - 1) // tile_y + 1)
+
+    def forget_rows(self, monster):
+        for y in self.monster_rows(monster):
+            monsters = self.row_sleeping[y]
+            monsters.discard(monster)
+            if not monsters:
+                del self.row_sleeping[y]
+
+    def area(self):
+        center_x, center_y = self.world.player.rect.center
+        area = pygame.Rect(center_x - self.area_x, center_y - self.area_y,
+                           2 * self.area_x, 2 * self.area_y)
+        if self.view is not None:
+            area.union_ip(self.view)
+        return area
+
+    # Called every step before the monsters are updated.
+    def update(self):
+        world = self.world
+        now = world.ticks
+        self.clock += 1
+        area = self.area()
+        self.check_due(area)
+        far = area.inflate(2 * self.margin, 2 * self.margin)
+        sweeps = self.sweeps()
+        tile_grid = world.tile_grid
+        for monster in [monster for monster in self.awake
+                        if not far.colliderect(monster.rect)]:
+            # Monsters inside tiles (put there by an edit of the level, see
+            # hotreload.py) don't walk legs, they stay awake.
+            if (monster.rect.collidelist(sweeps) < 0 and
+                tile_grid.collide_any(monster.rect) is None):
+                self.sleep(monster, area, now)
+
+    def check_due(self, area):
+        world = self.world
+        now = world.ticks
+        if self.shots:
+            self.wake_shot()
+        queue = self.queue
+        while queue and queue[0][0] <= self.clock:
+            when, counter, monster, sleep = heapq.heappop(queue)
+            if monster.asleep is sleep:
+                self.check(monster, area, now)
+        # Sleeping monsters are hashed where they were last checked.
+        for monster in world.entity_hash.query(area, ('monster',)):
+            if monster.asleep is not None:
+                self.check(monster, area, now)
+
+    # The world was set to another step (see snapshot.py), steps steps from
+    # the one it was at. The player can't have got further than it could
+    # in as many steps, so checks due by then are enough.
+    def jumped(self, steps):
+        self.clock += steps
+        self.check_due(self.area())
+
+    # Rects monsters could touch fireballs in the air in.
+    def sweeps(self):
+        sweeps = []
+        for fireball in self.world.all_fireballs:
+            sweeps.append(self.sweep(fireball))
+        return sweeps
+
+    # Rect a fireball passes through in the rest of its lifetime, widened
+    # by how far monsters get meanwhile.
+    def sweep(self, fireball):
+        rect = fireball.rect
+        travel = fireball.velocity_x * self.dt * fireball.lifetime
+        reach = self.monster_speed * fireball.lifetime + 1
+        return rect.union(rect.move(round(travel), 0)).inflate(2 * reach, 0)
+
+    # Monsters the new fireball could get to are woken in the next update,
+    # before anything moves, for all fireballs shot meanwhile at once.
+    # Monsters are hashed where they were last checked, at most a quarter or
+    # so of their distance to the active area from where they are.
+    def fireball_shot(self, fireball):
+        sweep = self.sweep(fireball)
+        drift = self.monster_speed / self.closing_x
+        sweep.inflate_ip(2 * round((sweep.width / 2) * drift) + 2, 0)
+        self.shots.append(sweep)
+
+    def wake_shot(self):
+        shots = self.shots
+        self.shots = []
+        for monster in self.world.entity_hash.query(shots[0].unionall(shots),
+                                                    ('monster',)):
+            if monster.asleep is not None:
+                self.wake(monster)
+
+    def sleep(self, monster, area, now):
+        self.fall_asleep(monster, now)
+        self.schedule(monster, area)
+
+    def fall_asleep(self, monster, since):
+        monster.asleep = self.plan(monster, since)
+        self.awake.discard(monster)
+        self.sleeping.add(monster)
+        for y in self.monster_rows(monster):
+            self.row_sleeping.setdefault(y, set()).add(monster)
+        self.world.all_sprites.remove(monster)
+        self.world.mark_changed(monster)
+
+    # Put awake monster, in the state it had at step since, back to sleep
+    # as it was then. It keeps that plan until it could get into the
+    # active area from where it is now, so restoring the snapshots of a
+    # rewind one after the other doesn't check and change it every time.
+    def resume(self, monster, since):
+        self.fall_asleep(monster, since)
+        area = self.area()
+        now = self.world.ticks
+        leg_x, leg_steps, y, velocity_x = self.state_of(monster)
+        rect = monster.rect.copy()
+        rect.x = round(leg_x + leg_steps * (velocity_x * self.dt))
+        steps = self.steps_to(rect, area)
+        if steps < 1:
+            self.check(monster, area, now)
+        else:
+            self.enqueue(monster, steps)
+
+    # Bring sleeping monster up to date, wake it if it's in area.
+    def check(self, monster, area, now):
+        self.checks += 1
+        monster.set_state(self.state_of(monster))
+        monster.asleep = self.plan(monster, now)
+        self.world.mark_changed(monster)
+        if area.colliderect(monster.rect):
+            self.wake(monster)
+        else:
+            self.schedule(monster, area)
+
+    def schedule(self, monster, area):
+        self.enqueue(monster, self.steps_to(monster.rect, area))
+
+    # Half the steps a monster at rect would need at least to get into area.
+    def steps_to(self, rect, area):
+        gap_x = max(0, area.left - rect.right, rect.left - area.right)
+        gap_y = max(0, area.top - rect.bottom, rect.top - area.bottom)
+        # Steps to fall or rise gap_y, from the fastest the player can be
+        # going in the next step (plus a pixel of rounding) on.
+        speed = abs(self.world.player.velocity_y) * self.dt + self.jump_y + 1
+        gravity = self.gravity_y
+        steps_y = ((speed * speed + 2 * gravity * gap_y) ** 0.5 - speed) / gravity
+        return max(gap_x / self.closing_x, steps_y) / 2
+
+    def enqueue(self, monster, steps):
+        self.counter += 1
+        heapq.heappush(self.queue, (self.clock + max(1, int(steps)),
+                                    self.counter, monster, monster.asleep))
+
+    def wake(self, monster):
+        if monster.asleep is None:
+            return
+        monster.set_state(self.state_of(monster))
+        self.rouse(monster)
+
+    # Wake monster without bringing it up to date, for when its state is
+    # set right after.
+    def rouse(self, monster):
+        if monster.asleep is None:
+            return
+        monster.asleep = None
+        self.sleeping.discard(monster)
+        self.forget_rows(monster)
+        self.awake.add(monster)
+        self.world.all_sprites.add(monster)
+        self.world.mark_changed(monster)
+
+    def wake_all(self):
+        for monster in list(self.sleeping):
+            self.wake(monster)
+        self.queue = []
+
+    # Walls left and right of rect in the rows it covers: x of the right
+    # side of the nearest tile on the left and of the left side of the
+    # nearest tile on the right, None where there is none.
+    def walls(self, rect):
+        if self.rows is None:
+            rows = {}
+            for x, y in self.world.tile_grid.cells:
+                rows.setdefault(y, []).append(x)
+            for columns in rows.values():
+                columns.sort()
+            self.rows = rows
+        tile_x = self.world.tile_grid.tile_x
+        tile_y = self.world.tile_grid.tile_y
+        first_right = -(-rect.right // tile_x)
+        last_left = rect.left // tile_x - 1
+        left = right = None
+        for y in range(rect.top // tile_y, (rect.bottom - 1) // tile_y + 1):
+            columns = self.rows.get(y)
+            if not columns:
+                continue
+            i = bisect_left(columns, first_right)
+            if i < len(columns):
+                x = columns[i] * tile_x
+                if right is None or x < right:
+                    right = x
+            i = bisect_right(columns, last_left) - 1
+            if i >= 0:
+                x = (columns[i] + 1) * tile_x
+                if left is None or x > left:
+                    left = x
+        return left, right
+
+    # Sleep of monster from step now on, its legs turning at the walls left
+    # and right of it.
+    def plan(self, monster, now):
+        left, right = self.walls(monster.rect)
+        width = monster.rect.width
+        velocity_x = monster.velocity_x
+        turn = self.leg_end(monster.leg_x, monster.leg_steps, velocity_x,
+                            left, right, width)
+        if turn is None:
+            return Sleep(now, left, right)
+        # Turns at the walls snap like in Monster.bounce.
+        if velocity_x > 0:
+            first_x = float(right - width)
+        else:
+            first_x = float(left)
+        first_steps = self.leg_end(first_x, 0, -velocity_x, left, right, width)
+        back_x = period = None
+        if first_steps is not None:
+            if velocity_x > 0:
+                back_x = float(left)
+            else:
+                back_x = float(right - width)
+            period = first_steps + self.leg_end(back_x, 0, velocity_x, left,
+                                                right, width)
+        return Sleep(now, left, right, turn - monster.leg_steps, first_x,
+                     first_steps, back_x, period)
+
+    # State (see Monster.get_state) sleeping monster has by now.
+    def state_of(self, monster):
+        sleep = monster.asleep
+        steps = self.world.ticks - sleep.since
+        velocity_x = monster.velocity_x
+        if sleep.turn is None or steps < sleep.turn:
+            return (monster.leg_x, monster.leg_steps + steps, monster.rect.y,
+                    velocity_x)
+        steps -= sleep.turn
+        if sleep.period is not None:
+            steps %= sleep.period
+        if sleep.first_steps is None or steps < sleep.first_steps:
+            return (sleep.first_x, steps, monster.rect.y, -velocity_x)
+        return (sleep.back_x, steps - sleep.first_steps, monster.rect.y,
+                velocity_x)
+
+    # Step of the leg the monster hits a wall at, None if it never does.
+    # Positions are computed like in Monster.update, so the step is exact.
+    def leg_end(self, leg_x, leg_steps, velocity_x, left, right, width):
+        step = velocity_x * self.dt
+        if step > 0 and right is not None:
+            limit = right - width
+            hit = lambda k: round(leg_x + k * step) > limit
+            estimate = (limit + 0.5 - leg_x) / step
+        elif step < 0 and left is not None:
+            limit = left
+            hit = lambda k: round(leg_x + k * step) < limit
+            estimate = (limit - 0.5 - leg_x) / step
+        else:
+            return None
+        k = max(leg_steps + 1, int(estimate) - 1)
+        while k > leg_steps + 1 and hit(k - 1):
+            k -= 1
+        while not hit(k):
+            k += 1
+        return k
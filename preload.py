@@ -0,0 +1,72 @@
+import time
+import threading
+
+# Background preparation of the next level.
+# A worker thread builds the next level (World with its tiles and entities,
+# Renderer with the tile chunks around the spawn baked) while the current
+# one is played, so when the door is reached the prepared level is swapped
+# in without a stall. Images are decoded once into the shared Atlas at
+# startup, so the worker never loads anything from disk for them.
+# The worker shares the interpreter lock with the game loop, which gets it
+# back at least every switch interval (5 ms by default), so frames are
+# delayed a little while the worker runs but never for the whole build.
+
+class Preloader(object):
+
+    # make() is called on the worker thread and returns the prepared level.
+    def __init__(self, make):
+        self.make = make
+        self.result = None
+        self.error = None
+        self.build_time = None # Seconds the worker took, once done.
+        self.finished = None # perf_counter() time the worker was done.
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='preload',
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.result = self.make()
+        except BaseException as error:
+            self.error = error
+        self.finished = time.perf_counter()
+        self.build_time = self.finished - start
+        self.done.set()
+
+    def ready(self):
+        return self.done.is_set()
+
+    # Prepared level, waits for the worker if it isn't done yet. Errors of
+    # the worker are raised here, on the calling thread.
+    def get(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+# Timing of one change of level, all in seconds.
+class Transition(object):
+
+    def __init__(self, start):
+        self.start = start # perf_counter() time the door was reached.
+        self.swap_time = None # Taking the next level into use.
+        self.first_frame = None # Work of the first frame of the new level.
+        self.build_time = None # Building the level, on the worker or not.
+        self.delay = 0.0 # Change of level held up waiting for the level.
+        self.preloaded = False
+
+    # Frame time added by the change of level, the stall a player could
+    # notice. Waiting for the next frame in clock.tick is not counted.
+    @property
+    def latency(self):
+        return self.swap_time + self.first_frame
+
+    def report(self):
+        return ("Level %s in %.1f ms, delayed %.1f ms, stall %.1f ms (swap "
+                "%.1f ms, first frame %.1f ms)"
+                % ('preloaded' if self.preloaded else 'built',
+                   self.build_time * 1000, self.delay * 1000,
+                   self.latency * 1000, self.swap_time * 1000,
+                   self.first_frame * 1000))
@@ -0,0 +1,122 @@
+import csv
+import json
+import time
+from collections import deque
+
+# Per frame profiler for the game loop.
+# The loop calls begin_frame() at the start of a frame, mark(phase) at the
+# end of each phase and end_frame() when the frame is done. Time since the
+# previous mark is added to the phase, so a phase that runs several times in
+# one frame (e.g. update when the world takes two fixed steps) is summed.
+# Everything that calls the profiler checks first if there is one, so a game
+# without a profiler pays one "if" per phase.
+
+phases = ('input', 'update', 'collision', 'render', 'hud', 'flip')
+# Counters taken every frame, as differences of the running totals.
+counters = ('tile_queries', 'collision_checks', 'blits', 'drawn', 'culled')
+columns = ('frame', 'dt', 'total') + phases + counters
+
+class FrameProfiler(object):
+
+    def __init__(self, window=600, overlay=True):
+        self.window = window # Frames used for percentiles.
+        self.overlay = overlay # Show overlay on screen.
+        self.records = [] # One tuple per frame, see columns.
+        self.totals = deque(maxlen=window) # Recent frame times.
+        self.frame = 0
+        self.start = self.last = time.perf_counter()
+        self.current = dict.fromkeys(phases, 0.0)
+        self.last_counts = None
+        self.last_world = None
+
+    def begin_frame(self):
+        self.start = self.last = time.perf_counter()
+        self.current = dict.fromkeys(phases, 0.0)
+
+    # Add time since the previous mark to phase.
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    # Frame done. dt is the frame interval the game loop used, world and
+    # renderer give the collision and blit counters.
+    def end_frame(self, dt, world, renderer):
+        total = time.perf_counter() - self.start
+        counts = (world.tile_grid.queries, world.entity_hash.checks)
+        if world is not self.last_world:
+            # New world, its counters start from zero.
+            self.last_counts = (0, 0)
+            self.last_world = world
+        record = ((self.frame, dt, total) +
+                  tuple(self.current[phase] for phase in phases) +
+                  (counts[0] - self.last_counts[0],
+                   counts[1] - self.last_counts[1],
+                   renderer.stats['blits'], renderer.stats['drawn'],
+                   renderer.stats['culled']))
+        self.last_counts = counts
+        self.records.append(record)
+        self.totals.append(total)
+        self.frame += 1
+
+    # Percentiles of recent frame times in seconds, as a dict like
+    # {'p50': ..., 'p95': ..., 'p99': ...}.
+    def percentiles(self, ranks=(50, 95, 99)):
+        values = sorted(self.totals)
+        if not values:
+            return dict(('p%d' % rank, 0.0) for rank in ranks)
+        # Nearest rank.
+        return dict(('p%d' % rank,
+                     values[min(len(values) - 1,
+                                max(0, -(-rank * len(values) // 100) - 1))])
+                    for rank in ranks)
+
+    # Means of phases and counters over recent frames, plus percentiles.
+    def summary(self):
+        recent = self.records[-self.window:]
+        result = {'frames': len(self.records)}
+        result.update(self.percentiles())
+        for i, name in enumerate(columns[2:], 2):
+            result['mean_' + name] = (
+                sum(record[i] for record in recent) / len(recent)
+                if recent else 0.0)
+        return result
+
+    def report(self):
+        summary = self.summary()
+        lines = ["%d frames, frame time p50 %.2f ms, p95 %.2f ms, p99 %.2f ms"
+                 % (summary['frames'], summary['p50'] * 1000,
+                    summary['p95'] * 1000, summary['p99'] * 1000)]
+        lines.append("  ".join("%s %.2f ms" % (phase,
+                                                summary['mean_' + phase] * 1000)
+                               for phase in phases))
+        lines.append("  ".join("%s %.0f" % (name, summary['mean_' + name])
+                               for name in counters))
+        return '\n'.join(lines)
+
+    # Text lines for the on-screen overlay: last frame and percentiles.
+    def overlay_lines(self):
+        if not self.records:
+            return []
+        record = dict(zip(columns, self.records[-1]))
+        lines = ["frame %.2f ms" % (record['total'] * 1000)]
+        lines += ["%s %.2f ms" % (phase, record[phase] * 1000)
+                  for phase in phases]
+        lines.append("p50 %.1f p95 %.1f p99 %.1f" % tuple(
+            value * 1000 for key, value in sorted(self.percentiles().items())))
+        lines.append("checks %d blits %d" % (record['collision_checks'],
+                                             record['blits']))
+        return lines
+
+    # Write all frames to path, as JSON if it ends with .json, otherwise CSV.
+    def export(self, path):
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({'columns': columns, 'summary': self.summary(),
+                           'frames': [dict(zip(columns, record))
+                                      for record in self.records]}, f)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                writer.writerows(self.records)
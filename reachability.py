@@ -0,0 +1,704 @@
+import os
+import sys
+from collections import namedtuple
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import roborun
+import levels
+from levels import CompiledLevel
+
+# Offline reachability and solvability analysis of levels.
+# Positions the player can stand on (an empty cell with a platform tile
+# under it) are the nodes of a graph. Edges are walking along a platform
+# and jump arcs: the player's path through the air, simulated step by step
+# with the game's physics for every way of steering (holding left or right
+# from some step on, double jump at some step). Letting go of the keys at
+# any point of an arc, or falling further than max_fall rows, is a straight
+# drop from there. Arcs only depend on the physics, so they are made once
+# and kept in a tree where arcs going through the same cells share nodes.
+# A branch of the tree stops where it hits a tile: on top of a tile the
+# player lands, anywhere else the branch is dropped. Dropping branches that
+# hit walls and ceilings means some very tight moves that work in the game
+# may be missed.
+#
+# The level is kept in big integers used as bit masks, one bit per cell,
+# column after column with some empty rows above and below each column:
+# moving by an offset of cells is a shift, and the tree is followed once
+# from all positions of the level at the same time. A tree node's mask has
+# the positions from where the player gets to it, which gives masks of the
+# positions that can move by each offset. Operations on big integers go
+# through all of their memory, so the tree is followed for a band of
+# columns at a time. Falling straight down from many
+# cells at once is an addition: the carry runs down each column over the
+# cells that are not positions and stops at the first one.
+# A breadth first search then follows the moves from the spawn, one round
+# per jump or fall. A round only gets a few columns further, so the search
+# works on chunks of the masks and only on the chunks the positions new in
+# the round are in. As the search counts jumps and falls, the path found to
+# the door has the fewest of them.
+#
+# The player is one tile big and stands on whole cells; coins are touched
+# when any cell the player covers has one and the door is reached when the
+# center of the player is in a door cell, like in the game. Monsters are
+# not taken into account, and neither is the order coins are collected in:
+# a level is reported solvable when the door and every coin can be reached
+# from the spawn.
+# Run: python reachability.py [world0 | world file | level file ...]
+
+Physics = namedtuple('Physics', ['g', 'jump_speed', 'speed', 'double_jump',
+                                 'dt', 'tile_x', 'tile_y'])
+
+# Physics of the game, from the settings in roborun.py.
+def game_physics():
+    return Physics(roborun.g, roborun.player_jump_speed, roborun.player_speed,
+                   roborun.double_jump, roborun.fixed_dt, roborun.tile_x,
+                   roborun.tile_y)
+
+steer_steps = 6 # Steering starts every this many steps.
+double_jump_steps = 4 # Double jump tried every this many steps.
+max_double_jump = 60 # Last step a double jump is tried at.
+max_fall = 8 # Rows below the start arcs are followed for.
+chunk_columns = 32 # Columns in a chunk of the search.
+band_chunks = 16 # Chunks the tree is followed in at a time.
+
+# Arc trees, {physics: (jump, {direction: walk off})}.
+arc_cache = {}
+
+# Player positions in pixels relative to the start after each step of an
+# arc. Horizontal key is held in direction first, then from step begin on
+# in turn (-1, 0 or 1), vertical speed starts at velocity_y.
+def simulate(physics, direction, begin, turn, velocity_y, double_at,
+             start_x):
+    g, jump_speed, speed, double_jump, dt, tile_x, tile_y = physics
+    x = float(start_x)
+    y = 0.0
+    step = 0
+    while y <= max_fall * tile_y:
+        if step == double_at:
+            velocity_y -= jump_speed
+        velocity_x = (turn if step >= begin else direction) * speed
+        velocity_y += g * dt
+        x += velocity_x * dt
+        y += velocity_y * dt
+        step += 1
+        yield round(x), round(y), velocity_y > 0, step
+
+# Tree of arcs as a list of nodes, each node followed by its subtree. A
+# node is a tuple of the cells the player covers (first and last column,
+# first and last row, relative to the start), if the player is falling, the
+# cell of the player's center, steps taken, index of the parent node (-1 for
+# none), index after the end of its subtree and the columns the player was
+# not in at the parent node. Dropping from a column the player was already
+# in lands where dropping from the parent does, so only these get drops.
+def arc_tree(physics, arcs):
+    tile_x = physics.tile_x
+    tile_y = physics.tile_y
+    root = {}
+    for arc in arcs:
+        children = root
+        last = None
+        for x, y, falling, step in arc:
+            key = (x // tile_x, (x + tile_x - 1) // tile_x,
+                   y // tile_y, (y + tile_y - 1) // tile_y, falling,
+                   (x + tile_x // 2) // tile_x, (y + tile_y // 2) // tile_y)
+            if key == last:
+                continue
+            last = key
+            if key not in children:
+                children[key] = (step, {})
+            children = children[key][1]
+    nodes = []
+    def flatten(children, parent, columns):
+        for key, (step, grandchildren) in children.items():
+            index = len(nodes)
+            nodes.append(None)
+            flatten(grandchildren, index, key[:2])
+            new = tuple(column for column in sorted(set(key[:2]))
+                        if column not in columns)
+            nodes[index] = key + (step, parent, len(nodes), new)
+    flatten(root, -1, ())
+    return nodes
+
+# Trees for jumping and for walking off an edge to the left (-1) or right.
+def jump_arcs(physics):
+    if physics in arc_cache:
+        return arc_cache[physics]
+    # Steps in the air after a single jump.
+    air = int(2 * physics.jump_speed / physics.g / physics.dt)
+    steer = [(0, 0)] + [(direction, begin) for direction in (-1, 1)
+                        for begin in range(0, air, steer_steps)]
+    doubles = [None]
+    if physics.double_jump:
+        doubles += list(range(1, max_double_jump + 1, double_jump_steps))
+    jump = arc_tree(physics, (
+        simulate(physics, 0, begin, turn, -physics.jump_speed, double_at, 0)
+        for turn, begin in steer for double_at in doubles))
+    # Falling starts with the player fully off the edge, a cell to the side,
+    # and keeps going that way or turns. Falling players have no double jump
+    # (see World.tick) unless left over from an earlier jump, which is not
+    # counted on.
+    fall_steps = int((2 * max_fall * physics.tile_y / physics.g) ** 0.5 /
+                     physics.dt)
+    walk_off = {}
+    for direction in (-1, 1):
+        start = direction * physics.tile_x
+        walk_off[direction] = arc_tree(physics, (
+            [(start, 0, False, 0)] +
+            list(simulate(physics, direction, begin, turn, 0.0, None, start))
+            for turn in (-1, 0, 1)
+            for begin in range(0, fall_steps, steer_steps)))
+    arc_cache[physics] = (jump, walk_off)
+    return arc_cache[physics]
+
+# Mask of origins i whose cell i + offset is set in mask, and back.
+def to_origins(mask, offset):
+    return mask >> offset if offset >= 0 else mask << -offset
+
+def to_cells(mask, offset):
+    return mask << offset if offset >= 0 else mask >> -offset
+
+# Indices of the set bits of mask.
+def bits(mask):
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+def count_bits(mask):
+    return bin(mask).count('1')
+
+# Seeds extended both ways over the runs of set bits, step bits apart, they
+# are in. Runs are at most length long.
+def fill(seeds, runs, step, length):
+    up = down = seeds
+    up_runs = down_runs = runs
+    shift = step
+    while shift < step * length and (up_runs or down_runs):
+        up |= up_runs & (up << shift)
+        up_runs &= up_runs << shift
+        down |= down_runs & (down >> shift)
+        down_runs &= down_runs >> shift
+        shift *= 2
+    return up | down
+
+def add_move(moves, offset, mask, steps):
+    entry = moves.get(offset)
+    if entry is None:
+        moves[offset] = [mask, steps]
+    else:
+        entry[0] |= mask
+        entry[1] = min(entry[1], steps)
+
+# Result of analyze().
+class Report(object):
+
+    def __init__(self, analyzer):
+        self.width = analyzer.width
+        self.height = analyzer.height
+        self.spawn = analyzer.spawn
+        self.doors = analyzer.positions(analyzer.doors)
+        # Reachable standing positions.
+        self.positions = count_bits(analyzer.reach)
+        self.coins = count_bits(analyzer.coins)
+        self.unreachable_coins = analyzer.positions(
+            analyzer.coins & ~analyzer.collected)
+        self.door_reachable = analyzer.path is not None
+        # Cells on the way from the spawn to the door where the player lets
+        # go of the keys, lands and jumps or walks off, jumps and falls on
+        # the way and fixed steps it takes.
+        self.path = analyzer.path
+        self.jumps = analyzer.jumps
+        self.path_steps = analyzer.path_steps
+        self.solvable = self.door_reachable and not self.unreachable_coins
+
+    def summary(self):
+        lines = ["%dx%d level, %d reachable positions, %d coins"
+                 % (self.width, self.height, self.positions, self.coins)]
+        if self.unreachable_coins:
+            shown = self.unreachable_coins[:20]
+            lines.append("%d unreachable coins: %s%s" % (
+                len(self.unreachable_coins),
+                " ".join("%d,%d" % position for position in shown),
+                " ..." if len(shown) < len(self.unreachable_coins) else ""))
+        if not self.doors:
+            lines.append("no door")
+        elif self.door_reachable:
+            lines.append("door reachable with %d jumps and falls, %d steps "
+                         "(%.1f s)" % (self.jumps, self.path_steps,
+                                       self.path_steps * roborun.fixed_dt))
+            shown = self.path[:20]
+            lines.append("path: %s%s" % (
+                " ".join("%d,%d" % position for position in shown),
+                " ..." if len(shown) < len(self.path) else ""))
+        else:
+            lines.append("door not reachable")
+        lines.append("solvable" if self.solvable else "NOT solvable")
+        return '\n'.join(lines)
+
+class Analyzer(object):
+
+    def __init__(self, level, physics=None):
+        self.physics = physics or game_physics()
+        self.jump, self.walk_off = jump_arcs(self.physics)
+        if isinstance(level, CompiledLevel):
+            self.width = level.width
+            self.height = level.height
+            self.spawn = level.spawn
+        else:
+            rows = [row.encode('ascii') if isinstance(row, str) else row
+                    for row in level]
+            self.width = max(len(row) for row in rows)
+            self.height = len(rows)
+            self.spawn = None
+            for y, row in enumerate(rows):
+                if b'S' in row:
+                    self.spawn = (row.index(b'S'), y)
+            if self.spawn is None:
+                raise ValueError("Level has no spawn position S.")
+        # Column x of the masks starts at bit x * stride and row y is
+        # pad_top bits further. The rows above and below are empty and arcs
+        # never go further, so they stay in their column.
+        nodes = self.jump + self.walk_off[-1] + self.walk_off[1]
+        self.pad_top = -min(node[2] for node in nodes)
+        pad_bottom = max(node[3] for node in nodes) + 1
+        self.stride = -(-(self.pad_top + self.height + pad_bottom) // 8) * 8
+        # Chunks of the search, moves go at most into the next chunk.
+        self.chunk_columns = max(chunk_columns, max(
+            max(-node[0], node[1]) for node in nodes) + 1)
+        self.chunk_bits = self.chunk_columns * self.stride
+        self.chunks = -(-self.width // self.chunk_columns)
+        self.size = self.chunks * self.chunk_bits // 8 # Bytes of a mask.
+        if isinstance(level, CompiledLevel):
+            self.read_compiled(level)
+        else:
+            self.read_rows(rows)
+        self.walk_steps = (self.physics.tile_x / self.physics.speed /
+                           self.physics.dt)
+        inside = self.repeat(((1 << self.height) - 1) << self.pad_top)
+        on_tiles = ~self.tiles & (self.tiles >> 1)
+        self.stand = on_tiles & inside
+        # Falls stop on tiles, above the level too, and in the last row of
+        # every column.
+        stops = self.split(on_tiles | self.repeat(1 << (self.stride - 1)))
+        self.full = (1 << self.chunk_bits) - 1
+        self.falls = [self.full ^ stop for stop in stops]
+        self.stand_chunks = self.split(self.stand)
+        self.door_chunks = self.split(self.doors)
+        # Found by find_moves, with masks split into chunks. Moves as
+        # (offset, steps, chunks) and by chunk as (mask, shift): a jump
+        # lands, or the player lets go to drop straight down, at the offset
+        # from the positions in the mask. Coin touches as {(left, right, y):
+        # chunks} by columns and row of the cells the player covers and door
+        # touches by the cell of the player's center as {(x, y): [steps,
+        # chunks]}.
+        self.moves = []
+        self.chunk_moves = [[] for k in range(self.chunks)]
+        self.touches = {}
+        self.door_touches = {}
+        # Search results. Reachable positions by chunk, and (new positions,
+        # drop starts, landings) of each round, as {chunk: mask}.
+        self.reached = [0] * self.chunks
+        self.rounds = []
+        self.reach = 0
+        self.collected = 0
+        # (round, position, steps, cell) where the door is reached, cell is
+        # the door when touched in a jump from position.
+        self.door = None
+        self.path = None
+        self.jumps = None
+        self.path_steps = None
+
+    def index(self, x, y):
+        return x * self.stride + self.pad_top + y
+
+    def position(self, index):
+        x, row = divmod(index, self.stride)
+        return x, row - self.pad_top
+
+    # Positions of the set bits of mask, column by column.
+    def positions(self, mask):
+        return [self.position(index) for index in bits(mask)]
+
+    # Mask with pattern in every column of the level.
+    def repeat(self, pattern):
+        column = pattern.to_bytes(self.stride // 8, 'little')
+        return int.from_bytes(column * self.width, 'little')
+
+    # Mask of rows of b'0' and b'1', all as wide as the level.
+    def pack(self, rows):
+        size = self.stride // 8
+        empty = bytes(size)
+        columns = []
+        for column in zip(*rows):
+            value = int(bytes(column)[::-1], 2)
+            columns.append((value << self.pad_top).to_bytes(size, 'little')
+                           if value else empty)
+        return int.from_bytes(b''.join(columns), 'little')
+
+    # Mask of the given (x, y) cells.
+    def mark(self, cells):
+        data = bytearray(self.size)
+        for x, y in cells:
+            index = self.index(x, y)
+            data[index >> 3] |= 1 << (index & 7)
+        return int.from_bytes(data, 'little')
+
+    def split(self, mask):
+        data = mask.to_bytes(self.size, 'little')
+        size = self.chunk_bits // 8
+        return [int.from_bytes(data[start:start + size], 'little')
+                for start in range(0, self.size, size)]
+
+    # Chunks first - 1 ... last of a mask in bytes, as one mask.
+    def band(self, data, first, last):
+        size = self.chunk_bits // 8
+        mask = int.from_bytes(data[max(0, first - 1) * size:(last + 1) * size],
+                              'little')
+        return mask << self.chunk_bits if first == 0 else mask
+
+    # Chunks first ... last - 1 of a mask made by band into chunks.
+    def unband(self, mask, first, last, chunks):
+        for k in range(first, last):
+            chunks[k] = mask >> ((k - first + 1) * self.chunk_bits) & self.full
+
+    # Window of chunks k - 1 ... k + 1 ORed into chunks, {chunk: mask}.
+    def spread(self, window, k, chunks):
+        for j in range(k - 1, k + 2):
+            part = window & self.full
+            window >>= self.chunk_bits
+            if part and 0 <= j < self.chunks:
+                chunks[j] = chunks.get(j, 0) | part
+
+    def join(self, chunks):
+        size = self.chunk_bits // 8
+        return int.from_bytes(b''.join(chunk.to_bytes(size, 'little')
+                                       for chunk in chunks), 'little')
+
+    def read_rows(self, rows):
+        width = self.width
+        self.tiles = self.pack([row.ljust(width).translate(levels.tile_bits)
+                                for row in rows])
+        coins = []
+        doors = []
+        for y, row in enumerate(rows):
+            for element, cells in ((b'C', coins), (b'D', doors)):
+                x = row.find(element)
+                while x >= 0:
+                    cells.append((x, y))
+                    x = row.find(element, x + 1)
+        self.coins = self.mark(coins)
+        self.doors = self.mark(doors)
+
+    def read_compiled(self, level):
+        row_bytes = level.row_bytes
+        digits = '0%db' % (row_bytes * 8)
+        # Bitmap has column 0 in the highest bit.
+        self.tiles = self.pack([
+            format(int.from_bytes(level.bitmap[y * row_bytes:
+                                               (y + 1) * row_bytes], 'big'),
+                   digits)[:level.width].encode('ascii')
+            for y in range(level.height)])
+        entities = list(level.entity_list())
+        self.coins = self.mark((x, y) for kind, x, y in entities
+                               if kind == 'C')
+        self.doors = self.mark((x, y) for kind, x, y in entities
+                               if kind == 'D')
+
+    # Follow arc tree from origins, adding the moves and touches. masks has
+    # the tiles, coins and doors, shifted keeps them shifted.
+    def follow(self, tree, origins, masks, moves, touches, door_touches,
+               shifted):
+        stride = self.stride
+        # Cells of columns left and right in row y.
+        def cells(kind, left, right, y):
+            key = (kind, left, right, y)
+            mask = shifted.get(key)
+            if mask is None:
+                mask = to_origins(masks[kind], left * stride + y)
+                if right != left:
+                    mask |= to_origins(masks[kind], right * stride + y)
+                shifted[key] = mask
+            return mask
+        coins = masks['coins']
+        doors = masks['doors']
+        # (index, mask) of the nodes on the way to the current one.
+        stack = []
+        i = 0
+        size = len(tree)
+        while i < size:
+            (left, right, top, bottom, falling, center_x, center_y, steps,
+             parent, end, new_columns) = tree[i]
+            while stack and stack[-1][0] != parent:
+                stack.pop()
+            mask = stack[-1][1] if stack else origins
+            # Masks are kept positive, x ^ (x & y) is x & ~y.
+            blocked = cells('tiles', left, right, top)
+            if bottom != top:
+                below = cells('tiles', left, right, bottom)
+                if falling:
+                    landing = mask & below
+                    landing ^= landing & blocked
+                    for column in (left, right) if left != right else (left,):
+                        hits = landing & cells('tiles', column, column, bottom)
+                        if hits:
+                            add_move(moves, (column, top), hits, steps)
+                blocked = blocked | below
+            mask ^= mask & blocked
+            if not mask:
+                i = end
+                continue
+            stack.append((i, mask))
+            if coins:
+                for row in (top, bottom) if bottom != top else (top,):
+                    hits = mask & cells('coins', left, right, row)
+                    if hits:
+                        key = (left, right, row)
+                        touches[key] = touches.get(key, 0) | hits
+            if doors:
+                hits = mask & cells('doors', center_x, center_x, center_y)
+                if hits:
+                    add_move(door_touches, (center_x, center_y), hits, steps)
+            # Letting go of the keys here drops the player straight down.
+            for column in new_columns:
+                add_move(moves, (column, bottom), mask, steps)
+            i += 1
+
+    # Find the moves from every position of the level.
+    def find_moves(self):
+        stride = self.stride
+        chunks = self.chunks
+        data = dict((kind, getattr(self, kind).to_bytes(self.size, 'little'))
+                    for kind in ('tiles', 'coins', 'doors', 'stand'))
+        moves = {}
+        for first in range(0, chunks, band_chunks):
+            last = min(first + band_chunks, chunks)
+            # A chunk more on both sides for where the moves go.
+            masks = dict((kind, self.band(mask, first, last))
+                         for kind, mask in data.items())
+            core = (((1 << ((last - first) * self.chunk_bits)) - 1) <<
+                    self.chunk_bits)
+            stand = masks['stand'] & core
+            tiles = masks['tiles']
+            band_moves = {}
+            touches = {}
+            door_touches = {}
+            shifted = {}
+            self.follow(self.jump, stand, masks, band_moves, touches,
+                        door_touches, shifted)
+            for direction in (-1, 1):
+                # Next cell empty and without a tile under it.
+                edges = stand & ~(to_origins(tiles, direction * stride) |
+                                  to_origins(tiles, direction * stride + 1))
+                self.follow(self.walk_off[direction], edges, masks,
+                            band_moves, touches, door_touches, shifted)
+            for key, mask in touches.items():
+                self.unband(mask, first, last,
+                            self.touches.setdefault(key, [0] * chunks))
+            for into, found in ((moves, band_moves),
+                                (self.door_touches, door_touches)):
+                for key, (mask, steps) in found.items():
+                    entry = into.setdefault(key, [steps, [0] * chunks])
+                    entry[0] = min(entry[0], steps)
+                    self.unband(mask, first, last, entry[1])
+        for (x, y), (steps, masks) in moves.items():
+            offset = x * stride + y
+            self.moves.append((offset, steps, masks))
+            for k, mask in enumerate(masks):
+                if mask:
+                    # Shifted into a window starting a chunk before.
+                    self.chunk_moves[k].append((mask,
+                                                offset + self.chunk_bits))
+        self.door_origins = [0] * chunks
+        for steps, masks in self.door_touches.values():
+            for k, mask in enumerate(masks):
+                self.door_origins[k] |= mask
+
+    # Positions in seeds, {chunk: mask}, get reachable and the player walks
+    # on from them. Returns the new positions.
+    def walk(self, seeds):
+        stride = self.stride
+        chunk_columns = self.chunk_columns
+        last_column = self.chunk_bits - stride
+        column = (1 << stride) - 1
+        stand = self.stand_chunks
+        reached = self.reached
+        new = {}
+        todo = list(seeds.items())
+        while todo:
+            k, mask = todo.pop()
+            mask &= ~reached[k]
+            if not mask:
+                continue
+            mask = fill(mask, stand[k], stride, chunk_columns) & ~reached[k]
+            reached[k] |= mask
+            new[k] = new.get(k, 0) | mask
+            # Walking on into the next chunks.
+            if k + 1 < self.chunks:
+                edge = (mask >> last_column) & stand[k + 1] & ~reached[k + 1]
+                if edge:
+                    todo.append((k + 1, edge))
+            if k > 0:
+                edge = ((mask & column) << last_column) & stand[k - 1] & \
+                    ~reached[k - 1]
+                if edge:
+                    todo.append((k - 1, edge))
+        return new
+
+    # Drop straight down from starts, {chunk: mask}, and walk on from the
+    # landings, as one round of the search. Returns the new positions.
+    def fall(self, starts):
+        landings = {}
+        for k, mask in starts.items():
+            falls = self.falls[k]
+            # Starts on a tile land right there, the carry of the others
+            # runs down to the next tile.
+            land = (((falls + (mask & falls)) | mask) & self.stand_chunks[k] &
+                    ~self.reached[k])
+            if land:
+                landings[k] = land
+        new = self.walk(landings)
+        self.rounds.append((new, starts, landings))
+        return new
+
+    # Breadth first search from the spawn, one round per jump or fall.
+    def explore(self):
+        self.find_moves()
+        k, bit = divmod(self.index(*self.spawn), self.chunk_bits)
+        new = self.fall({k: 1 << bit})
+        while new:
+            if self.door is None:
+                self.find_door(new)
+            starts = {}
+            for k, mask in new.items():
+                window = 0
+                for hits, shift in self.chunk_moves[k]:
+                    hits &= mask
+                    if hits:
+                        window |= hits << shift
+                self.spread(window, k, starts)
+            new = self.fall(starts)
+        self.reach = self.join(self.reached)
+        if self.door is not None:
+            self.path_to(*self.door)
+        self.collect()
+
+    # Check for the door in the positions new in the last round.
+    def find_door(self, new):
+        chunk_bits = self.chunk_bits
+        round = len(self.rounds) - 1
+        for k in sorted(new):
+            standing = new[k] & self.door_chunks[k]
+            if standing:
+                self.door = (round, k * chunk_bits + next(bits(standing)), 0,
+                             None)
+                return
+        for k in sorted(new):
+            touching = new[k] & self.door_origins[k]
+            if touching:
+                bit = next(bits(touching))
+                origin = k * chunk_bits + bit
+                steps, x, y = min(
+                    (steps, x, y) for (x, y), (steps, masks)
+                    in self.door_touches.items() if masks[k] >> bit & 1)
+                self.door = (round, origin, steps,
+                             origin + x * self.stride + y)
+                return
+
+    def has(self, chunks, index):
+        k, bit = divmod(index, self.chunk_bits)
+        return chunks.get(k, 0) >> bit & 1
+
+    # Move from the positions in new to the drop start, as (position,
+    # steps).
+    def find_origin(self, start, new):
+        chunk_bits = self.chunk_bits
+        best = None
+        for offset, steps, chunks in self.moves:
+            origin = start - offset
+            k, bit = divmod(origin, chunk_bits)
+            if (0 <= k < self.chunks and chunks[k] >> bit & 1 and
+                    new.get(k, 0) >> bit & 1 and
+                    (best is None or steps < best[1])):
+                best = (origin, steps)
+        return best
+
+    # Go back from where the door is reached through the rounds of the
+    # search.
+    def path_to(self, round, target, steps, door_cell):
+        stride = self.stride
+        physics = self.physics
+        path = [door_cell] if door_cell is not None else []
+        self.jumps = round + (door_cell is not None)
+        while True:
+            new, starts, landings = self.rounds[round]
+            path.append(target)
+            # Walked from where the player landed.
+            landing = target
+            if not self.has(landings, landing):
+                for direction in (-stride, stride):
+                    landing = target + direction
+                    while (self.has(new, landing) and
+                           not self.has(landings, landing)):
+                        landing += direction
+                    if self.has(landings, landing):
+                        break
+            steps += abs(landing - target) // stride * self.walk_steps
+            path.append(landing)
+            # Fell from where the player let go.
+            start = landing
+            while not self.has(starts, start):
+                start -= 1
+            steps += (2 * (landing - start) * physics.tile_y /
+                      physics.g) ** 0.5 / physics.dt
+            path.append(start)
+            if round == 0:
+                break
+            round -= 1
+            target, move_steps = self.find_origin(start,
+                                                  self.rounds[round][0])
+            steps += move_steps
+        path.reverse()
+        self.path = []
+        for index in path:
+            position = self.position(index)
+            if not self.path or self.path[-1] != position:
+                self.path.append(position)
+        self.path_steps = steps
+
+    # Coins touched from reachable positions.
+    def collect(self):
+        stride = self.stride
+        reached = self.reached
+        touched = {}
+        for (left, right, row), masks in self.touches.items():
+            # Into a window starting a chunk before.
+            left = left * stride + row + self.chunk_bits
+            right = right * stride + row + self.chunk_bits
+            for k, mask in enumerate(masks):
+                hits = mask & reached[k]
+                if hits:
+                    self.spread(hits << left | hits << right, k, touched)
+        self.collected = (self.reach | self.join(
+            touched.get(k, 0) for k in range(self.chunks))) & self.coins
+
+    def analyze(self):
+        self.explore()
+        return Report(self)
+
+# Analyze world template (list of rows), LevelFile or CompiledLevel.
+def analyze(level, physics=None):
+    return Analyzer(level, physics).analyze()
+
+if __name__ == '__main__':
+    solvable = True
+    for name in sys.argv[1:] or ['world0', 'world1', 'world2', 'world3']:
+        level = getattr(roborun, name, None)
+        if not isinstance(level, list):
+            # Not one of the built in world templates, a level file.
+            level = roborun.open_world(name)
+        report = analyze(level)
+        print(name)
+        print(report.summary())
+        solvable = solvable and report.solvable
+    sys.exit(0 if solvable else 1)
@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import zlib
+import struct
+import hashlib
+
+# Input recording and replay.
+# The recorder writes the inputs and dt of every frame to a compact binary
+# log. Replaying feeds them back to World.step without a display, as fast as
+# possible, and compares a checksum of the final world state with the one
+# stored at the end of the recording.
+# Replay: python replay.py recording.rrr [--capture path]
+# With --capture the frames are also drawn off-screen and written to path
+# as raw video or numbered images, see capture.py.
+#
+# File layout, integers little endian:
+#   header: magic b'RRREPLAY', version (uint8), vectorized (uint8),
+#           world kind (uint8), world size (uint32), world
+#           World kind 0: world is a zlib compressed compiled level (see
+#           levels.CompiledLevel), so the recording works on its own.
+#           World kind 1: world is the utf-8 path of a level file.
+#   frames: flags (uint8), then jump and shoot (uint8 each) if flag_counts,
+#           then dt in milliseconds (uint16) if flag_dt_ms, or dt (float64)
+#           if neither flag_dt_ms nor flag_dt_same is set.
+#   end: end_marker (uint8), frames (uint32), ticks (uint32), sha1 checksum
+#        (20 bytes).
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+import roborun
+import levels
+from atlas import Atlas
+from capture import FrameCapture, make_writer
+
+magic = b'RRREPLAY'
+version = 3 # Monsters move in legs from wall to wall, see Monster.
+header_format = struct.Struct('<8sBBBI')
+end_format = struct.Struct('<II20s')
+
+flag_left = 1
+flag_right = 2
+flag_counts = 4 # Jump and shoot counts follow.
+flag_dt_same = 8 # Same dt as previous frame.
+flag_dt_ms = 16 # dt is a whole amount of milliseconds, like clock.tick gives.
+end_marker = 255
+
+# Checksum of everything that can change while the world runs.
+def world_checksum(world):
+    world.wake_all()
+    digest = hashlib.sha1()
+    player = world.player
+    digest.update(repr((
+        world.ticks, world.lives, world.shoot_count, world.coins_collected,
+        tuple(player.rect), player.x, player.y, player.velocity_x,
+        player.velocity_y, player.jumping, player.double_jump_ready,
+        player.hit_time, player.clip, player.winning)).encode())
+    # In insertion order, which doesn't depend on what was removed and put
+    # back, e.g. by restoring a snapshot.
+    entity_hash = world.entity_hash
+    kinds = entity_hash.kinds
+    for sprite in sorted(kinds, key=entity_hash.order.__getitem__):
+        kind = kinds[sprite]
+        digest.update(repr((kind, tuple(sprite.rect),
+                            getattr(sprite, 'velocity_x', None),
+                            getattr(sprite, 'is_open', None))).encode())
+    for fireball in world.all_fireballs:
+        digest.update(repr(('fireball', tuple(fireball.rect),
+                            fireball.lifetime)).encode())
+    return digest.digest()
+
+class Recorder(object):
+
+    # world is the template, CompiledLevel or LevelFile the game was made
+    # from, in the state before the first frame.
+    def __init__(self, path, world, vectorized=False):
+        self.file = open(path, 'wb')
+        if isinstance(world, levels.LevelFile):
+            kind = 1
+            data = os.path.abspath(world.path).encode('utf-8')
+        else:
+            kind = 0
+            if not isinstance(world, levels.CompiledLevel):
+                world = levels.compile_level(world)
+            data = zlib.compress(world.to_bytes())
+        self.file.write(header_format.pack(magic, version, int(vectorized),
+                                           kind, len(data)))
+        self.file.write(data)
+        self.frames = 0
+        self.last_dt = None
+
+    def frame(self, dt, inputs):
+        flags = 0
+        if inputs.left:
+            flags |= flag_left
+        if inputs.right:
+            flags |= flag_right
+        data = b''
+        if inputs.jump or inputs.shoot:
+            flags |= flag_counts
+            data += struct.pack('<BB', inputs.jump, inputs.shoot)
+        if dt == self.last_dt:
+            flags |= flag_dt_same
+        else:
+            ms = round(dt * 1000)
+            if ms / 1000 == dt and 0 <= ms < 65536:
+                flags |= flag_dt_ms
+                data += struct.pack('<H', ms)
+            else:
+                data += struct.pack('<d', dt)
+        self.file.write(bytes((flags,)) + data)
+        self.last_dt = dt
+        self.frames += 1
+
+    # End recording with the checksum of game world in its final state.
+    def close(self, game):
+        self.file.write(bytes((end_marker,)) + end_format.pack(
+            self.frames, game.ticks, world_checksum(game)))
+        self.file.close()
+
+class Recording(object):
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        (file_magic, file_version, self.vectorized, kind,
+         size) = header_format.unpack_from(data)
+        if file_magic != magic or file_version != version:
+            raise ValueError("Not a Roborun recording: " + path)
+        start = header_format.size
+        world = data[start:start + size]
+        if kind == 0:
+            self.world = levels.CompiledLevel.from_bytes(
+                zlib.decompress(world))
+        else:
+            self.world = levels.LevelFile(world.decode('utf-8'))
+        self.data = data
+        self.start = start + size
+        self.ticks = self.checksum = None
+
+    # (dt, Inputs) of every frame. Reads the end of the recording too.
+    def frames(self):
+        data = self.data
+        i = self.start
+        dt = None
+        Inputs = roborun.Inputs
+        while True:
+            flags = data[i]
+            i += 1
+            if flags == end_marker:
+                frames, self.ticks, self.checksum = end_format.unpack_from(
+                    data, i)
+                return
+            jump = shoot = 0
+            if flags & flag_counts:
+                jump, shoot = data[i], data[i + 1]
+                i += 2
+            if flags & flag_dt_ms:
+                dt = struct.unpack_from('<H', data, i)[0] / 1000
+                i += 2
+            elif not flags & flag_dt_same:
+                dt = struct.unpack_from('<d', data, i)[0]
+                i += 8
+            yield dt, Inputs(bool(flags & flag_left), bool(flags & flag_right),
+                             jump, shoot)
+
+    def make_world(self, atlas):
+        if isinstance(self.world, levels.LevelFile):
+            return roborun.StreamingWorld(self.world, atlas, self.vectorized)
+        return roborun.World(self.world, atlas, self.vectorized)
+
+# Replay recording at path headless. Returns a result dict, 'match' tells if
+# the final state is the same as when recording. If capture (a FrameCapture)
+# is given, every frame is drawn like in the game on an off-screen window
+# and captured.
+def replay(path, atlas=None, capture=None):
+    if atlas is None:
+        atlas = Atlas(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'assets'))
+    recording = Recording(path)
+    world = recording.make_world(atlas)
+    renderer = None
+    if capture is not None:
+        window = pygame.Surface(roborun.window_size)
+        renderer = roborun.Renderer(window, world)
+    frames = 0
+    start = time.perf_counter()
+    for dt, inputs in recording.frames():
+        if renderer is not None:
+            renderer.camera.update(world.player, dt)
+        world.step(dt, inputs)
+        if renderer is not None:
+            renderer.draw()
+            capture.frame(window)
+        frames += 1
+    elapsed = time.perf_counter() - start
+    checksum = world_checksum(world)
+    return {
+        'frames': frames,
+        'ticks': world.ticks,
+        'checksum': checksum.hex(),
+        'recorded_checksum': recording.checksum.hex(),
+        'match': checksum == recording.checksum and
+                 world.ticks == recording.ticks,
+        'elapsed': elapsed,
+        'steps_per_sec': world.ticks / elapsed if elapsed > 0 else 0.0,
+    }
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Replay a Roborun recording headless and check its final state.")
+    parser.add_argument('recording')
+    parser.add_argument('--capture', metavar='PATH',
+                        help="write the frames to PATH: raw video ('-' for "
+                        "stdout), or numbered images if PATH has a %%d")
+    args = parser.parse_args()
+    # Raw video to stdout leaves only stderr for messages.
+    out = sys.stderr if args.capture == '-' else sys.stdout
+    capture = None
+    if args.capture:
+        pygame.init()
+        # No frames are dropped, the replay waits for the writer instead.
+        capture = FrameCapture(make_writer(args.capture), roborun.window_size,
+                               wait=True)
+        print("Capturing %dx%d %s frames to %s"
+              % (roborun.WIDTH, roborun.HEIGHT, capture.pixel_format,
+                 args.capture), file=out)
+    result = replay(args.recording, capture=capture)
+    if capture is not None:
+        capture.close()
+        print(capture.report(), file=out)
+    print("%d frames, %d steps in %.3f s (%.0f steps/s), checksum %s: %s"
+          % (result['frames'], result['ticks'], result['elapsed'],
+             result['steps_per_sec'], result['checksum'],
+             'match' if result['match'] else
+             'MISMATCH, recorded ' + result['recorded_checksum']), file=out)
+    sys.exit(0 if result['match'] else 1)
@@ -1,19 +1,26 @@
 import pygame
 import traceback
 import os
+import sys
+import time
+from collections import namedtuple
+from atlas import Atlas
+from tilemap import TileChunks
+from collision import TileGrid, SpatialHash
+import levels
+from levels import LevelFile, CompiledLevel
+from profiler import FrameProfiler
+from preload import Preloader, Transition
+from snapshot import Snapshotter, SnapshotRing
+from capture import FrameCapture, make_writer
+from hotreload import LevelWatcher
 
 #===============================================================================
 # TODO:
-# - Parent class for all sprites for collisiondetection and animation etc.
-# - Divide code into separate files for clarity.
-# - Make world loader and place worlds in text files.
 # - Sound effects!
 # - Optimize g and player movement variables for wanted world dynamics.
-# - Optimize rendering, by drawing only the sprites inside game window.
-# - Level loader class.
 # - Center camera starting position accordding to player spawn position.
 # - Start up screen and world selection?
-# - Conversion to int in camera_speed causes jerk in camera movement. Fix???
 #
 #===============================================================================
 
@@ -29,31 +36,35 @@ backround_color = GREY
 
 FPS = 60 # Target screen refresh rate.
 max_dt = 1 / 20 # Cap for delta time.
+fixed_dt = 1 / FPS # Simulation time step, the world always advances by this.
 animation_speed = 6
 tile_x = 32
 tile_y = 32
 camera_speed = 0.06 # Smooth scrolling, how fast camera catches the player. def = 0.06
 borders = False # If True camera wont show stuff outside world borders.
 
-lives = 10
-reset_lives = lives
+lives = 10 # Lives at start.
 g = 1500 # Gravitational acceleration. def = 1500
 shoot_count = 10 # Amount of fireballs that can be on air at once.
-reset_fire = shoot_count
 fireball_lifetime = 250 # def = 250
 fireball_speed = 250 # def = 250
+fireball_pool_size = shoot_count # Fireballs made in advance, pool grows if needed.
 player_speed = 200 # def = 200
 player_jump_speed = 500 # How high player can jump. def = 500
-double_jump = False
+double_jump = True # Allow one more jump while in the air.
 monster_speed = 70 # def = 70
-coins_total = 0
-reset_coins = coins_total
 
 # Game window.
 WIDTH = 960
 HEIGHT = 544
 window_size = [WIDTH, HEIGHT]
 
+# Rendering. Sprites outside the camera view are always culled.
+dirty_rects = False # If True only changed areas are redrawn when camera is still.
+hud_area = pygame.Rect(0, 0, 240, 64) # Window area covered by HUD.
+hud_fps = False # Show frames per second in HUD.
+hud_fireballs = False # Show fireballs in the air in HUD.
+
 # World templates for testing. 960x544 pixels = 30x17 tiles. (1 tile = 32x32 pixels)
 # P = Platform M = monster S = Spawn player C = Coin D = door
 # Choose which one to use from below or create your own. 
@@ -166,45 +177,174 @@ world3 = [
 "PPPPPPPPPPPPPPPPP                                           ",
 ]
 
+
+# Profiling, see profiler.py.
+profile = False # Time each phase of the game loop.
+profile_overlay = True # Show profiler numbers on screen.
+profile_export = None # File (.json or .csv) for profiler data on exit.
+profile_area = pygame.Rect(WIDTH - 220, 0, 220, 180)
+
+# Record inputs of every frame to this file, replay with replay.py. When a
+# new game starts the file is written again.
+record_path = None
+
+# Capture every frame shown to this file as raw video, or to numbered
+# images if it has a %d (e.g. 'frames/%05d.png'), see capture.py. Frames
+# the writer can't keep up with are dropped, not waited for.
+capture_path = None
+
 # Choose which world to use.
 world = world0
+world_path = None # Plain world or level file the world was loaded from.
+
+# Reload the world file given as argument when it's saved, applying only
+# what changed to the running game, see hotreload.py. Not while recording.
+watch = False
+
+# Change of level when the door is reached. The next level is prepared on a
+# background thread while the current one is played, see preload.py.
+next_world = world1 # World played after the door is reached.
+preload = True # If False the next level is built only when it's needed.
+level_pause = 2.0 # Seconds the finished level stays on screen.
+
+# Rewind by holding rewind_key, see snapshot.py. Not available while
+# recording or in streamed level files.
+rewind = True
+rewind_key = pygame.K_BACKSPACE
+rewind_seconds = 5 # Seconds of play kept for rewinding.
+
+# Monsters far from the player sleep and catch up when they wake, see
+# lod.py. Not used with vectorized monsters or in streamed level files.
+lod = True
+
+# Streaming of big level files, see StreamingWorld.
+region_width = 32 # Columns of tiles loaded and evicted together.
+load_distance = WIDTH * 1.5 # Regions closer to player than this are loaded.
+evict_distance = WIDTH * 3 # Regions further from player than this are evicted.
 
-# Set ground level where player falls without platform.
-GROUND = len(world) * tile_y + 2048
+# Open level file (see levels.py) for streaming, load compiled level file,
+# or load plain world file compiled (cached, see levels.load_level).
+def open_world(path):
+    if levels.is_compiled(path):
+        with open(path, 'rb') as f:
+            return levels.CompiledLevel.from_bytes(f.read())
+    with open(path, 'rb') as f:
+        is_level = f.read(len(levels.magic)) == levels.magic
+    if is_level:
+        return LevelFile(path)
+    return levels.load_level(path)
+
+# Player input for one frame. left and right tell if the keys are held down,
+# jump and shoot how many times the keys were pressed during the frame.
+Inputs = namedtuple('Inputs', ['left', 'right', 'jump', 'shoot'],
+                    defaults=(False, False, 0, 0))
+
+# Animation clips, tuples of frames shared by all sprites of a World (see
+# make_clips). A sprite refers to its clip by index and moving sprites have
+# three clips in a row: standing, moving left, moving right.
+robot_clips = 0
+monster_clips = 3
+fireball_clips = 6
+coin_clip = 9
+
+def make_clips(atlas):
+    robot = atlas.frames('robo', 0, 21)
+    monster = atlas.frames('monster', 0, 11)
+    fireball = atlas.frames('fireball', 1, 7)
+    return (
+        tuple(robot[:1]), tuple(robot[1:11]), tuple(robot[11:21]),
+        tuple(monster[:1]), tuple(monster[1:6]), tuple(monster[6:11]),
+        tuple(fireball[:1]), tuple(fireball[:3]), tuple(fireball[3:6]),
+        tuple(atlas.frames('coin', 1, 10)),
+    )
+
+# pygame's Sprite keeps the groups it is in in a set, which takes more memory
+# than the rest of a coin or a tile. LightSprite keeps them in a list (there
+# are only one or two). pygame's Sprite has no __slots__, so instances still
+# have a __dict__, but it's never made as long as subclasses keep all of
+# their attributes in __slots__.
+# This depends on how pygame's Sprite is written: its methods keep the groups
+# in the private attribute __g, which is _Sprite__g outside the class, and
+# only need it to support in, add, remove, clear and iteration, which a list
+# does. LightSprite doesn't call Sprite.__init__, that would make the set.
+# If a pygame version stops using _Sprite__g, LightSprite would silently
+# break group membership, so it is checked here when the module is loaded.
+for sprite_method in ('add_internal', 'remove_internal', 'kill', 'groups',
+                      'alive'):
+    code = getattr(pygame.sprite.Sprite, sprite_method).__code__
+    if '_Sprite__g' not in code.co_names:
+        raise ImportError("pygame.sprite.Sprite.%s doesn't use _Sprite__g, "
+                          "LightSprite needs updating." % sprite_method)
+
+class LightSprite(pygame.sprite.Sprite):
+    
+    # _Sprite__g holds the groups of pygame's Sprite, see above.
+    __slots__ = ('_Sprite__g',)
+    
+    def __init__(self):
+        self._Sprite__g = []
+    
+    def add_internal(self, group):
+        self._Sprite__g.append(group)
+
+# Parent class for all animated sprites. Attributes live in __slots__, so
+# thousands of coins take little memory. The frame shown is picked from the
+# world's tick count instead of a counter in every sprite, so all sprites
+# showing the same clip are in step and standing still costs nothing.
+class Entity(LightSprite):
+    
+    __slots__ = ('world', 'rect', 'clip')
+    
+    def __init__(self, world, clip, x_location, y_location):
+        LightSprite.__init__(self)
+        self.world = world
+        self.clip = clip
+        self.rect = world.clips[clip][0].get_rect()
+        self.rect.x = x_location
+        self.rect.y = y_location
+    
+    @property
+    def image(self):
+        frames = self.world.clips[self.clip]
+        return frames[self.world.ticks // animation_speed % len(frames)]
+    
+    # Pick standing, left or right clip of the clips starting at first.
+    def face(self, first, velocity_x):
+        if velocity_x < 0:
+            self.clip = first + 1
+        elif velocity_x > 0:
+            self.clip = first + 2
+        else:
+            self.clip = first
 
 # Class for creating player sprite.
-class Robot(pygame.sprite.Sprite):
+class Robot(Entity):
+    
+    __slots__ = ('hit_time', 'speed', 'jump_speed', 'jumping',
+                 'double_jump_ready', 'shooting_right', 'velocity_x',
+                 'velocity_y', 'ground', 'x', 'y', 'winning')
     
-    def __init__(self, x, y):
-        pygame.sprite.Sprite.__init__(self)
+    def __init__(self, world, x, y):
+        Entity.__init__(self, world, robot_clips, x, y)
         self.hit_time = 100
-        self.speed = player_speed
+        self.speed = float(player_speed)
         self.jump_speed = player_jump_speed 
         self.jumping = False
+        self.double_jump_ready = False
         self.shooting_right = True
-        self.velocity_x = 0
-        self.velocity_y = 0
-        self.ground = GROUND
-        self.frame = 0
-        self.images = []
-        self.animation_cycles = 10
-        
-        # Load all the images for player movement animation.
-        for i in range(0,21):
-            img = pygame.image.load(
-                os.path.join(assets, 'robo' + str(i) + '.png')).convert_alpha()
-            self.images.append(img)
-        
-        self.image = self.images[0]
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+        self.velocity_x = 0.0
+        self.velocity_y = 0.0
+        self.ground = world.ground
+        # Exact position, rect is it rounded to whole pixels.
+        self.x = float(x)
+        self.y = float(y)
         self.winning = False
     
     def gravity(self, dt):
         if self.rect.bottom > self.ground and self.velocity_y >= 0:
-            self.velocity_y = 0
+            self.velocity_y = 0.0
             self.rect.bottom = self.ground + 1
+            self.y = float(self.rect.y)
             # Jumping possible when on ground.
             self.jumping = False
         else:
@@ -218,232 +358,276 @@ class Robot(pygame.sprite.Sprite):
         self.jumping = True
 
     def shoot_fireball(self):
-        global shoot_count
-        if shoot_count > 0:
-            shoot_count -= 1
+        world = self.world
+        if world.shoot_count > 0:
+            world.shoot_count -= 1
             if self.shooting_right:
-                fireball = Fireball(fireball_speed, self.rect.x, self.rect.y - 1)
-                all_sprites.add(fireball)
+                fireball = world.fireball_pool.acquire(
+                    fireball_speed, self.rect.x, self.rect.y - 1)
             else:
-                fireball = Fireball(-fireball_speed, self.rect.x, self.rect.y - 1)
-                all_sprites.add(fireball)
+                fireball = world.fireball_pool.acquire(
+                    -fireball_speed, self.rect.x, self.rect.y - 1)
+            world.all_sprites.add(fireball)
+            world.all_fireballs.add(fireball)
+            if world.lod is not None:
+                world.lod.fireball_shot(fireball)
 
     def update(self, dt):
         self.gravity(dt)
         
         # Moving player in x direction. x = x_0 + v_x*t
-        self.rect.x += int(self.velocity_x * dt)
+        self.x += self.velocity_x * dt
+        self.rect.x = round(self.x)
         
         # Collision detection in x direction.
-        colliding_tile = pygame.sprite.spritecollideany(self, all_tiles)
+        colliding_tile = self.world.tile_grid.collide_any(self.rect)
         if colliding_tile is None:
-            self.ground = GROUND
+            self.ground = self.world.ground
         # Hitting wall from left.
         elif self.velocity_x > 0  and self.ground != colliding_tile.rect.top:
             self.rect.right = colliding_tile.rect.left
-            self.velocity_x = 0
+            self.x = float(self.rect.x)
+            self.velocity_x = 0.0
         # Hitting wall from right.
         elif self.velocity_x < 0 and self.ground != colliding_tile.rect.top:
             self.rect.left = colliding_tile.rect.right
-            self.velocity_x = 0
+            self.x = float(self.rect.x)
+            self.velocity_x = 0.0
         
         # Moving player in y direction. y = y_0 + v_y*t
-        self.rect.y += int(self.velocity_y * dt)
+        self.y += self.velocity_y * dt
+        self.rect.y = round(self.y)
         
         # Collision detection in y direction.
-        colliding_tile = pygame.sprite.spritecollideany(self, all_tiles)
+        colliding_tile = self.world.tile_grid.collide_any(self.rect)
         if colliding_tile is None:
-            self.ground = GROUND
-        # Hitting the ceiling.
-        elif self.velocity_y < 0:
+            self.ground = self.world.ground
+        # Hitting the ceiling. Floor tile player stands in is not a ceiling
+        # when jumping starts slower than a pixel per step.
+        elif self.velocity_y < 0 and self.ground != colliding_tile.rect.top:
             self.rect.top = colliding_tile.rect.bottom
-            self.velocity_y = 0
-            self.ground = GROUND
+            self.y = float(self.rect.y)
+            self.velocity_y = 0.0
+            self.ground = self.world.ground
         # Hitting the floor.
         elif self.velocity_y > 0:
-            self.velocity_y = 0
+            self.velocity_y = 0.0
             self.ground = colliding_tile.rect.top
         
+        # Animating player movement.
+        self.face(robot_clips, self.velocity_x)
+    
+    # Handle monsters, coins and doors found touching by the broad-phase.
+    def interact(self, contacts):
         # Check if monsters got you.
-        global lives
-        colliding_monster = pygame.sprite.spritecollideany(self, all_monsters)
+        colliding_monster = contacts.get('monster')
         if (colliding_monster is not None) and (self.hit_time >= 100):
-            lives -= 1
+            self.world.lives -= 1
             self.jump()
             self.hit_time = 0
         self.hit_time += 1
         
-        colliding_coin = pygame.sprite.spritecollideany(self, all_coins)
+        colliding_coin = contacts.get('coin')
         if colliding_coin is not None:
             colliding_coin.kill()
+            self.world.coins_collected += 1
         
-        colliding_door = pygame.sprite.spritecollideany(self, doors)
+        colliding_door = contacts.get('door')
         if colliding_door is not None:
             if colliding_door.is_open and \
             colliding_door.rect.collidepoint(self.rect.center):
                 self.winning = True
-                pygame.time.wait(2000)
-        
-        # Animating player movement.
-        if self.velocity_x < 0:
-            self.image = self.images[self.frame//animation_speed + 1]
-            self.frame += 1
-            if self.frame >= self.animation_cycles * animation_speed:
-                self.frame = 0
-        elif self.velocity_x > 0:
-            self.image = self.images[
-                self.frame//animation_speed + 1 + self.animation_cycles]
-            self.frame += 1
-            if self.frame >= self.animation_cycles * animation_speed:
-                self.frame = 0
-        else:
-            self.image = self.images[0]
 
 # Fireball projectile class which player can shoot.
-class Fireball(pygame.sprite.Sprite):
+class Fireball(Entity):
+    
+    __slots__ = ('velocity_x', 'lifetime', 'x')
 
-    def __init__(self, velocity_x, x_location, y_location):
-        pygame.sprite.Sprite.__init__(self)
-        self.velocity_x = velocity_x
+    def __init__(self, world, velocity_x, x_location, y_location):
+        Entity.__init__(self, world, fireball_clips, x_location, y_location)
+        self.reset(velocity_x, x_location, y_location)
+    
+    # Make fireball as good as new, for reusing it from FireballPool.
+    def reset(self, velocity_x, x_location, y_location):
+        self.velocity_x = float(velocity_x)
         self.lifetime = fireball_lifetime
-        self.frame = 0
-        self.images = []
-        self.animation_cycles = 3
-        for i in range(1,7):
-            img = pygame.image.load(
-                os.path.join(assets, 'fireball' + str(i) + '.png')).convert_alpha()
-            self.images.append(img)
-        self.image = self.images[0]
-        self.rect  = self.image.get_rect()
         self.rect.x = x_location
         self.rect.y = y_location
+        self.x = float(x_location)
+        # Animating fireball movement.
+        self.face(fireball_clips, velocity_x)
     
     def update(self, dt):
-        global shoot_count
-        self.rect.x += int(self.velocity_x * dt)
+        self.x += self.velocity_x * dt
+        self.rect.x = round(self.x)
+    
+    # Handle monsters found touching by the broad-phase, tiles and lifetime.
+    def interact(self, contacts):
+        world = self.world
         
         # Check if fireball hits monsters.
-        colliding_monster = pygame.sprite.spritecollideany(self, all_monsters)
+        colliding_monster = contacts.get('monster')
         if colliding_monster is None:
             self.lifetime -= 1
         else:
             colliding_monster.kill()
-            shoot_count += 1
+            world.shoot_count += 1
             self.kill()
         
         # Check if fireball hits tiles.
-        colliding_tile = pygame.sprite.spritecollideany(self, all_tiles)
+        colliding_tile = world.tile_grid.collide_any(self.rect)
         if colliding_tile is not None:
-            shoot_count += 1
+            world.shoot_count += 1
             self.kill()
         
         if self.lifetime == 0:
-            shoot_count += 1
+            world.shoot_count += 1
             self.kill()
+    
+    # Killed fireballs go back to the pool.
+    def kill(self):
+        if self.alive():
+            pygame.sprite.Sprite.kill(self)
+            self.world.fireball_pool.release(self)
+
+# Fireballs that are not in the air, reused when player shoots so shooting
+# doesn't create any objects. Pool grows when more fireballs are in the air
+# than it was made for, reserve() makes room in advance for stress modes
+# with a big shoot_count.
+class FireballPool(object):
+    
+    # size defaults to the fireball_pool_size setting at the time.
+    def __init__(self, world, size=None):
+        self.world = world
+        self.free = []
+        self.created = 0
+        if size is None:
+            size = fireball_pool_size
+        self.reserve(size)
+    
+    def __len__(self):
+        return len(self.free)
+    
+    # Make sure there are at least count fireballs in the pool.
+    def reserve(self, count):
+        while len(self.free) < count:
+            self.free.append(Fireball(self.world, 0, 0, 0))
+            self.created += 1
+    
+    # Fireball flying with velocity_x from given position, not yet in any
+    # group.
+    def acquire(self, velocity_x, x_location, y_location):
+        if not self.free:
+            self.reserve(1)
+        fireball = self.free.pop()
+        fireball.reset(velocity_x, x_location, y_location)
+        return fireball
+    
+    def release(self, fireball):
+        self.free.append(fireball)
         
-        # Animating fireball movement.
-        if self.velocity_x < 0:
-            self.image = self.images[self.frame//animation_speed]
-            self.frame += 1
-            if self.frame >= self.animation_cycles * animation_speed:
-                self.frame = 0
-        elif self.velocity_x > 0:
-            self.image = self.images[self.frame//animation_speed + self.animation_cycles]
-            self.frame += 1
-            if self.frame >= self.animation_cycles * animation_speed:
-                self.frame = 0
-        else:
-            self.image = self.images[0]
-        
-# Simple monster class.
-class Monster(pygame.sprite.Sprite):
-    
-    def __init__(self, x_location, y_location):
-        pygame.sprite.Sprite.__init__(self)
-        self.velocity_x = monster_speed
-        self.velocity_y = 0
-        self.frame = 0
-        self.images = []
-        self.animation_cycles = 5
-        for i in range(0,11):
-            img = pygame.image.load(
-                os.path.join(assets, 'monster' + str(i) + '.png')).convert_alpha()
-            self.images.append(img)
-        self.image = self.images[0]
-        self.rect  = self.image.get_rect()
-        self.rect.x = x_location
-        self.rect.y = y_location
+# Simple monster class. Monsters patrol in legs from wall to wall: the
+# position is the leg's start plus leg_steps steps, computed rather than
+# summed step by step, so it can also be computed for any step ahead (see
+# lod.py).
+class Monster(Entity):
+    
+    __slots__ = ('velocity_x', 'x', 'leg_x', 'leg_steps', 'asleep')
+    
+    def __init__(self, world, x_location, y_location):
+        Entity.__init__(self, world, monster_clips, x_location, y_location)
+        self.velocity_x = float(monster_speed)
+        self.x = float(x_location) # Exact x, rect.x is it rounded.
+        self.leg_x = self.x
+        self.leg_steps = 0
+        self.asleep = None # Set by the world's Dormancy while asleep.
+        self.face(monster_clips, self.velocity_x)
 
     def update(self, dt):
-        self.rect.x += int(self.velocity_x * dt)
+        self.leg_steps += 1
+        self.x = self.leg_x + self.leg_steps * (self.velocity_x * dt)
+        self.rect.x = round(self.x)
         
         # Collision detection in x direction.
-        colliding_tile = pygame.sprite.spritecollideany(self, all_tiles)
+        colliding_tile = self.world.tile_grid.collide_any(self.rect)
         if colliding_tile is not None:
             # Hitting wall from left.
             if self.velocity_x > 0  and self.rect.bottom != colliding_tile.rect.top:
                 self.rect.right = colliding_tile.rect.left
-                self.velocity_x *= -1
+                self.bounce()
             # Hitting wall from right.
             elif self.velocity_x < 0 and self.rect.bottom != colliding_tile.rect.top:
                 self.rect.left = colliding_tile.rect.right
-                self.velocity_x *= -1
+                self.bounce()
+        
+        # Re-hash only if monster moved to other cells.
+        self.world.entity_hash.move(self)
         
         # Animating monster movement.
-        if self.velocity_x < 0:
-            self.image = self.images[self.frame//animation_speed + 1]
-            self.frame += 1
-            if self.frame >= self.animation_cycles * animation_speed:
-                self.frame = 0
-        elif self.velocity_x > 0:
-            self.image = self.images[
-                self.frame//animation_speed + 1 + self.animation_cycles]
-            self.frame += 1
-            if self.frame >= self.animation_cycles * animation_speed:
-                self.frame = 0
-        else:
-            self.image = self.images[0]
-
-class Coin(pygame.sprite.Sprite):
-    
-    def __init__(self, x_location, y_location):
-        pygame.sprite.Sprite.__init__(self)
-        self.frame = 0
-        self.images = []
-        self.animation_cycles = 9
-        for i in range(1,10):
-            img = pygame.image.load(
-                os.path.join(assets, 'coin' + str(i) + '.png')).convert_alpha()
-            self.images.append(img)
-        self.image = self.images[0]
-        self.rect  = self.image.get_rect()
-        self.rect.x = x_location
-        self.rect.y = y_location
+        self.face(monster_clips, self.velocity_x)
     
-    def update(self, dt):
-        self.image = self.images[self.frame//animation_speed]
-        self.frame += 1
-        if self.frame >= self.animation_cycles * animation_speed:
-            self.frame = 0
+    # Turn back, starting a new leg from rect.
+    def bounce(self):
+        self.x = self.leg_x = float(self.rect.x)
+        self.leg_steps = 0
+        self.velocity_x *= -1
+    
+    def kill(self):
+        lod = self.world.lod
+        if lod is not None:
+            lod.discard(self)
+        self.world.entity_hash.remove(self)
+        self.world.mark_changed(self)
+        pygame.sprite.Sprite.kill(self)
+    
+    # Leg start, steps into the leg, y and velocity, for saving and
+    # restoring. A sleeping monster gives where it is by now.
+    def get_state(self):
+        if self.asleep is not None:
+            return self.world.lod.state_of(self)
+        return (self.leg_x, self.leg_steps, self.rect.y, self.velocity_x)
+    
+    def set_state(self, state):
+        self.leg_x, self.leg_steps, self.rect.y, self.velocity_x = state
+        self.x = self.leg_x + self.leg_steps * (self.velocity_x * fixed_dt)
+        self.rect.x = round(self.x)
+        self.face(monster_clips, self.velocity_x)
+        self.world.entity_hash.move(self)
+
+# Coins don't need updating, their animation comes from the world's tick
+# count, so they are not in all_sprites.
+class Coin(Entity):
+    
+    __slots__ = ()
+    
+    def __init__(self, world, x_location, y_location):
+        Entity.__init__(self, world, coin_clip, x_location, y_location)
+    
+    def kill(self):
+        self.world.entity_hash.remove(self)
+        self.world.mark_changed(self)
+        pygame.sprite.Sprite.kill(self)
         
 # Class for generating tile object.        
-class Tile(pygame.sprite.Sprite):
+class Tile(LightSprite):
     
-    def __init__(self, x_location, y_location):
-        pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.image.load(
-            os.path.join(assets,'tile.png')).convert_alpha()
+    __slots__ = ('image', 'rect')
+    
+    def __init__(self, world, x_location, y_location):
+        LightSprite.__init__(self)
+        self.image = world.atlas.get('tile')
         self.rect = self.image.get_rect()
         self.rect.x = x_location
         self.rect.y = y_location
 
-class Door(pygame.sprite.Sprite):
+class Door(LightSprite):
+    
+    __slots__ = ('is_open', 'image', 'rect')
     
-    def __init__(self, x_location, y_location):
-        pygame.sprite.Sprite.__init__(self)
+    def __init__(self, world, x_location, y_location):
+        LightSprite.__init__(self)
         self.is_open = False
-        self.image = pygame.image.load(
-            os.path.join(assets,'door.png')).convert_alpha()
+        self.image = world.atlas.get('door')
         self.rect = self.image.get_rect()
         self.rect.x = x_location
         self.rect.y = y_location
@@ -454,106 +638,660 @@ class Camera(object):
         self.camera_function = camera_function
         # Store cameras top left corner and world borders in rect.
         self.state = pygame.Rect(0, 0, world_width, world_height)
+        # Exact top left corner, state is it rounded to whole pixels.
+        self.position = pygame.Vector2(0, 0)
     
     # Offset target sprite's position according to camera state.
     def apply(self, target):
         return target.rect.move(self.state.topleft)
     
-    # Keep camera position constant in relation to source.
-    def update(self, source):
-        self.state = self.camera_function(self.state, source.rect)
+    # Keep camera position constant in relation to source. dt is the time
+    # since last update, camera moves as fast at any frame rate.
+    def update(self, source, dt=1 / FPS):
+        self.position = self.camera_function(self.position, source.rect, dt)
+        # Set max/min x/y to limit camera from moving outside world borders.
+        if borders:
+            self.position.x = max(-(self.state.width - WIDTH),
+                                  min(0, self.position.x))
+            self.position.y = max(-(self.state.height - HEIGHT),
+                                  min(0, self.position.y))
+        self.state.topleft = (round(self.position.x), round(self.position.y))
 
-# Function for moving camera.
-def camera_function(camera, source_rect):
+# Function for moving camera, returns new position of camera's top left.
+def camera_function(position, source_rect, dt):
     # Center camera to source_rect center.
-    x = -source_rect.center[0] + int(WIDTH / 2)
-    y = -source_rect.center[1] + int(HEIGHT / 2)
-    position = pygame.Vector2(camera.topleft)
-    # Move the camera, multiplies by camera_speed for smoothness.
-    position += (pygame.Vector2((x, y)) 
-                       - pygame.Vector2(camera.topleft)) * camera_speed
-    camera.topleft = (int(position.x), int(position.y))
-    # Set max/min x/y to limit camera from moving outside world borders.
-    if borders:
-        camera.x = max(-(camera.width - WIDTH), min(0, camera.x))
-        camera.y = max(-(camera.height - HEIGHT), min(0, camera.y))
-    return camera
-
-def generate_world(world):
-    global coins_total
-    y = 0
-    for row in world:
-        x = 0
-        for element in row:
-            if element == "S": # S = Spawn player
-                start_pos = [x, y]
-            if element == "P": # P = Platform
-                platform_part = Tile(x * tile_x, y * tile_y)
-                all_tiles.add(platform_part)
-            if element == "M": # M = Monster
-                monster = Monster(x * tile_x, y * tile_y)
-                all_sprites.add(monster)
-                all_monsters.add(monster)
-            if element == "C": # C = Coin
-                coin = Coin(x * tile_x, y * tile_y)
-                all_sprites.add(coin)
-                all_coins.add(coin)
-                coins_total += 1
-            if element == "D": # D = Door
-                door = Door(x * tile_x, y * tile_y)
-                doors.add(door)
-            x += 1
-        y += 1
-    return start_pos
-
-# Show how much lives player has left.
-def draw_HUD():
-    global lives
-    for i in range(lives):
-        window.blit(pygame.image.load(
-            os.path.join(assets,'heart.png')).convert_alpha(), (i * 20 + 4, 4))
-    window.blit(pygame.image.load(
-        os.path.join(assets, 'coin6.png')).convert_alpha(), (0, 16))
-    font = pygame.font.Font('freesansbold.ttf', 16)
-    text = font.render(
-        str(coins_total - len(all_coins)) + "/" + str(coins_total), True, WHITE)
-    window.blit(text, (32, 26))
-
-def update_window(dt, camera):
-    window.fill(backround_color)
-    
-    # Calls the update() method on all Sprites in the Group.
-    all_sprites.update(dt)
-    
-    if len(all_coins) == 0:
-        for door in doors:
-            door.is_open = True
-    
-    # Render world.
-    for sprite in all_sprites:
-        window.blit(sprite.image, camera.apply(sprite))
-    for tile in all_tiles:
-        window.blit(tile.image, camera.apply(tile))
-    for door in doors:
-        if door.is_open:
-            window.blit(door.image, camera.apply(door))
-    
-    draw_HUD()
-    pygame.display.flip()
+    target = pygame.Vector2(-source_rect.centerx + WIDTH / 2,
+                            -source_rect.centery + HEIGHT / 2)
+    # Move the camera by camera_speed of the way per 1/FPS s for smoothness.
+    speed = 1 - (1 - camera_speed) ** (dt * FPS)
+    return position + (target - position) * speed
+
+# Game state and simulation of one world. Doesn't need a display, so it can
+# be stepped headless as fast as the CPU allows. Same template and same
+# inputs always give the same outcome.
+# With vectorized=True monsters are simulated with NumPy arrays, which is
+# much faster for hundreds or thousands of monsters.
+class World(object):
+    
+    use_lod = True # Monsters may sleep if the lod setting is on.
+    
+    def __init__(self, template, atlas, vectorized=False):
+        self.template = template
+        self.atlas = atlas
+        if isinstance(template, CompiledLevel):
+            columns, rows = template.width, template.height
+        else:
+            columns, rows = len(template[0]), len(template)
+        self.width = tile_x * columns
+        self.height = tile_y * rows
+        # Set ground level where player falls without platform.
+        self.ground = rows * tile_y + 2048
+        self.lives = lives
+        self.shoot_count = shoot_count
+        self.coins_total = 0
+        self.coins_collected = 0
+        self.ticks = 0 # Simulation steps taken.
+        self.accumulator = 0.0 # Time not yet simulated.
+        self.pending = Inputs() # Key presses waiting for next step.
+        self.profiler = None # FrameProfiler timing the steps, if any.
+        # Sprites whose state changed other than by updating them, since a
+        # Snapshotter last looked. None while no Snapshotter is watching.
+        self.changed = None
+        
+        # Animation clips shared by all sprites.
+        self.clips = make_clips(atlas)
+        
+        # Make groups for handling sprites.
+        self.all_sprites = pygame.sprite.Group() # Sprites to update.
+        self.all_tiles = pygame.sprite.Group()
+        # Groups for handling interactions, monsters and fireballs are also
+        # in all_sprites.
+        self.all_monsters = pygame.sprite.Group()
+        self.all_coins = pygame.sprite.Group()
+        self.doors = pygame.sprite.Group()
+        self.all_fireballs = pygame.sprite.Group()
+        self.fireball_pool = FireballPool(self)
+        # Grid index for fast tile collision queries.
+        self.tile_grid = TileGrid(tile_x, tile_y)
+        # Broad-phase index of monsters, coins and doors for interactions.
+        self.entity_hash = SpatialHash()
+        # Functions called as f(x, y, added) when a tile is added or removed.
+        self.tile_listeners = []
+        self.monster_store = None
+        if vectorized:
+            # NumPy is only needed when asked for.
+            from swarm import MonsterArray
+            self.monster_store = MonsterArray(self, monster_clips,
+                                              animation_speed, fixed_dt)
+        self.lod = None
+        if lod and self.use_lod and not vectorized:
+            from lod import Dormancy
+            # Active area: the camera view and the reach of fireballs, plus
+            # two tiles. The player can jump twice before landing.
+            fireball_range = fireball_lifetime * fireball_speed * fixed_dt
+            self.lod = Dormancy(
+                self, max(WIDTH / 2, fireball_range) + 2 * tile_x,
+                HEIGHT / 2 + 2 * tile_y,
+                (player_speed + monster_speed) * fixed_dt,
+                2 * player_jump_speed * fixed_dt, g * fixed_dt * fixed_dt,
+                monster_speed * fixed_dt, fixed_dt)
+        
+        # Let there be light!
+        start_pos = self.generate_world(template)
+        if self.monster_store is not None:
+            self.monster_store.refresh_tiles()
+            self.tile_listeners.append(self.monster_store.tile_changed)
+        
+        # "In a hole in the ground there lived a robot..."
+        self.player = Robot(self, start_pos[0] * tile_x, start_pos[1] * tile_y)
+        self.all_sprites.add(self.player)
+    
+    def generate_world(self, template):
+        if isinstance(template, CompiledLevel):
+            return self.generate_compiled(template)
+        y = 0
+        for row in template:
+            x = 0
+            for element in row:
+                if element == "S": # S = Spawn player
+                    start_pos = [x, y]
+                if element == "P": # P = Platform
+                    self.add_tile(x, y)
+                if element == "M": # M = Monster
+                    self.add_monster(x, y)
+                if element == "C": # C = Coin
+                    self.add_coin(x, y)
+                    self.coins_total += 1
+                if element == "D": # D = Door
+                    self.add_door(x, y)
+                x += 1
+            y += 1
+        return start_pos
+    
+    # Same as generate_world, from a compiled level. Entities are added in
+    # the same order as from the template.
+    def generate_compiled(self, level):
+        for x, y in level.tiles():
+            self.add_tile(x, y)
+        add = {'M': self.add_monster, 'C': self.add_coin, 'D': self.add_door}
+        for kind, x, y in level.entity_list():
+            add[kind](x, y)
+        self.coins_total += level.coins
+        return list(level.spawn)
+    
+    # Functions for adding things to grid cell (x, y), coordinates in tiles.
+    def add_tile(self, x, y):
+        platform_part = Tile(self, x * tile_x, y * tile_y)
+        self.all_tiles.add(platform_part)
+        self.tile_grid.add(platform_part, x, y)
+        for listener in self.tile_listeners:
+            listener(x, y, True)
+        return platform_part
+    
+    def remove_tile(self, x, y):
+        platform_part = self.tile_grid.remove(x, y)
+        if platform_part is not None:
+            platform_part.kill()
+            for listener in self.tile_listeners:
+                listener(x, y, False)
+        return platform_part
     
+    def add_monster(self, x, y):
+        if self.monster_store is None:
+            monster = Monster(self, x * tile_x, y * tile_y)
+            self.all_sprites.add(monster)
+            if self.lod is not None:
+                self.lod.add(monster)
+        else:
+            # Updated by the store, not via all_sprites.
+            from swarm import ArrayMonster
+            monster = ArrayMonster(self, self.monster_store,
+                                   x * tile_x, y * tile_y, monster_speed)
+        self.all_monsters.add(monster)
+        self.entity_hash.insert(monster, 'monster')
+        return monster
+    
+    def add_coin(self, x, y):
+        coin = Coin(self, x * tile_x, y * tile_y)
+        self.all_coins.add(coin)
+        self.entity_hash.insert(coin, 'coin')
+        return coin
+    
+    def add_door(self, x, y):
+        door = Door(self, x * tile_x, y * tile_y)
+        self.doors.add(door)
+        self.entity_hash.insert(door, 'door')
+        return door
+    
+    # Amount of sprites in the world, doors included.
+    def sprite_count(self):
+        count = len(self.all_sprites) + len(self.all_coins) + len(self.doors)
+        if self.monster_store is not None:
+            count += len(self.all_monsters)
+        if self.lod is not None:
+            count += len(self.lod.sleeping)
+        return count
+    
+    # Game ends if player runs out of lives or drops out of map.
+    @property
+    def lost(self):
+        return self.lives <= 0 or self.player.rect.y > self.height + 512
+    
+    @property
+    def won(self):
+        return self.player.winning
+    
+    # Advance simulation by dt seconds in fixed_dt steps. Time left over is
+    # kept for the next call. Key presses are applied on the first step
+    # taken, or kept until there is one. Returns amount of steps taken.
+    def step(self, dt, inputs):
+        self.accumulator += dt
+        self.pending = Inputs(inputs.left, inputs.right,
+                              self.pending.jump + inputs.jump,
+                              self.pending.shoot + inputs.shoot)
+        steps = 0
+        while self.accumulator >= fixed_dt:
+            self.accumulator -= fixed_dt
+            self.tick(self.pending)
+            self.pending = Inputs(inputs.left, inputs.right)
+            steps += 1
+        return steps
+    
+    # One fixed step of the simulation.
+    def tick(self, inputs):
+        player = self.player
+        
+        # Initiate jump on pressing jump key.
+        for i in range(inputs.jump):
+            if not player.jumping:
+                player.jump()
+                player.double_jump_ready = double_jump
+            elif player.double_jump_ready:
+                player.jump()
+                player.double_jump_ready = False
+        # Shoot fireballs.
+        for i in range(inputs.shoot):
+            player.shoot_fireball()
+        
+        if inputs.left:
+            player.velocity_x = - player.speed
+            player.shooting_right = False
+        elif inputs.right:
+            player.velocity_x = player.speed
+            player.shooting_right = True
+        else:
+            player.velocity_x = 0.0
+        
+        # Monsters far away go to sleep, monsters getting close wake up.
+        if self.lod is not None:
+            self.lod.update()
+        # Calls the update() method on all Sprites in the Group.
+        if self.monster_store is not None:
+            self.monster_store.update(fixed_dt)
+        self.all_sprites.update(fixed_dt)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark('update')
+        
+        # Interactions of player and fireballs with monsters, coins and doors,
+        # all found in a single broad-phase pass.
+        actors = [player] + self.all_fireballs.sprites()
+        for actor, contacts in self.entity_hash.pairs(actors):
+            actor.interact(contacts)
+        if profiler is not None:
+            profiler.mark('collision')
+        
+        if self.coins_collected >= self.coins_total:
+            for door in self.doors:
+                door.is_open = True
+        
+        self.ticks += 1
+    
+    # Bring sleeping monsters up to date and wake them, for when all of the
+    # world's state is needed.
+    def wake_all(self):
+        if self.lod is not None:
+            self.lod.wake_all()
+    
+    def mark_changed(self, sprite):
+        if self.changed is not None:
+            self.changed.add(sprite)
+
+# World streamed from a LevelFile one region (a strip of columns) at a time.
+# Regions near the player are loaded before the camera gets to them and
+# regions far away are evicted. Evicted regions remember collected coins and
+# killed or moved monsters, so coming back finds them as they were left.
+# Monsters of evicted regions don't move meanwhile, and monsters next to a
+# region that isn't loaded wait for it.
+# Memory use and load time don't depend on the width of the level.
+class StreamingWorld(World):
+    
+    use_lod = False # Evicted regions are not updated anyway.
+    
+    def __init__(self, level, atlas, vectorized=False):
+        self.level = level
+        self.regions = {} # Loaded region index -> things created from it.
+        self.saved = {} # Evicted region index -> coins and monster states.
+        self.region_count = (level.width + region_width - 1) // region_width
+        self.frozen = set() # Monsters waiting for a region to be loaded.
+        World.__init__(self, level, atlas, vectorized)
+        self.stream()
+    
+    # Nothing is created up front, regions are loaded by stream().
+    def generate_world(self, level):
+        self.coins_total = level.coins
+        return list(level.spawn)
+    
+    # Load regions within load_distance and evict regions further than
+    # evict_distance from the player.
+    def stream(self):
+        center = self.player.rect.centerx
+        size = region_width * tile_x
+        first = max(0, int((center - load_distance) // size))
+        last = min(self.region_count - 1, int((center + load_distance) // size))
+        for i in range(first, last + 1):
+            if i not in self.regions:
+                self.load_region(i)
+        for i in list(self.regions):
+            if (center - (i + 1) * size > evict_distance or
+                i * size - center > evict_distance):
+                self.evict_region(i)
+        self.freeze_monsters()
+    
+    # The tiles of regions that aren't loaded are not there, monsters would
+    # walk through their walls. Monsters within a tile of such a region
+    # stand still until it's loaded (monsters move less than a tile a step).
+    def freeze_monsters(self):
+        size = region_width * tile_x
+        frozen = set()
+        for i in self.regions:
+            edges = []
+            if i > 0 and i - 1 not in self.regions:
+                edges.append(i * size)
+            if i + 1 < self.region_count and i + 1 not in self.regions:
+                edges.append((i + 1) * size - tile_x)
+            for x in edges:
+                strip = pygame.Rect(x, 0, tile_x, self.height)
+                frozen.update(self.entity_hash.query(strip, ('monster',)))
+        for monster in self.frozen - frozen:
+            if monster.alive():
+                self.set_frozen(monster, False)
+        for monster in frozen - self.frozen:
+            self.set_frozen(monster, True)
+        self.frozen = frozen
+    
+    def set_frozen(self, monster, frozen):
+        if self.monster_store is not None:
+            self.monster_store.frozen[monster.index] = frozen
+        elif frozen:
+            self.all_sprites.remove(monster)
+        else:
+            self.all_sprites.add(monster)
+    
+    def load_region(self, i):
+        saved = self.saved.pop(i, {'coins': set(), 'monsters': {}})
+        region = {'tiles': [], 'monsters': {}, 'coins': {}, 'doors': [],
+                  'saved': saved}
+        first_x = i * region_width
+        last_x = min(first_x + region_width, self.level.width)
+        for y in range(self.level.height):
+            row = self.level.row(y, first_x, last_x)
+            if row.isspace():
+                continue
+            for x, element in enumerate(row, first_x):
+                if element == "P":
+                    self.add_tile(x, y)
+                    region['tiles'].append((x, y))
+                elif element == "M":
+                    state = saved['monsters'].get((x, y), 'new')
+                    if state is None: # Killed earlier.
+                        continue
+                    monster = self.add_monster(x, y)
+                    if state != 'new':
+                        monster.set_state(state)
+                    region['monsters'][(x, y)] = monster
+                elif element == "C":
+                    if (x, y) not in saved['coins']:
+                        region['coins'][(x, y)] = self.add_coin(x, y)
+                elif element == "D":
+                    region['doors'].append(self.add_door(x, y))
+        self.regions[i] = region
+    
+    def evict_region(self, i):
+        region = self.regions.pop(i)
+        # Killed monsters and collected coins from earlier visits are kept.
+        saved = region['saved']
+        for x, y in region['tiles']:
+            self.remove_tile(x, y)
+        for cell, monster in region['monsters'].items():
+            if monster.alive():
+                saved['monsters'][cell] = monster.get_state()
+                monster.kill()
+            else:
+                saved['monsters'][cell] = None
+        for cell, coin in region['coins'].items():
+            if coin.alive():
+                coin.kill()
+            else:
+                saved['coins'].add(cell)
+        for door in region['doors']:
+            self.entity_hash.remove(door)
+            door.kill()
+        self.saved[i] = saved
+    
+    def tick(self, inputs):
+        self.stream()
+        World.tick(self, inputs)
+
+# Fonts are loaded once and shared.
+fonts = {}
+
+def get_font(size=16):
+    if size not in fonts:
+        fonts[size] = pygame.font.Font('freesansbold.ttf', size)
+    return fonts[size]
+
+# Lives and coins drawn into a cached surface, which is rendered again only
+# when they change. Extra widgets show a number each (e.g. FPS) and are
+# rendered again only when the number changes.
+class HUD(object):
+    
+    def __init__(self, world):
+        self.world = world
+        self.font = get_font(16)
+        self.heart = world.atlas.get('heart')
+        self.coin = world.atlas.get('coin6')
+        self.surface = pygame.Surface(hud_area.size, pygame.SRCALPHA)
+        self.state = None # (lives, coins collected, coins total) in surface.
+        self.area = None
+        self.widgets = []
+        self.renders = 0 # Times something was rendered, for measuring.
+    
+    # Show value() formatted with text_format (e.g. "FPS %d") at position.
+    def add_widget(self, position, value, text_format):
+        self.widgets.append([position, value, text_format, None, None])
+    
+    def render(self, state):
+        lives, coins_collected, coins_total = state
+        surface = self.surface
+        surface.fill((0, 0, 0, 0))
+        for i in range(lives):
+            surface.blit(self.heart, (i * 20 + 4, 4))
+        surface.blit(self.coin, (0, 16))
+        text = self.font.render(str(coins_collected) + "/" + str(coins_total),
+                                True, WHITE)
+        surface.blit(text, (32, 26))
+        # Only the part with something in it is blitted to the window.
+        self.area = surface.get_bounding_rect()
+        self.state = state
+        self.renders += 1
+    
+    # Returns amount of blits done.
+    def draw(self, window):
+        world = self.world
+        state = (world.lives, world.coins_collected, world.coins_total)
+        if state != self.state:
+            self.render(state)
+        window.blit(self.surface, self.area.move(hud_area.topleft), self.area)
+        for widget in self.widgets:
+            position, value, text_format, last_value, image = widget
+            current = value()
+            if current != last_value or image is None:
+                image = self.font.render(text_format % current, True, WHITE)
+                widget[3:] = current, image
+                self.renders += 1
+            window.blit(image, position)
+        return 1 + len(self.widgets)
+
+# Draws a World to window. Sprites outside the camera view are culled.
+class Renderer(object):
+    
+    def __init__(self, window, world, dirty_rects=None):
+        self.window = window
+        self.world = world
+        if dirty_rects is None:
+            # The setting as it is now, the argument hides its name.
+            dirty_rects = globals()['dirty_rects']
+        self.dirty_rects = dirty_rects
+        self.camera = Camera(camera_function, world.width, world.height)
+        # Tiles are drawn from pre-rendered chunks instead of one by one.
+        self.tile_chunks = TileChunks(world.atlas.get('tile'), tile_x, tile_y)
+        for x, y in world.tile_grid.cells:
+            self.tile_chunks.add(x, y)
+        world.tile_listeners.append(self.tile_changed)
+        self.font = get_font(16)
+        self.hud = HUD(world)
+        if hud_fireballs:
+            self.hud.add_widget((4, 44), lambda: len(world.all_fireballs),
+                                "Fireballs %d/" + str(shoot_count))
+        self.stats = {'drawn': 0, 'culled': 0, 'dirty_rects': 0,
+                      'blits': 0} # Last frame.
+        self.profiler = None # FrameProfiler timing the drawing, if any.
+        self.last_drawn = {} # Sprite -> (window rect, image) drawn last frame.
+        self.last_camera = None # Camera position last frame.
+        self.banner = None # Surface shown in the middle of the window.
+        self.watch_view()
+    
+    # Start over with the camera, after the world was restored to its start.
+    def restart(self):
+        self.camera = Camera(camera_function, self.world.width,
+                             self.world.height)
+        self.last_drawn = {}
+        self.last_camera = None
+        self.banner = None
+        self.watch_view()
+    
+    # Tell the world's level of detail what the camera shows, so monsters
+    # there are awake.
+    def watch_view(self):
+        if self.world.lod is not None:
+            self.world.lod.view = pygame.Rect(
+                -self.camera.state.x, -self.camera.state.y, WIDTH, HEIGHT)
+    
+    def tile_changed(self, x, y, added):
+        if added:
+            self.tile_chunks.add(x, y)
+        else:
+            self.tile_chunks.remove(x, y)
+    
+    # Paint world layers (sprites, tiles, open doors) in current clip area.
+    def paint_world(self, sprites, open_doors, area=None):
+        window = self.window
+        camera = self.camera
+        window.fill(backround_color)
+        blits = 0
+        for sprite in sprites:
+            if area is None or area.colliderect(camera.apply(sprite)):
+                window.blit(sprite.image, camera.apply(sprite))
+                blits += 1
+        blits += self.tile_chunks.draw(window, camera.state)
+        for door in open_doors:
+            if area is None or area.colliderect(camera.apply(door)):
+                window.blit(door.image, camera.apply(door))
+                blits += 1
+        self.stats['blits'] += blits
+    
+    # Render only what is inside the camera view. Returns list of changed
+    # window rects in dirty rect mode when the camera stands still, otherwise
+    # None.
+    def render_world(self):
+        world = self.world
+        camera = self.camera
+        view = pygame.Rect(-camera.state.x, -camera.state.y, WIDTH, HEIGHT)
+        if world.lod is not None:
+            world.lod.view = view
+        # Monsters, coins and doors come from the spatial hash cells covering
+        # the view, in the order they were added to the world.
+        sprites = world.entity_hash.query(view, ('monster', 'coin'))
+        for sprite in [world.player] + world.all_fireballs.sprites():
+            if view.colliderect(sprite.rect):
+                sprites.append(sprite)
+        open_doors = [door for door in world.entity_hash.query(view, ('door',))
+                      if door.is_open]
+        
+        drawn = {}
+        for sprite in sprites + open_doors:
+            drawn[sprite] = (camera.apply(sprite), sprite.image)
+        self.stats['drawn'] = len(drawn)
+        self.stats['culled'] = world.sprite_count() - len(drawn)
+        self.stats['blits'] = 0
+        
+        rects = None
+        if self.dirty_rects and camera.state.topleft == self.last_camera:
+            # Repaint areas of sprites that moved, changed image, appeared or
+            # vanished, plus the HUD. Each area is painted from scratch with
+            # clipping, so overlapping sprites stay correct.
+            rects = [hud_area]
+            if self.profiler is not None and self.profiler.overlay:
+                rects.append(profile_area)
+            last_drawn = self.last_drawn
+            for sprite, state in drawn.items():
+                old = last_drawn.pop(sprite, None)
+                if old is None:
+                    rects.append(state[0])
+                elif old != state:
+                    rects.append(state[0].union(old[0]))
+            for old in last_drawn.values():
+                rects.append(old[0])
+            for rect in rects:
+                self.window.set_clip(rect)
+                self.paint_world(sprites, open_doors, rect)
+            self.window.set_clip(None)
+            self.stats['dirty_rects'] = len(rects)
+        else:
+            self.paint_world(sprites, open_doors)
+            self.stats['dirty_rects'] = 0
+        self.last_drawn = drawn
+        self.last_camera = camera.state.topleft
+        return rects
+    
+    # Show how much lives player has left.
+    def draw_HUD(self):
+        self.stats['blits'] += self.hud.draw(self.window)
+    
+    # Profiler numbers of the previous frame in the top right corner.
+    def draw_profile(self):
+        x, y = profile_area.topleft
+        for line in self.profiler.overlay_lines():
+            self.window.blit(self.font.render(line, True, WHITE), (x + 4, y + 4))
+            y += 18
+    
+    def draw(self):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark('update')
+        rects = self.render_world()
+        if profiler is not None:
+            profiler.mark('render')
+        self.draw_HUD()
+        if self.banner is not None:
+            rect = self.banner.get_rect(center=self.window.get_rect().center)
+            self.window.blit(self.banner, rect)
+            if rects is not None:
+                rects.append(rect)
+        if profiler is not None:
+            if profiler.overlay:
+                self.draw_profile()
+            profiler.mark('hud')
+        # Off-screen windows (see capture.py) are not shown.
+        if self.window is pygame.display.get_surface():
+            if rects is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+        if profiler is not None:
+            profiler.mark('flip')
+
+# Read player inputs for this frame. Returns None if game window was closed.
+def read_inputs():
+    jump = 0
+    shoot = 0
+    for event in pygame.event.get():
+        # Close game window with red X button or Esc.
+        if (event.type == pygame.QUIT or
+            event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+            return None
+        # Initiate jump on pressing space key.
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+            jump += 1
+        # Shoot fireballs when pressing right shift.
+        elif event.type == pygame.KEYDOWN and (
+            event.key == pygame.K_RSHIFT or event.key == pygame.K_LSHIFT):
+            shoot += 1
+    
+    keys = pygame.key.get_pressed()
+    return Inputs(keys[pygame.K_LEFT] or keys[pygame.K_a],
+                  keys[pygame.K_RIGHT] or keys[pygame.K_d], jump, shoot)
+
+# Returns True for a new game, False if game window was closed.
 def game_over():
-    global lives
-    global shoot_count
-    global coins_total
     window.fill(BLACK)
-    font = pygame.font.Font('freesansbold.ttf', 16)
-    text = font.render("Game over  -  Press n for new game!", True, WHITE)
+    text = get_font(16).render("Game over  -  Press n for new game!", True, WHITE)
     text_rect = text.get_rect()
     window_rect = window.get_rect()
     text_rect.center = window_rect.center
     window.blit(text, text_rect)
-    window.blit(pygame.image.load(
-        os.path.join(assets, 'robo0.png')).convert_alpha(),
+    window.blit(atlas.get('robo0'),
                  (int(WIDTH / 2) - tile_x//2, window_rect.centery - 2 * tile_y))
     pygame.display.flip()
     while True:
@@ -561,89 +1299,166 @@ def game_over():
         for event in pygame.event.get():
             if (event.type == pygame.QUIT or
                 event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
-                return pygame.quit()
+                return False
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_n:
-                lives = reset_lives
-                shoot_count = reset_fire
-                coins_total = reset_coins
-                all_sprites.empty()
-                all_tiles.empty()
-                all_monsters.empty()
-                all_coins.empty()
-                doors.empty()
-                return main()
+                return True
     
+# World (StreamingWorld for a level file) and its Renderer for template,
+# with the tile chunks the camera passes at the start already baked. Can be
+# called on a worker thread, see preload.py.
+def prepare_level(template, window, atlas):
+    if isinstance(template, LevelFile):
+        game = StreamingWorld(template, atlas)
+    else:
+        game = World(template, atlas)
+    renderer = Renderer(window, game)
+    # Camera starts at the top left corner and moves to the player.
+    view = pygame.Rect(0, 0, WIDTH, HEIGHT)
+    renderer.tile_chunks.bake_area(
+        view.union(view.move(game.player.rect.centerx - WIDTH // 2,
+                             game.player.rect.centery - HEIGHT // 2)))
+    return game, renderer
+
 def main():
-    global world
-    global double_jump
-    # Let there be light!
-    start_pos = generate_world(world)
-    
-    camera = Camera(camera_function, tile_x * len(world[0]), tile_y * len(world))
-    
-    # "In a hole in the ground there lived a robot..."
-    player = Robot(start_pos[0] * tile_x, start_pos[1] * tile_y)
-    all_sprites.add(player)
-    
-    # Game loop.
+    global world, world_path
+    game, renderer = prepare_level(world, window, atlas)
+    new_level = True
+    transition = None
+    preloader = None
     while True:
+        if new_level:
+            game.profiler = renderer.profiler = profiler
+            if hud_fps:
+                renderer.hud.add_widget((120, 44),
+                                        lambda: int(clock.get_fps()), "FPS %d")
+            # A new game restores the level as it was at the start instead
+            # of building it again.
+            snapshotter = start = history = None
+            if not isinstance(game, StreamingWorld):
+                snapshotter = Snapshotter(game)
+                start = snapshotter.capture()
+                if rewind and not record_path:
+                    history = SnapshotRing(round(rewind_seconds * FPS))
+            watcher = None
+            if (watch and world_path is not None and not record_path and
+                not isinstance(game, StreamingWorld)):
+                watcher = LevelWatcher(world_path, game)
+        recorder = None
+        if record_path:
+            from replay import Recorder
+            recorder = Recorder(record_path, world)
+        finished = None # Time the door was reached.
         
-        # Creating Delta Time to make movement independent of frame rate.
-        dt = clock.tick(FPS) / 1000
-        if dt > max_dt:
-            dt = max_dt
-        
-        for event in pygame.event.get():
-            # Close game window with red X button or Esc.
-            if (event.type == pygame.QUIT or
-                event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+        # Game loop.
+        while True:
+            
+            # Creating Delta Time, simulation catches up with it in fixed steps.
+            dt = clock.tick(FPS) / 1000
+            if dt > max_dt:
+                dt = max_dt
+            frame_start = time.perf_counter()
+            if profiler is not None:
+                profiler.begin_frame()
+            
+            inputs = read_inputs()
+            if inputs is None:
+                if recorder is not None and finished is None:
+                    recorder.close(game)
                 return pygame.quit()
-            # Initiate jump on pressing space key.
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                if not player.jumping:
-                    player.jump()
-                    double_jump = True
-                elif double_jump:
-                    player.jump()
-                    double_jump = False
-            # Shoot fireballs when pressing right shift.
-            elif event.type == pygame.KEYDOWN and (
-                event.key == pygame.K_RSHIFT or event.key == pygame.K_LSHIFT):
-                player.shoot_fireball()
-                
-        keys = pygame.key.get_pressed()
-
-        if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-            player.velocity_x = - player.speed
-            player.shooting_right = False
-        elif keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-            player.velocity_x = player.speed
-            player.shooting_right = True
+            if profiler is not None:
+                profiler.mark('input')
+            
+            if watcher is not None and finished is None and watcher.poll():
+                print(watcher.report())
+                renderer.camera.state.size = (game.width, game.height)
+                # A new game starts from the changed file, rewinding to
+                # before the change isn't possible.
+                world = watcher.template
+                if snapshotter is not None:
+                    snapshotter.close()
+                snapshotter = start = history = None
+            
+            # Finished level stays on screen as it was left.
+            if finished is None:
+                if (history is not None and
+                    pygame.key.get_pressed()[rewind_key]):
+                    # One frame back in time per frame.
+                    state = history.pop()
+                    if state is not None:
+                        snapshotter.restore(state)
+                    renderer.camera.update(game.player, dt)
+                else:
+                    if recorder is not None:
+                        recorder.frame(dt, inputs)
+                    renderer.camera.update(game.player, dt)
+                    if game.step(dt, inputs) and history is not None:
+                        history.push(snapshotter.capture())
+            renderer.draw()
+            if capture is not None:
+                capture.frame(window)
+            if transition is not None and transition.first_frame is None:
+                transition.first_frame = time.perf_counter() - frame_start
+                print(transition.report())
+            # Start preparing the next level once this one is on screen, so
+            # the worker doesn't slow down the first frame.
+            if preload and preloader is None:
+                preloader = Preloader(
+                    lambda: prepare_level(next_world, window, atlas))
+            if profiler is not None:
+                profiler.end_frame(dt, game, renderer)
+            
+            if finished is not None:
+                # Keep drawing frames until the pause is over and the next
+                # level is ready, the loop never blocks on it.
+                if (time.perf_counter() - finished >= level_pause and
+                    (preloader is None or preloader.ready())):
+                    break
+                continue
+            
+            if (game.lost or game.won) and recorder is not None:
+                recorder.close(game)
+            
+            if game.lost:
+                if not game_over():
+                    return pygame.quit()
+                break
+            
+            if game.won:
+                finished = time.perf_counter()
+                renderer.banner = get_font(32).render("Level complete!", True,
+                                                      WHITE)
+        
+        if finished is None:
+            # New game on the same level.
+            if start is not None:
+                snapshotter.restore(start)
+                renderer.restart()
+                if history is not None:
+                    history.clear()
+                new_level = False
+            else:
+                game, renderer = prepare_level(world, window, atlas)
+                new_level = True
+            continue
+        
+        # Swap in the next level.
+        transition = Transition(finished)
+        swap = time.perf_counter()
+        if preloader is None:
+            game, renderer = prepare_level(next_world, window, atlas)
+            transition.build_time = time.perf_counter() - swap
+            transition.delay = transition.build_time
         else:
-            player.velocity_x = 0
-        
-        camera.update(player)
-        update_window(dt, camera)
-        
-        # Game ends if player runs out of lives or drops out of map.
-        global lives
-        if lives <= 0 or player.rect.y > (len(world) * tile_y + 512):
-            game_over()
-            return
-        
-        global shoot_count
-        global coins_total
-        if player.winning:
-            lives = reset_lives
-            shoot_count = reset_fire
-            coins_total = reset_coins
-            all_sprites.empty()
-            all_tiles.empty()
-            all_monsters.empty()
-            all_coins.empty()
-            doors.empty()
-            world = world1
-            return main()
+            game, renderer = preloader.get()
+            transition.build_time = preloader.build_time
+            transition.delay = max(0.0, preloader.finished - finished -
+                                   level_pause)
+            transition.preloaded = True
+        world = next_world
+        world_path = None
+        transition.swap_time = time.perf_counter() - swap
+        new_level = True
+        preloader = None
     
 if __name__ == '__main__':
     try:
@@ -656,24 +1471,39 @@ if __name__ == '__main__':
         game_dir = os.path.dirname(__file__)
         assets = os.path.join(game_dir, 'assets')
         
+        # Decode all images once into a shared atlas.
+        atlas = Atlas(assets)
+        print(atlas.report())
+        
         # Set window icon.
-        pygame.display.set_icon(pygame.image.load(
-            os.path.join(assets, 'robo12.png')).convert_alpha())
+        pygame.display.set_icon(atlas.get('robo12'))
         
         # For keeping up time to control screen refresh rate, used in game loop.
         clock = pygame.time.Clock()
         
-        # Make groups for handling sprites.
-        all_sprites = pygame.sprite.Group()
-        all_tiles = pygame.sprite.Group()
-        # Groups gor handling interactions,
-        # members of these groups will be added also to all_sprites.
-        all_monsters = pygame.sprite.Group()
-        all_coins = pygame.sprite.Group()
-        doors = pygame.sprite.Group()
+        # World or level file can be given as argument.
+        if len(sys.argv) > 1:
+            world = open_world(sys.argv[1])
+            if not levels.is_compiled(sys.argv[1]):
+                world_path = sys.argv[1]
         
+        profiler = None
+        if profile:
+            profiler = FrameProfiler(overlay=profile_overlay)
+        capture = None
+        if capture_path:
+            capture = FrameCapture(make_writer(capture_path), window_size)
+            print("Capturing %dx%d %s frames to %s"
+                  % (WIDTH, HEIGHT, capture.pixel_format, capture_path))
         main()
+        if profiler is not None:
+            print(profiler.report())
+            if profile_export:
+                profiler.export(profile_export)
+        if capture is not None:
+            capture.close()
+            print(capture.report())
     except:
         traceback.print_exc()
         pygame.quit()
-        input()
\ No newline at end of file
+        input()
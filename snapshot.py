@@ -0,0 +1,320 @@
+import zlib
+import struct
+from array import array
+from collections import deque
+
+# Snapshots of a World's state, for rewinding and restarting without
+# building the world again.
+# A snapshot is a flat array('d') of the numbers that change while the world
+# runs: ticks, lives, shoot_count, coins_collected, keys waiting for the
+# next step, the player, then every monster (see write_monster), alive
+# flags of coins, open flags of doors and the fireballs in the air.
+# state.tobytes() serializes it, array('d', data) reads it back.
+# Entities are found by their place in the world, so a snapshot can only
+# be restored to the world it was taken from. Tiles are not in snapshots,
+# a World never changes them; StreamingWorld is not supported.
+# Snapshotter keeps the latest snapshot and only writes what changed since:
+# the player, awake monsters, fireballs and what the world marks changed
+# (killed monsters and coins, monsters put to sleep or woken up). Sleeping
+# monsters are in it as they fell asleep, so they cost nothing. Restoring
+# only sets back the entities whose numbers differ. So with level of detail
+# on, capture and restore cost about the same in any size of level; with it
+# off every monster moves and is written every step.
+#
+# SnapshotRing keeps the latest snapshots with little memory: the latest
+# one as it is and for each one before it the zlib compressed delta back
+# from the one after it, made of only the blocks of bytes that changed.
+
+block_size = 512 # Bytes of a snapshot compared at once.
+
+header_size = 22 # Numbers of world and player at the start of a snapshot.
+monster_size = 6 # Numbers per monster.
+
+class Snapshotter(object):
+
+    # Must be made before anything in world is killed, it remembers all of
+    # the monsters, coins and doors. A world can have one Snapshotter.
+    def __init__(self, world):
+        if getattr(world, 'regions', None) is not None:
+            raise ValueError("Snapshots need a World, not a StreamingWorld.")
+        self.world = world
+        self.monsters = world.all_monsters.sprites()
+        self.coins = world.all_coins.sprites()
+        self.doors = world.doors.sprites()
+        # Insertion numbers in the spatial hash decide which entity a
+        # contact is with, revived entities get their old ones back.
+        self.order = dict(world.entity_hash.order)
+        # Monster -> index of its numbers in a snapshot.
+        self.monster_index = {}
+        for i, monster in enumerate(self.monsters):
+            self.monster_index[monster] = header_size + monster_size * i
+        self.coin_index = {}
+        self.coins_start = header_size + monster_size * len(self.monsters)
+        for i, coin in enumerate(self.coins):
+            self.coin_index[coin] = self.coins_start + i
+        self.doors_start = self.coins_start + len(self.coins)
+        self.fireballs_start = self.doors_start + len(self.doors)
+        # The world as it was at the last capture or restore, kept up to
+        # date by writing only what changed since.
+        self.state = array('d', bytes(8 * self.fireballs_start))
+        world.changed = set()
+        self.write_header()
+        for monster in self.monsters:
+            self.write_monster(monster)
+        for coin in self.coins:
+            self.state[self.coin_index[coin]] = coin.alive()
+        self.write_rest()
+
+    # Stop watching the world's changes.
+    def close(self):
+        self.world.changed = None
+
+    def capture(self):
+        self.update()
+        return self.state[:]
+
+    # Bring self.state up to date. Sleeping monsters only change when they
+    # are checked or wake up, which marks them changed, so only the awake
+    # ones are written every time.
+    def update(self):
+        world = self.world
+        self.write_header()
+        if world.lod is None:
+            moving = world.all_monsters
+        else:
+            moving = world.lod.awake
+        for monster in moving:
+            self.write_monster(monster)
+        monster_index = self.monster_index
+        coin_index = self.coin_index
+        for sprite in world.changed:
+            if sprite in monster_index:
+                self.write_monster(sprite)
+            elif sprite in coin_index:
+                self.state[coin_index[sprite]] = sprite.alive()
+        world.changed.clear()
+        self.write_rest()
+
+    def write_header(self):
+        world = self.world
+        player = world.player
+        pending = world.pending
+        self.state[:header_size] = array('d', (
+            world.ticks, world.lives, world.shoot_count,
+            world.coins_collected, world.accumulator,
+            pending.left, pending.right, pending.jump, pending.shoot,
+            player.x, player.y, player.rect.x, player.rect.y,
+            player.velocity_x, player.velocity_y, player.jumping,
+            player.double_jump_ready, player.shooting_right, player.hit_time,
+            player.ground, player.winning, player.clip))
+
+    # A monster is 0 if it's dead, 1 and its state (see Monster.get_state)
+    # if it's awake, and 2, the state it fell asleep in and the step it did
+    # if it's sleeping (see lod.py).
+    def write_monster(self, monster):
+        i = self.monster_index[monster]
+        if not monster.alive():
+            values = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        elif self.world.lod is not None and monster.asleep is not None:
+            values = (2.0, monster.leg_x, monster.leg_steps, monster.rect.y,
+                      monster.velocity_x, monster.asleep.since)
+        else:
+            values = (1.0,) + tuple(monster.get_state()) + (0.0,)
+        self.state[i:i + monster_size] = array('d', values)
+
+    # Doors and fireballs.
+    def write_rest(self):
+        state = self.state
+        del state[self.doors_start:]
+        state.extend([door.is_open for door in self.doors])
+        fireballs = self.world.all_fireballs.sprites()
+        state.append(len(fireballs))
+        for fireball in fireballs:
+            state.extend((fireball.x, fireball.rect.y, fireball.velocity_x,
+                          fireball.lifetime))
+
+    def restore(self, state):
+        world = self.world
+        self.update()
+        current = self.state
+        player = world.player
+        old_ticks = world.ticks
+        (ticks, lives, shoot_count, coins_collected, world.accumulator,
+         left, right, jump, shoot, player.x, player.y, rect_x, rect_y,
+         player.velocity_x, player.velocity_y, jumping, double_jump_ready,
+         shooting_right, hit_time, ground, winning,
+         clip) = state[:header_size]
+        world.ticks = int(ticks)
+        world.lives = int(lives)
+        world.shoot_count = int(shoot_count)
+        world.coins_collected = int(coins_collected)
+        world.pending = world.pending._make(
+            (bool(left), bool(right), int(jump), int(shoot)))
+        player.rect.x = int(rect_x)
+        player.rect.y = int(rect_y)
+        player.jumping = bool(jumping)
+        player.double_jump_ready = bool(double_jump_ready)
+        player.shooting_right = bool(shooting_right)
+        player.hit_time = int(hit_time)
+        player.ground = int(ground)
+        player.winning = bool(winning)
+        player.clip = int(clip)
+
+        # Monsters and coins the same in both are left as they are.
+        monsters = set()
+        coins = []
+        coins_start = self.coins_start
+        doors_start = self.doors_start
+        for offset in changed_blocks(current.tobytes(), state.tobytes(),
+                                     8 * header_size, 8 * doors_start):
+            for i in range(offset // 8,
+                           min(doors_start, (offset + block_size) // 8)):
+                if state[i] != current[i]:
+                    if i < coins_start:
+                        monsters.add((i - header_size) // monster_size)
+                    else:
+                        coins.append(i)
+        for j in sorted(monsters):
+            i = header_size + monster_size * j
+            self.restore_monster(self.monsters[j], state[i:i + monster_size])
+        for i in coins:
+            coin = self.coins[i - coins_start]
+            if state[i]:
+                if not coin.alive():
+                    world.all_coins.add(coin)
+                    self.rehash(coin, 'coin')
+            elif coin.alive():
+                coin.kill()
+        i = doors_start
+        for door in self.doors:
+            door.is_open = bool(state[i])
+            i += 1
+        for fireball in world.all_fireballs.sprites():
+            fireball.kill()
+        for j in range(int(state[i])):
+            x, y, velocity_x, lifetime = state[i + 1 + 4 * j:i + 5 + 4 * j]
+            fireball = world.fireball_pool.acquire(velocity_x, round(x),
+                                                   int(y))
+            fireball.x = x
+            fireball.lifetime = int(lifetime)
+            world.all_sprites.add(fireball)
+            world.all_fireballs.add(fireball)
+        self.state = state[:]
+        if world.lod is not None:
+            world.lod.jumped(abs(world.ticks - old_ticks))
+
+    def restore_monster(self, monster, values):
+        world = self.world
+        if not values[0]:
+            if monster.alive():
+                monster.kill()
+            return
+        monster_state = (values[1], int(values[2]), int(values[3]), values[4])
+        if not monster.alive():
+            self.revive_monster(monster, monster_state)
+        elif world.lod is not None:
+            world.lod.rouse(monster)
+        monster.set_state(monster_state)
+        if values[0] == 2:
+            world.lod.resume(monster, int(values[5]))
+
+    def revive_monster(self, monster, monster_state):
+        world = self.world
+        if world.monster_store is None:
+            monster.add(world.all_sprites, world.all_monsters)
+            if world.lod is not None:
+                world.lod.add(monster)
+        else:
+            # Gets a new place in the arrays, its old one stays dead.
+            world.monster_store.add(monster, *monster_state)
+            monster.add(world.all_monsters)
+        self.rehash(monster, 'monster')
+
+    def rehash(self, sprite, kind):
+        entity_hash = self.world.entity_hash
+        entity_hash.insert(sprite, kind)
+        entity_hash.order[sprite] = self.order[sprite]
+
+# Offsets from start to end of the blocks of bytes where a and b, of the
+# same length, differ.
+def changed_blocks(a, b, start=0, end=None):
+    if end is None:
+        end = len(a)
+    return [offset for offset in range(start, end, block_size)
+            if a[offset:offset + block_size] != b[offset:offset + block_size]]
+
+def xor(a, b):
+    return (int.from_bytes(a, 'little') ^
+            int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+# Delta from the bytes of a snapshot back to the bytes of the one before it,
+# key: length of key and the zlib compressed offsets and XORs of the blocks
+# that differ. Numbers that changed a little XOR to mostly zero bytes, which
+# compress well. The shorter of the two (fewer fireballs) is padded with
+# zeros.
+def encode_delta(data, key):
+    size = max(len(data), len(key))
+    padded = data.ljust(size, b'\0')
+    padded_key = key.ljust(size, b'\0')
+    parts = []
+    for offset in changed_blocks(padded, padded_key):
+        parts.append(struct.pack('<I', offset))
+        parts.append(xor(padded[offset:offset + block_size],
+                         padded_key[offset:offset + block_size]))
+    return struct.pack('<I', len(key)) + zlib.compress(b''.join(parts), 1)
+
+def decode_delta(data, delta):
+    length, = struct.unpack_from('<I', delta)
+    parts = zlib.decompress(delta[4:])
+    size = max(len(data), length)
+    key = bytearray(data.ljust(size, b'\0'))
+    i = 0
+    while i < len(parts):
+        offset, = struct.unpack_from('<I', parts, i)
+        end = min(offset + block_size, size)
+        block = parts[i + 4:i + 4 + end - offset]
+        key[offset:end] = xor(key[offset:end], block)
+        i += 4 + end - offset
+    return bytes(key[:length])
+
+class SnapshotRing(object):
+
+    # Keeps the latest capacity snapshots.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.latest = None # Bytes of the latest snapshot.
+        self.deltas = deque() # Back from each snapshot, oldest first.
+        self.nbytes = 0 # Size of the deltas.
+
+    def __len__(self):
+        if self.latest is None:
+            return 0
+        return 1 + len(self.deltas)
+
+    def clear(self):
+        self.deltas.clear()
+        self.latest = None
+        self.nbytes = 0
+
+    def push(self, state):
+        data = state.tobytes()
+        if self.latest is not None:
+            delta = encode_delta(data, self.latest)
+            self.deltas.append(delta)
+            self.nbytes += len(delta)
+            if len(self.deltas) >= self.capacity:
+                self.nbytes -= len(self.deltas.popleft())
+        self.latest = data
+
+    # Latest snapshot, taken out of the ring. None if ring is empty.
+    def pop(self):
+        data = self.latest
+        if data is None:
+            return None
+        if self.deltas:
+            delta = self.deltas.pop()
+            self.nbytes -= len(delta)
+            self.latest = decode_delta(data, delta)
+        else:
+            self.latest = None
+        return array('d', data)
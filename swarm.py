@@ -0,0 +1,259 @@
+import numpy as np
+import pygame
+
+import roborun
+
+# Optional structure of arrays store for monsters, needs NumPy.
+# Positions, velocities and alive flags of all monsters live in arrays, and
+# movement and wall bounces run as batched array operations, one call per
+# step for all monsters. Animation frames come from the world's tick count
+# like for all entities, so they need no work per step.
+# Gives the same results as Monster.update, step for step.
+
+class MonsterArray(object):
+
+    # first_clip is the index of the standing clip in world.clips, followed
+    # by moving left and moving right clips. dt is the time step update is
+    # called with.
+    def __init__(self, world, first_clip, animation_speed, dt):
+        self.world = world
+        self.dt = dt
+        self.first_clip = first_clip
+        self.animation_speed = animation_speed
+        self.width, self.height = world.clips[first_clip][0].get_size()
+        self.tile_x = world.tile_grid.tile_x
+        self.tile_y = world.tile_grid.tile_y
+        self.cell_size = world.entity_hash.cell_size
+        self.sprites = []
+        # Arrays have room for more monsters than there are, only the first
+        # len(self.sprites) entries are in use.
+        self.x = np.zeros(16, dtype=np.float64) # Exact, rects are rounded.
+        # Legs from wall to wall like Monster: x is leg_x plus leg_steps
+        # steps.
+        self.leg_x = np.zeros(16, dtype=np.float64)
+        self.leg_steps = np.zeros(16, dtype=np.int64)
+        self.y = np.zeros(16, dtype=np.int64)
+        self.velocity_x = np.zeros(16, dtype=np.float64)
+        self.alive = np.zeros(16, dtype=bool)
+        self.frozen = np.zeros(16, dtype=bool) # Alive but not moving.
+        self.dead = 0
+        self.refresh_tiles()
+
+    def __len__(self):
+        return len(self.sprites) - self.dead
+
+    # Rebuild the solid tile bitmap from the world's tile grid. Must be
+    # called after tiles are added or removed.
+    def refresh_tiles(self):
+        cells = self.world.tile_grid.cells
+        if not cells:
+            self.solid = np.zeros((1, 1), dtype=bool)
+            self.solid_x = self.solid_y = 0
+            return
+        xs = [x for x, y in cells]
+        ys = [y for x, y in cells]
+        self.solid_x = min(xs)
+        self.solid_y = min(ys)
+        self.solid = np.zeros((max(ys) - self.solid_y + 1,
+                               max(xs) - self.solid_x + 1), dtype=bool)
+        self.solid[np.array(ys) - self.solid_y, np.array(xs) - self.solid_x] = True
+
+    # Keep the bitmap up to date when a tile is added or removed. The bitmap
+    # grows with some extra room when a tile is added outside of it.
+    def tile_changed(self, x, y, added):
+        height, width = self.solid.shape
+        row = y - self.solid_y
+        col = x - self.solid_x
+        if 0 <= row < height and 0 <= col < width:
+            self.solid[row, col] = added
+            return
+        if not added:
+            return
+        margin = 64
+        left = min(self.solid_x, x - margin)
+        top = min(self.solid_y, y - margin)
+        right = max(self.solid_x + width, x + margin)
+        bottom = max(self.solid_y + height, y + margin)
+        solid = np.zeros((bottom - top, right - left), dtype=bool)
+        solid[self.solid_y - top:self.solid_y - top + height,
+              self.solid_x - left:self.solid_x - left + width] = self.solid
+        solid[y - top, x - left] = True
+        self.solid = solid
+        self.solid_x = left
+        self.solid_y = top
+
+    def add(self, sprite, leg_x, leg_steps, y, velocity_x):
+        i = len(self.sprites)
+        if i == len(self.x):
+            # Out of room, double the size of the arrays.
+            for name in ('x', 'leg_x', 'leg_steps', 'y', 'velocity_x',
+                         'alive', 'frozen'):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate(
+                    (array, np.zeros_like(array))))
+        sprite.store = self
+        sprite.index = i
+        self.sprites.append(sprite)
+        self.leg_x[i] = leg_x
+        self.leg_steps[i] = leg_steps
+        self.x[i] = leg_x + leg_steps * (velocity_x * self.dt)
+        self.y[i] = y
+        self.velocity_x[i] = velocity_x
+        self.alive[i] = True
+        self.frozen[i] = False
+
+    def remove(self, index):
+        if self.alive[index]:
+            self.alive[index] = False
+            self.dead += 1
+        # Drop dead monsters from the arrays once they are the majority.
+        if self.dead * 2 > len(self.sprites):
+            self.compact()
+
+    def compact(self):
+        n = len(self.sprites)
+        keep = self.alive[:n].copy()
+        self.sprites = [sprite for sprite, alive in zip(self.sprites, keep)
+                        if alive]
+        for i, sprite in enumerate(self.sprites):
+            sprite.index = i
+        for name in ('x', 'leg_x', 'leg_steps', 'y', 'velocity_x', 'alive',
+                     'frozen'):
+            array = getattr(self, name)
+            kept = array[:n][keep]
+            array[:len(kept)] = kept
+        self.dead = 0
+
+    # Is there a tile in grid cells (rows, cols)? Cells outside the bitmap
+    # are empty.
+    def is_solid(self, rows, cols):
+        rows = rows - self.solid_y
+        cols = cols - self.solid_x
+        height, width = self.solid.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        return inside & self.solid[np.clip(rows, 0, height - 1),
+                                   np.clip(cols, 0, width - 1)]
+
+    def update(self, dt):
+        n = len(self.sprites)
+        if n == 0:
+            return
+        old_x = self.x[:n]
+        old_velocity_x = self.velocity_x[:n]
+        old_leg_x = self.leg_x[:n]
+        old_leg_steps = self.leg_steps[:n]
+        moving = self.alive[:n] & ~self.frozen[:n]
+        y = self.y[:n]
+
+        # Moving in x direction. Collisions use the position rounded to
+        # whole pixels like the rect of Monster.
+        leg_steps = old_leg_steps + 1
+        x = old_leg_x + leg_steps * (old_velocity_x * dt)
+        rect_x = np.round(x).astype(np.int64)
+        velocity_x = old_velocity_x
+
+        # Collision detection in x direction. Covered cells are checked in
+        # the same row by row order as TileGrid.collide_any.
+        left = rect_x // self.tile_x
+        right = (rect_x + self.width - 1) // self.tile_x
+        top = y // self.tile_y
+        bottom = (y + self.height - 1) // self.tile_y
+        candidates = [(top, left), (top, right), (bottom, left), (bottom, right)]
+        hits = [self.is_solid(rows, cols) for rows, cols in candidates]
+        tile_row = np.select(hits, [rows for rows, cols in candidates])
+        tile_col = np.select(hits, [cols for rows, cols in candidates])
+        hit = hits[0] | hits[1] | hits[2] | hits[3]
+        tile_top = tile_row * self.tile_y
+        tile_left = tile_col * self.tile_x
+        bounce = hit & (y + self.height != tile_top)
+        # Hitting wall from left.
+        from_left = bounce & (velocity_x > 0)
+        # Hitting wall from right.
+        from_right = bounce & (velocity_x < 0)
+        rect_x = np.where(from_left, tile_left - self.width, rect_x)
+        rect_x = np.where(from_right, tile_left + self.tile_x, rect_x)
+        turned = from_left | from_right
+        x = np.where(turned, rect_x, x)
+        leg_x = np.where(turned, x, old_leg_x)
+        leg_steps = np.where(turned, 0, leg_steps)
+        velocity_x = np.where(turned, -velocity_x, velocity_x)
+
+        # Re-hash only monsters that moved to other cells.
+        size = self.cell_size
+        width = self.width
+        old_rect_x = np.round(old_x).astype(np.int64)
+        moved = moving & ((rect_x // size != old_rect_x // size) |
+                          ((rect_x + width - 1) // size !=
+                           (old_rect_x + width - 1) // size))
+
+        # Dead and frozen monsters keep their state.
+        self.x[:n] = np.where(moving, x, old_x)
+        self.leg_x[:n] = np.where(moving, leg_x, old_leg_x)
+        self.leg_steps[:n] = np.where(moving, leg_steps, old_leg_steps)
+        self.velocity_x[:n] = np.where(moving, velocity_x, old_velocity_x)
+
+        entity_hash = self.world.entity_hash
+        for i in np.flatnonzero(moved):
+            entity_hash.move(self.sprites[i])
+
+# Monster sprite whose state lives in a MonsterArray. rect and image are
+# made from the arrays when asked, so only monsters near the player or in
+# the camera view cost any Python work.
+class ArrayMonster(roborun.LightSprite):
+
+    __slots__ = ('world', 'store', 'index')
+
+    def __init__(self, world, store, x_location, y_location, velocity_x):
+        roborun.LightSprite.__init__(self)
+        self.world = world
+        store.add(self, float(x_location), 0, y_location, float(velocity_x))
+
+    @property
+    def rect(self):
+        store = self.store
+        return pygame.Rect(round(float(store.x[self.index])),
+                           int(store.y[self.index]), store.width, store.height)
+
+    @property
+    def image(self):
+        store = self.store
+        velocity_x = store.velocity_x[self.index]
+        clip = store.first_clip
+        if velocity_x < 0:
+            clip += 1
+        elif velocity_x > 0:
+            clip += 2
+        frames = self.world.clips[clip]
+        return frames[self.world.ticks // store.animation_speed % len(frames)]
+
+    @property
+    def velocity_x(self):
+        return float(self.store.velocity_x[self.index])
+
+    # Leg start, steps into the leg, y and velocity, for saving and
+    # restoring, like Monster.
+    def get_state(self):
+        store = self.store
+        i = self.index
+        return (float(store.leg_x[i]), int(store.leg_steps[i]),
+                int(store.y[i]), float(store.velocity_x[i]))
+
+    def set_state(self, state):
+        store = self.store
+        i = self.index
+        leg_x, leg_steps, y, velocity_x = state
+        store.leg_x[i] = leg_x
+        store.leg_steps[i] = leg_steps
+        store.x[i] = leg_x + leg_steps * (velocity_x * store.dt)
+        store.y[i] = y
+        store.velocity_x[i] = velocity_x
+        self.world.entity_hash.move(self)
+
+    def update(self, dt):
+        pass
+
+    def kill(self):
+        self.world.entity_hash.remove(self)
+        self.store.remove(self.index)
+        self.world.mark_changed(self)
+        pygame.sprite.Sprite.kill(self)
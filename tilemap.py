@@ -0,0 +1,133 @@
+import pygame
+
+# Static geometry renderer for the platform tiles.
+# Tiles are baked into chunk surfaces of chunk_size x chunk_size tiles, so
+# drawing the world costs one blit per visible chunk instead of one per tile.
+# A chunk is re-baked only after tiles inside it have been added or removed.
+
+chunk_size = 16 # Tiles per chunk side.
+colorkey = (255, 0, 255) # Empty chunk area when baking without alpha.
+
+class TileChunks(object):
+
+    def __init__(self, tile_image, tile_x, tile_y, chunk_size=chunk_size):
+        self.tile_image = tile_image
+        self.tile_x = tile_x
+        self.tile_y = tile_y
+        self.chunk_size = chunk_size
+        self.chunk_width = tile_x * chunk_size
+        self.chunk_height = tile_y * chunk_size
+        self.cells = {} # Chunk key (cx, cy) -> set of tile cells (x, y).
+        self.surfaces = {} # Chunk key -> baked surface.
+        self.dirty = set() # Chunks waiting to be (re)baked.
+        self.bakes = 0 # Total amount of chunk bakes, for measuring.
+        # If the tile has no half transparent pixels, chunks are baked with
+        # an RLE colorkey instead of per pixel alpha, which is much cheaper
+        # to blit since empty runs are skipped entirely.
+        self.use_colorkey = (
+            pygame.mask.from_surface(tile_image, 0).count() ==
+            pygame.mask.from_surface(tile_image, 254).count())
+
+    def chunk_key(self, x, y):
+        return (x // self.chunk_size, y // self.chunk_size)
+
+    # Add tile to grid cell (x, y), coordinates in tiles.
+    def add(self, x, y):
+        key = self.chunk_key(x, y)
+        self.cells.setdefault(key, set()).add((x, y))
+        self.dirty.add(key)
+
+    # Remove tile from grid cell (x, y), coordinates in tiles.
+    def remove(self, x, y):
+        key = self.chunk_key(x, y)
+        cells = self.cells.get(key)
+        if cells is None or (x, y) not in cells:
+            return
+        cells.discard((x, y))
+        if not cells:
+            del self.cells[key]
+            self.surfaces.pop(key, None)
+            self.dirty.discard(key)
+        else:
+            self.dirty.add(key)
+
+    def clear(self):
+        self.cells.clear()
+        self.surfaces.clear()
+        self.dirty.clear()
+
+    def bake(self, key):
+        left = key[0] * self.chunk_size
+        top = key[1] * self.chunk_size
+        size = (self.chunk_width, self.chunk_height)
+        has_display = pygame.display.get_surface() is not None
+        if self.use_colorkey:
+            surface = pygame.Surface(size)
+            surface.fill(colorkey)
+            for x, y in self.cells[key]:
+                surface.blit(self.tile_image,
+                             ((x - left) * self.tile_x, (y - top) * self.tile_y))
+            surface.set_colorkey(colorkey, pygame.RLEACCEL)
+            if has_display:
+                surface = surface.convert()
+        else:
+            surface = pygame.Surface(size, pygame.SRCALPHA)
+            surface.fill((0, 0, 0, 0))
+            # Tiles never overlap, so BLEND_RGBA_MAX onto an empty chunk
+            # copies the tile pixels exactly, alpha included.
+            for x, y in self.cells[key]:
+                surface.blit(self.tile_image,
+                             ((x - left) * self.tile_x, (y - top) * self.tile_y),
+                             special_flags=pygame.BLEND_RGBA_MAX)
+            if has_display:
+                surface = surface.convert_alpha()
+        self.surfaces[key] = surface
+        self.bakes += 1
+
+    # Bake dirty chunks intersecting area (a rect in world pixels) ahead of
+    # drawing, so the first frames showing them don't have to.
+    def bake_area(self, area):
+        for cy in range(area.top // self.chunk_height,
+                        (area.bottom - 1) // self.chunk_height + 1):
+            for cx in range(area.left // self.chunk_width,
+                            (area.right - 1) // self.chunk_width + 1):
+                key = (cx, cy)
+                if key in self.dirty:
+                    self.bake(key)
+                    self.dirty.discard(key)
+
+    # Blit chunks intersecting the view to window. camera_state is the
+    # Camera.state rect whose topleft is the offset applied to the world.
+    # Returns amount of blits done.
+    def draw(self, window, camera_state):
+        view_width, view_height = window.get_size()
+        view_x = -camera_state.x
+        view_y = -camera_state.y
+        first_cx = view_x // self.chunk_width
+        first_cy = view_y // self.chunk_height
+        last_cx = (view_x + view_width - 1) // self.chunk_width
+        last_cy = (view_y + view_height - 1) // self.chunk_height
+        blits = 0
+        for cy in range(first_cy, last_cy + 1):
+            for cx in range(first_cx, last_cx + 1):
+                key = (cx, cy)
+                if key not in self.cells:
+                    continue
+                if key in self.dirty:
+                    self.bake(key)
+                    self.dirty.discard(key)
+                # Blit only the part of the chunk inside the view.
+                chunk_x = cx * self.chunk_width
+                chunk_y = cy * self.chunk_height
+                area = pygame.Rect(
+                    max(0, view_x - chunk_x), max(0, view_y - chunk_y),
+                    self.chunk_width, self.chunk_height)
+                area.width = min(area.width, view_x + view_width - chunk_x
+                                 - area.x)
+                area.height = min(area.height, view_y + view_height - chunk_y
+                                  - area.y)
+                window.blit(self.surfaces[key],
+                            (chunk_x + area.x + camera_state.x,
+                             chunk_y + area.y + camera_state.y), area)
+                blits += 1
+        return blits